@@ -0,0 +1,208 @@
+"""
+A ColorMatrix that keeps its cells in NumPy arrays: an H x W x 4 array of
+floats for the colors, and an H x W array of booleans that is False where a
+cell is None. Filling from a list or another matrix, rectangle fills,
+find_replace, conversion between logical and raw units, and the clamping
+and rounding in get_colors work on whole arrays at once.
+
+NumPy is optional. Without it, matrix_class() falls back to ColorMatrix.
+"""
+
+import logging
+
+from bardolph.controller.color_matrix import ColorMatrix, Rect
+from bardolph.controller.units import UnitMode
+from bardolph.lib import i_lib
+from bardolph.lib.injection import inject
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+class ArrayMatrix(ColorMatrix):
+    def __init__(self, height, width):
+        self._height = height
+        self._width = width
+        self._colors = numpy.zeros((height, width, 4), dtype=numpy.float64)
+        self._valid = numpy.ones((height, width), dtype=bool)
+        self._scratch = numpy.empty((height, width, 4), dtype=numpy.float64)
+
+    def __str__(self):
+        return str(ColorMatrix.new_from_iterable(
+            self._height, self._width, self.as_list()))
+
+    @property
+    def matrix(self):
+        cells = self.as_list()
+        return [cells[row * self._width:(row + 1) * self._width]
+                for row in range(0, self._height)]
+
+    def set_from_iterable(self, srce):
+        it = iter(srce)
+        self._set_section(slice(None), slice(None), [
+            next(it) for _ in range(0, self._height * self._width)])
+        return self
+
+    def set_from_constant(self, value):
+        self._fill(slice(None), slice(None), value)
+        return self
+
+    def set_from_matrix(self, srce):
+        if isinstance(srce, ArrayMatrix):
+            self._colors[:] = srce._colors
+            self._valid[:] = srce._valid
+            return self
+        return self.set_from_iterable(srce.as_list())
+
+    def get_raw_array(self):
+        """
+        The colors clamped to 0..65535 and rounded, as an H x W x 4 array of
+        unsigned 16-bit integers. Cells that are None come out as zero.
+        """
+        raw = numpy.rint(numpy.clip(self._colors, 0.0, 65535.0))
+        raw[~self._valid] = 0
+        return raw.astype(numpy.uint16)
+
+    def get_valid_mask(self):
+        return self._valid.copy()
+
+    def is_complete(self) -> bool:
+        return bool(self._valid.all())
+
+    def pack_into(self, buffer, offset, top, left, height, width) -> None:
+        # The section is converted in place, straight into the buffer.
+        dest = numpy.ndarray(
+            (height, width, 4), dtype='<u2', buffer=buffer, offset=offset)
+        section = (slice(top, top + height), slice(left, left + width))
+        scratch = self._scratch[:height, :width]
+        numpy.clip(self._colors[section], 0.0, 65535.0, out=scratch)
+        numpy.rint(scratch, out=scratch)
+        dest[...] = scratch
+        dest[~self._valid[section]] = 0
+
+    def get_colors(self):
+        colors = self.get_raw_array().reshape(-1, 4).tolist()
+        if not self._valid.all():
+            for index in numpy.flatnonzero(~self._valid):
+                colors[index] = None
+        return colors
+
+    def find_replace(self, to_find, replacement):
+        if to_find is None:
+            mask = ~self._valid
+        else:
+            mask = self._valid & numpy.all(
+                self._colors == numpy.asarray(to_find, dtype=numpy.float64),
+                axis=2)
+        if replacement is None:
+            self._valid[mask] = False
+        else:
+            self._colors[mask] = replacement
+            self._valid[mask] = True
+
+    def as_list(self):
+        colors = self._colors.reshape(-1, 4).tolist()
+        for index in numpy.flatnonzero(~self._valid):
+            colors[index] = None
+        return colors
+
+    def overlay_color(self, rect: Rect, color) -> None:
+        # Set the cells within rect to color.
+        self._normalize_rect(rect)
+        self._fill(
+            slice(rect.top, rect.bottom + 1),
+            slice(rect.left, rect.right + 1),
+            color)
+
+    def overlay_section(self, rect: Rect, srce) -> None:
+        # Copy the contents of srce into the section.
+        self._normalize_rect(rect)
+        self._set_section(
+            slice(rect.top, rect.bottom + 1),
+            slice(rect.left, rect.right + 1),
+            [color for row in srce[rect.top:rect.bottom + 1]
+             for color in row[rect.left:rect.right + 1]])
+
+    def convert_units(self, srce_mode, dest_mode):
+        convert = _CONVERSIONS.get((srce_mode, dest_mode))
+        if convert is None:
+            return super().convert_units(srce_mode, dest_mode)
+        # Clamped and rounded first, the same as get_colors().
+        result = ArrayMatrix(self._height, self._width)
+        numpy.clip(self._colors, 0.0, 65535.0, out=result._colors)
+        numpy.rint(result._colors, out=result._colors)
+        convert(result._colors)
+        result._valid[:] = self._valid
+        return result
+
+    def _fill(self, rows, columns, color) -> None:
+        if color is None:
+            self._valid[rows, columns] = False
+        else:
+            self._colors[rows, columns] = color
+            self._valid[rows, columns] = True
+
+    def _set_section(self, rows, columns, cells) -> None:
+        # cells is a flat list of the section's colors, row by row.
+        colors = self._colors[rows, columns]
+        valid = numpy.fromiter(
+            (color is not None for color in cells), dtype=bool,
+            count=len(cells)).reshape(colors.shape[:2])
+        if valid.all():
+            colors[...] = numpy.asarray(cells, dtype=numpy.float64).reshape(
+                colors.shape)
+        elif valid.any():
+            colors[valid] = [color for color in cells if color is not None]
+        self._valid[rows, columns] = valid
+
+
+def _logical_to_raw(colors) -> None:
+    # In place, on colors that have already been rounded. That makes the
+    # special cases in units.logical_to_raw unnecessary: a hue of 360 or a
+    # percentage of zero comes out as zero anyway.
+    hue = colors[..., 0]
+    numpy.mod(hue, 360.0, out=hue)
+    hue /= 360.0
+    hue *= 65535.0
+    percentages = colors[..., 1:3]
+    percentages /= 100.0
+    percentages *= 65535.0
+
+
+def _raw_to_logical(colors) -> None:
+    # In place, on colors that have already been clamped.
+    hue = colors[..., 0]
+    hue /= 65535.0
+    hue *= 360.0
+    percentages = colors[..., 1:3]
+    percentages /= 65535.0
+    percentages *= 100.0
+
+
+_CONVERSIONS = {
+    (UnitMode.LOGICAL, UnitMode.RAW): _logical_to_raw,
+    (UnitMode.RAW, UnitMode.LOGICAL): _raw_to_logical
+}
+
+
+_warned = False
+
+
+@inject(i_lib.Settings)
+def matrix_class(settings):
+    """
+    ArrayMatrix if the use_array_matrix setting is True and NumPy is
+    available, otherwise ColorMatrix.
+    """
+    global _warned
+    if not settings.get_value('use_array_matrix', False):
+        return ColorMatrix
+    if numpy is None:
+        if not _warned:
+            logging.warning(
+                'NumPy is not installed; using list-based matrices.')
+            _warned = True
+        return ColorMatrix
+    return ArrayMatrix
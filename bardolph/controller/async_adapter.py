@@ -0,0 +1,229 @@
+"""
+Synchronous wrappers for the classes in async_lan_api, so that the Machine
+and the rest of the controller can use them like any other LightApi.
+
+All of the coroutines run on one event loop, in a daemon thread of its own.
+A call from any other thread is handed to that loop and waits for the
+result.
+"""
+
+import asyncio
+import logging
+import queue
+import threading
+import time
+
+from bardolph.controller import async_lan_api, delivery, i_controller, light
+from bardolph.controller import lan_protocol
+from bardolph.controller.async_lan_api import LanTimeout
+from bardolph.lib import i_lib
+from bardolph.lib.injection import bind_instance, inject
+from bardolph.lib.param_helper import param_16, param_32, param_color
+from bardolph.lib.retry import tries
+
+_MAX_TRIES = 2
+
+
+class EventLoopThread:
+    def __init__(self):
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(
+            target=self._loop.run_forever, name='lan-event-loop', daemon=True)
+        self._thread.start()
+
+    def submit(self, coro):
+        # Start the coroutine on the loop and return a Future for its result.
+        return asyncio.run_coroutine_threadsafe(coro, self._loop)
+
+    def run(self, coro, timeout=None):
+        # Run the coroutine on the loop and wait for its result.
+        return self.submit(coro).result(timeout)
+
+    def stop(self) -> None:
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self._loop.close()
+
+
+class SyncLight(light.Light):
+    def __init__(self, impl, loop):
+        super().__init__(
+            hash(impl.get_mac_addr()), impl.get_name(), impl.get_group(),
+            impl.get_location())
+        self._impl = impl
+        self._loop = loop
+        self._delivery = None
+        self.product_features = impl.product_features
+
+    def is_color(self):
+        return self._impl.is_color()
+
+    def get_delivery(self) -> delivery.Delivery:
+        if self._delivery is not None:
+            return self._delivery
+        return delivery.default_delivery(self.get_name())
+
+    def set_delivery(self, new_delivery) -> None:
+        # None reverts to the delivery in the settings.
+        self._delivery = new_delivery
+
+    def _deliver(self, write) -> None:
+        # write(ack) returns the coroutine that sends the write once.
+        mode = self.get_delivery()
+        start = time.perf_counter()
+        try:
+            for _ in range(0, mode.repeats):
+                self._loop.run(write(mode.acked))
+        except LanTimeout:
+            delivery.the_stats.record(
+                mode, time.perf_counter() - start, mode.acked)
+            raise
+        delivery.the_stats.record(mode, time.perf_counter() - start)
+
+    @tries(_MAX_TRIES, LanTimeout, [-1] * 4)
+    def get_color(self):
+        return self._loop.run(self._impl.get_color())
+
+    @tries(_MAX_TRIES, LanTimeout)
+    def set_color(self, color, duration):
+        color = param_color(color)
+        duration = param_32(duration)
+        self._deliver(
+            lambda ack: self._impl.set_color(color, duration, ack))
+
+    @tries(_MAX_TRIES, LanTimeout)
+    def get_power(self) -> int:
+        return self._loop.run(self._impl.get_power())
+
+    @tries(_MAX_TRIES, LanTimeout)
+    def set_power(self, power, duration):
+        power = param_16(power)
+        duration = param_32(duration)
+        self._deliver(
+            lambda ack: self._impl.set_power(power, duration, ack))
+
+
+class SyncMultizoneLight(SyncLight, i_controller.MultizoneLight):
+    def get_height(self) -> int:
+        return 1
+
+    def get_width(self) -> int:
+        return self._impl.get_num_zones()
+
+    @tries(_MAX_TRIES, LanTimeout)
+    def get_zone_colors(self, first_zone=None, last_zone=None):
+        return self._loop.run(
+            self._impl.get_zone_colors(first_zone, last_zone))
+
+    def set_zone_colors(self, first_zone, last_zone, color, duration) -> None:
+        self.set_zone_list(
+            first_zone, [color] * (last_zone - first_zone), duration)
+
+    @tries(_MAX_TRIES, LanTimeout)
+    def set_zone_list(self, first_zone, colors, duration) -> None:
+        first_zone = param_16(first_zone)
+        colors = [None if color is None else param_color(color)
+                  for color in colors]
+        duration = param_32(duration)
+        self._deliver(lambda ack: self._impl.set_zone_list(
+            first_zone, colors, duration, ack))
+
+
+class SyncMatrixLight(SyncLight, i_controller.MatrixLight):
+    def get_height(self) -> int:
+        return self._impl.get_height()
+
+    def get_width(self) -> int:
+        return self._impl.get_width()
+
+    def get_tiles(self) -> list:
+        return self._impl.get_tiles()
+
+    @tries(_MAX_TRIES, LanTimeout)
+    def get_matrix(self):
+        return self._loop.run(self._impl.get_matrix())
+
+    @tries(_MAX_TRIES, LanTimeout)
+    def set_matrix(self, matrix, duration=0) -> None:
+        duration = param_32(duration)
+        self._deliver(
+            lambda ack: self._impl.set_matrix(matrix, duration, ack))
+
+
+def _sync_light(impl, loop):
+    if isinstance(impl, async_lan_api.AsyncMultizoneLight):
+        return SyncMultizoneLight(impl, loop)
+    if isinstance(impl, async_lan_api.AsyncMatrixLight):
+        return SyncMatrixLight(impl, loop)
+    return SyncLight(impl, loop)
+
+
+def parse_address(text, default_port=lan_protocol.DEFAULT_PORT):
+    # "host" or "host:port" to a (host, port) tuple.
+    host, _, port = str(text).partition(':')
+    return host, int(port) if port else default_port
+
+
+class SyncLightApi(i_controller.LightApi):
+    """
+    A LightApi on top of async_lan_api.AsyncLightApi. The lan_broadcast
+    setting is where discovery is sent, as "address" or "address:port".
+    """
+    @inject(i_lib.Settings)
+    def __init__(self, settings):
+        self._loop = EventLoopThread()
+        self._endpoint = async_lan_api.LanEndpoint()
+        self._loop.run(self._endpoint.open())
+        broadcast = parse_address(
+            settings.get_value('lan_broadcast', '255.255.255.255'))
+        self._api = async_lan_api.AsyncLightApi(self._endpoint, broadcast)
+        self._discovery_time = float(
+            settings.get_value('lan_discovery_time', 1.0))
+
+    def close(self) -> None:
+        self._loop.run(self._close())
+        self._loop.stop()
+
+    async def _close(self):
+        self._endpoint.close()
+
+    def get_lights(self):
+        """
+        Generator: each light is yielded as soon as it has been built. The
+        discovery itself runs on the event loop, which passes the lights
+        back through a queue.
+        """
+        lights = queue.Queue()
+        done = object()
+
+        async def discover():
+            try:
+                async for impl in self._api.get_lights(self._discovery_time):
+                    lights.put(impl)
+            except Exception as ex:
+                lights.put(ex)
+            lights.put(done)
+
+        self._loop.submit(discover())
+        while True:
+            impl = lights.get()
+            if impl is done:
+                return
+            if isinstance(impl, LanTimeout):
+                logging.error('In get_lights(): {}'.format(impl))
+                raise i_controller.LightException(impl)
+            if isinstance(impl, Exception):
+                raise impl
+            yield _sync_light(impl, self._loop)
+
+    def set_color_all_lights(self, color, duration):
+        self._loop.run(self._api.set_color_all_lights(
+            param_color(color), param_32(duration)))
+
+    def set_power_all_lights(self, power_level, duration):
+        self._loop.run(self._api.set_power_all_lights(
+            param_16(power_level), param_32(duration)))
+
+
+def configure():
+    bind_instance(SyncLightApi()).to(i_controller.LightApi)
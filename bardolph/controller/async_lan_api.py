@@ -0,0 +1,458 @@
+"""
+An asyncio implementation of the LIFX LAN protocol. One LanEndpoint, a
+single UDP socket, carries the traffic for every light. Each outgoing message
+gets a sequence number, and responses are matched to their requests by the
+device's MAC address and that sequence number, so any number of requests
+can be waiting at the same time without a thread for each.
+
+The classes here are coroutine-based. async_adapter wraps them for the
+synchronous Machine.
+"""
+
+import asyncio
+import logging
+import random
+
+from lifxlan.products import features_map
+
+from bardolph.controller import i_controller
+from bardolph.controller import lan_protocol as lp
+from bardolph.controller.color_matrix import ColorMatrix
+
+DEFAULT_TIMEOUT = 0.5  # seconds for each attempt
+DEFAULT_ATTEMPTS = 2
+_PROBE_TIMEOUT = 0.25
+
+
+class LanTimeout(i_controller.LightException):
+    pass
+
+
+class _Exchange:
+    # The responses to one request, collected until done(responses) is True.
+    def __init__(self, response_types, done):
+        self.response_types = response_types
+        self.responses = []
+        self._done = done
+        self.future = asyncio.get_running_loop().create_future()
+
+    def receive(self, header, payload, address) -> None:
+        if header.msg_type not in self.response_types or self.future.done():
+            return
+        try:
+            fields = lp.decode(header.msg_type, payload)
+        except lp.ProtocolError as ex:
+            logging.debug('Bad response from {}: {}'.format(address, ex))
+            return
+        self.responses.append((header, fields, address))
+        if self._done is not None and self._done(self.responses):
+            self.future.set_result(self.responses)
+
+
+class LanEndpoint(asyncio.DatagramProtocol):
+    def __init__(self, source_id=None):
+        self._source = source_id or random.randrange(2, 1 << 32)
+        self._transport = None
+        self._sequences = {}
+        self._pending = {}
+
+    async def open(self, local_addr=('0.0.0.0', 0)) -> None:
+        loop = asyncio.get_running_loop()
+        await loop.create_datagram_endpoint(
+            lambda: self, local_addr=local_addr, allow_broadcast=True)
+
+    def close(self) -> None:
+        if self._transport is not None:
+            self._transport.close()
+            self._transport = None
+
+    def get_source(self) -> int:
+        return self._source
+
+    def connection_made(self, transport) -> None:
+        self._transport = transport
+
+    def datagram_received(self, data, address) -> None:
+        try:
+            header, payload = lp.unpack_message(data)
+        except lp.ProtocolError as ex:
+            logging.debug('From {}: {}'.format(address, ex))
+            return
+        if header.source != self._source:
+            return
+        exchange = self._pending.get((header.target, header.sequence))
+        if exchange is None:
+            # A response to a broadcast.
+            exchange = self._pending.get((None, header.sequence))
+        if exchange is not None:
+            exchange.receive(header, payload, address)
+
+    def error_received(self, ex) -> None:
+        logging.debug('LanEndpoint: {}'.format(ex))
+
+    def _next_sequence(self, target) -> int:
+        # Sequence numbers are per device, skipping any that are in use.
+        sequence = self._sequences.get(target, 0)
+        for _ in range(0, 256):
+            sequence = (sequence + 1) & 0xff
+            if (target, sequence) not in self._pending:
+                break
+        self._sequences[target] = sequence
+        return sequence
+
+    def send(self, address, target, msg_type, payload=b'',
+             ack_required=False, res_required=False, sequence=None) -> int:
+        """
+        Send one message without waiting for anything. If target is None,
+        the message is tagged, for every device that receives it. Returns
+        the sequence number.
+        """
+        if sequence is None:
+            sequence = self._next_sequence(target)
+        self._transport.sendto(lp.pack_message(
+            msg_type, payload, target, self._source, sequence, ack_required,
+            res_required), address)
+        return sequence
+
+    async def request(self, address, target, msg_type, payload=b'',
+                      response_types=(lp.ACKNOWLEDGEMENT,), done=None,
+                      timeout=DEFAULT_TIMEOUT, attempts=DEFAULT_ATTEMPTS):
+        """
+        Send a message and collect the responses of the given types, each a
+        (header, fields, address) tuple.
+
+        done(responses) says when enough responses have arrived. By default,
+        one is enough. If done is False, responses are collected until the
+        timeout, which is how a broadcast finds every device.
+
+        Raises LanTimeout if the responses aren't complete after every
+        attempt.
+        """
+        if done is None:
+            done = len
+        elif done is False:
+            done = None
+        ack_required = lp.ACKNOWLEDGEMENT in response_types
+        sequence = self._next_sequence(target)
+        exchange = _Exchange(frozenset(response_types), done)
+        self._pending[(target, sequence)] = exchange
+        try:
+            for _ in range(0, attempts):
+                self.send(address, target, msg_type, payload, ack_required,
+                          not ack_required, sequence)
+                try:
+                    return await asyncio.wait_for(
+                        asyncio.shield(exchange.future), timeout)
+                except asyncio.TimeoutError:
+                    if done is None:
+                        return exchange.responses
+        finally:
+            del self._pending[(target, sequence)]
+        raise LanTimeout('No response from {} to message type {}'.format(
+            target or address, msg_type))
+
+
+class AsyncLight:
+    """
+    A light on the network. Writes are sent without waiting, unless ack is
+    True, in which case they wait for the light to acknowledge them.
+    """
+    def __init__(self, endpoint, mac_addr, address, info):
+        self._endpoint = endpoint
+        self._mac_addr = mac_addr
+        self._address = address
+        self._label = info.get('label', '')
+        self._group = info.get('group', '')
+        self._location = info.get('location', '')
+        self._product = info.get('product')
+        self.product_features = info.get('features') or features_map[None]
+
+    def get_mac_addr(self) -> str:
+        return self._mac_addr
+
+    def get_address(self):
+        return self._address
+
+    def get_name(self) -> str:
+        return self._label
+
+    def get_group(self) -> str:
+        return self._group
+
+    def get_location(self) -> str:
+        return self._location
+
+    def get_product(self):
+        return self._product
+
+    def is_color(self) -> bool:
+        return self.product_features.get('color', False)
+
+    async def _get(self, msg_type, response_type, fields=None, done=None):
+        payload = lp.encode(msg_type, **(fields or {}))
+        return await self._endpoint.request(
+            self._address, self._mac_addr, msg_type, payload,
+            (response_type,) if isinstance(response_type, int)
+            else response_type, done)
+
+    async def _set(self, msg_type, fields, ack) -> None:
+        payload = lp.encode(msg_type, **fields)
+        if ack:
+            await self._endpoint.request(
+                self._address, self._mac_addr, msg_type, payload)
+        else:
+            self._endpoint.send(
+                self._address, self._mac_addr, msg_type, payload)
+
+    async def get_state(self) -> dict:
+        # Color, power and label in one request.
+        return (await self._get(lp.LIGHT_GET, lp.LIGHT_STATE))[0][1]
+
+    async def get_color(self) -> list:
+        return (await self.get_state())['color']
+
+    async def set_color(self, color, duration, ack=False) -> None:
+        await self._set(
+            lp.LIGHT_SET_COLOR, {'color': color, 'duration': duration}, ack)
+
+    async def get_power(self) -> int:
+        responses = await self._get(lp.LIGHT_GET_POWER, lp.LIGHT_STATE_POWER)
+        return responses[0][1]['level']
+
+    async def set_power(self, power, duration, ack=False) -> None:
+        await self._set(
+            lp.LIGHT_SET_POWER, {'level': power, 'duration': duration}, ack)
+
+
+class AsyncMultizoneLight(AsyncLight):
+    def __init__(self, endpoint, mac_addr, address, info):
+        super().__init__(endpoint, mac_addr, address, info)
+        self._num_zones = info.get('num_zones', 0)
+        self._extended = info.get('extended_multizone', False)
+
+    def get_num_zones(self) -> int:
+        return self._num_zones
+
+    def is_extended(self) -> bool:
+        return self._extended
+
+    async def probe(self) -> None:
+        """
+        Find out how many zones there are and whether the light supports the
+        extended messages, by trying them first.
+        """
+        try:
+            responses = await self._endpoint.request(
+                self._address, self._mac_addr, lp.GET_EXTENDED_COLOR_ZONES,
+                b'', (lp.STATE_EXTENDED_COLOR_ZONES,),
+                timeout=_PROBE_TIMEOUT, attempts=1)
+            self._extended = True
+            self._num_zones = responses[0][1]['count']
+        except LanTimeout:
+            self._extended = False
+            self._num_zones = len(await self.get_zone_colors())
+
+    async def get_zone_colors(self, first_zone=None, last_zone=None) -> list:
+        # Zones first_zone up to, but not including, last_zone.
+        def done(responses):
+            count = responses[0][1]['count']
+            indexes = set()
+            for _, fields, _ in responses:
+                indexes.update(range(
+                    fields['index'], fields['index'] + len(fields['colors'])))
+            return all(index in indexes for index in range(0, count))
+
+        responses = await self._get(
+            lp.GET_COLOR_ZONES, (lp.STATE_ZONE, lp.STATE_MULTI_ZONE),
+            {'start_index': 0, 'end_index': 255}, done)
+        count = responses[0][1]['count']
+        zones = [None] * count
+        for _, fields, _ in responses:
+            for offset, color in enumerate(fields['colors']):
+                if fields['index'] + offset < count:
+                    zones[fields['index'] + offset] = color
+        self._num_zones = count
+        return zones[first_zone:last_zone]
+
+    async def set_zone_colors(self, first_zone, last_zone, color, duration,
+                              ack=False) -> None:
+        await self.set_zone_list(
+            first_zone, [color] * (last_zone - first_zone), duration, ack)
+
+    async def set_zone_list(self, first_zone, colors, duration,
+                            ack=False) -> None:
+        """
+        Set consecutive zones, starting with first_zone. A zone whose color
+        is None is left alone.
+        """
+        runs = []
+        for offset, color in enumerate(colors):
+            zone = first_zone + offset
+            if color is None:
+                continue
+            if self._extended:
+                if len(runs) > 0 and runs[-1][0] + len(runs[-1][1]) == zone:
+                    runs[-1][1].append(color)
+                else:
+                    runs.append([zone, [color]])
+            elif (len(runs) > 0 and runs[-1][1] == zone - 1
+                    and runs[-1][2] == color):
+                runs[-1][1] = zone
+            else:
+                runs.append([zone, zone, color])
+        sends = []
+        for index, run in enumerate(runs):
+            apply = 1 if index == len(runs) - 1 else 0
+            if self._extended:
+                start, run_colors = run
+                for chunk in range(0, len(run_colors), lp.MAX_EXTENDED_ZONES):
+                    sends.append(self._set(lp.SET_EXTENDED_COLOR_ZONES, {
+                        'duration': duration, 'index': start + chunk,
+                        'apply': apply,
+                        'colors': run_colors[
+                            chunk:chunk + lp.MAX_EXTENDED_ZONES]
+                    }, ack))
+            else:
+                start, end, color = run
+                sends.append(self._set(lp.SET_COLOR_ZONES, {
+                    'start_index': start, 'end_index': end, 'color': color,
+                    'duration': duration, 'apply': apply
+                }, ack))
+        for send in sends:
+            await send
+
+
+class AsyncMatrixLight(AsyncLight):
+    """ Tiles in the chain are laid out from left to right. """
+    def __init__(self, endpoint, mac_addr, address, info):
+        super().__init__(endpoint, mac_addr, address, info)
+        self._tiles = [tuple(tile) for tile in info.get('tiles', [])]
+
+    def get_tiles(self) -> list:
+        return list(self._tiles)
+
+    def get_height(self) -> int:
+        return max((height for _, height in self._tiles), default=0)
+
+    def get_width(self) -> int:
+        return sum(width for width, _ in self._tiles)
+
+    async def probe(self) -> None:
+        responses = await self._get(
+            lp.GET_DEVICE_CHAIN, lp.STATE_DEVICE_CHAIN)
+        self._tiles = responses[0][1]['tiles']
+
+    def _segments(self):
+        # (tile index, left column, first row, number of rows, width)
+        left = 0
+        for tile_index, (width, height) in enumerate(self._tiles):
+            rows = max(1, lp.MAX_TILE_PIXELS // width) if width else 1
+            for y in range(0, height, rows):
+                yield tile_index, left, y, min(rows, height - y), width
+            left += width
+
+    async def get_matrix(self) -> ColorMatrix:
+        height, width = self.get_height(), self.get_width()
+        colors = [[0, 0, 0, 0]] * (height * width)
+        for tile_index, left, y, rows, tile_width in self._segments():
+            fields = (await self._get(lp.GET_64, lp.STATE_64, {
+                'tile_index': tile_index, 'length': 1, 'reserved': 0,
+                'x': 0, 'y': y, 'width': tile_width
+            }))[0][1]
+            for row in range(0, rows):
+                for column in range(0, tile_width):
+                    colors[(y + row) * width + left + column] = (
+                        fields['colors'][row * tile_width + column])
+        return ColorMatrix.new_from_iterable(height, width, colors)
+
+    async def set_matrix(self, matrix, duration=0, ack=False) -> None:
+        colors = matrix.get_colors()
+        width = self.get_width()
+        for tile_index, left, y, rows, tile_width in self._segments():
+            pixels = [
+                colors[(y + row) * width + left + column] or [0, 0, 0, 0]
+                for row in range(0, rows)
+                for column in range(0, tile_width)]
+            await self._set(lp.SET_64, {
+                'tile_index': tile_index, 'length': 1, 'y': y,
+                'width': tile_width, 'duration': duration, 'colors': pixels
+            }, ack)
+
+
+class AsyncLightApi:
+    def __init__(self, endpoint, broadcast_address=(
+            '255.255.255.255', lp.DEFAULT_PORT)):
+        self._endpoint = endpoint
+        self._broadcast_address = broadcast_address
+
+    async def find_devices(self, timeout=1.0) -> list:
+        """
+        Broadcast GetService, and return a (mac, (ip, port)) tuple for each
+        device that answers within timeout seconds.
+        """
+        responses = await self._endpoint.request(
+            self._broadcast_address, None, lp.GET_SERVICE, b'',
+            (lp.STATE_SERVICE,), False, timeout, 1)
+        devices = {}
+        for header, fields, address in responses:
+            if fields['service'] == 1:
+                devices[header.target] = (address[0], fields['port'])
+        return list(devices.items())
+
+    async def get_lights(self, timeout=1.0):
+        """
+        Async generator: find the devices, then query each of them
+        concurrently, yielding each light as soon as it's built. A device
+        that doesn't respond is logged and skipped.
+        """
+        devices = await self.find_devices(timeout)
+        tasks = [asyncio.ensure_future(self.build_light(mac, address))
+                 for mac, address in devices]
+        for next_done in asyncio.as_completed(tasks):
+            try:
+                light = await next_done
+            except LanTimeout as ex:
+                logging.warning('In get_lights(): {}'.format(ex))
+                continue
+            yield light
+
+    async def build_light(self, mac_addr, address):
+        endpoint = self._endpoint
+
+        async def get(msg_type, response_type):
+            responses = await endpoint.request(
+                address, mac_addr, msg_type, b'', (response_type,))
+            return responses[0][1]
+
+        state, version, group, location = await asyncio.gather(
+            get(lp.LIGHT_GET, lp.LIGHT_STATE),
+            get(lp.GET_VERSION, lp.STATE_VERSION),
+            get(lp.GET_GROUP, lp.STATE_GROUP),
+            get(lp.GET_LOCATION, lp.STATE_LOCATION))
+        product = version['product']
+        info = {
+            'label': state['label'],
+            'group': group['label'],
+            'location': location['label'],
+            'product': product,
+            'features': features_map.get(product, features_map[None])
+        }
+        if info['features'].get('multizone', False):
+            light = AsyncMultizoneLight(endpoint, mac_addr, address, info)
+        elif info['features'].get('matrix', False):
+            light = AsyncMatrixLight(endpoint, mac_addr, address, info)
+        else:
+            return AsyncLight(endpoint, mac_addr, address, info)
+        await light.probe()
+        return light
+
+    async def set_color_all_lights(self, color, duration) -> None:
+        self._endpoint.send(
+            self._broadcast_address, None, lp.LIGHT_SET_COLOR,
+            lp.encode(lp.LIGHT_SET_COLOR, color=color, duration=duration))
+
+    async def set_power_all_lights(self, power_level, duration) -> None:
+        self._endpoint.send(
+            self._broadcast_address, None, lp.LIGHT_SET_POWER,
+            lp.encode(lp.LIGHT_SET_POWER, level=power_level,
+                      duration=duration))
@@ -0,0 +1,56 @@
+import logging
+import time
+
+from bardolph.lib.worker_pool import WorkerPool
+
+
+class Batch:
+    """
+    Applies the same operation to a number of lights concurrently, so that
+    every light in a group or location changes at about the same time.
+
+    Each call waits at most deadline seconds for the lights to respond.
+    Failures are collected rather than raised, and reported together in a
+    single log message.
+    """
+    def __init__(self, num_workers, deadline):
+        self._pool = WorkerPool(num_workers, 'batch')
+        self._deadline = deadline
+
+    def run(self, lights, operation) -> list:
+        """
+        Call operation(light) for each light. Returns a list of
+        (light_name, reason) tuples, one for each light that failed or
+        didn't finish before the deadline.
+        """
+        if len(lights) == 1:
+            return self._run_one(lights[0], operation)
+
+        tasks = [(light, self._pool.submit(operation, light))
+                 for light in lights]
+        end_time = time.monotonic() + self._deadline
+        failures = []
+        for light, task in tasks:
+            if not task.wait(max(0.0, end_time - time.monotonic())):
+                failures.append((light.get_name(), 'timed out'))
+            elif task.exception is not None:
+                failures.append((light.get_name(), task.exception))
+        Batch._report(failures, len(lights))
+        return failures
+
+    def _run_one(self, light, operation) -> list:
+        try:
+            operation(light)
+        except Exception as ex:
+            failures = [(light.get_name(), ex)]
+            Batch._report(failures, 1)
+            return failures
+        return []
+
+    @staticmethod
+    def _report(failures, num_lights) -> None:
+        if len(failures) > 0:
+            logging.warning('{} of {} lights failed: {}'.format(
+                len(failures), num_lights,
+                ', '.join('"{}" ({})'.format(name, reason)
+                          for name, reason in failures)))
@@ -1,5 +1,7 @@
 import copy
 
+from bardolph.controller import tile_packet, units
+
 
 class Rect:
     def __init__(self, top=0, bottom=0, left=0, right=0):
@@ -48,13 +50,13 @@ class ColorMatrix:
                 ret_value += '\n'
         return ret_value
 
-    @staticmethod
-    def new_from_iterable(height, width, srce):
-        return ColorMatrix(height, width).set_from_iterable(srce)
+    @classmethod
+    def new_from_iterable(cls, height, width, srce):
+        return cls(height, width).set_from_iterable(srce)
 
-    @staticmethod
-    def new_from_constant(height, width, init_value):
-        return ColorMatrix(height, width).set_from_constant(init_value)
+    @classmethod
+    def new_from_constant(cls, height, width, init_value):
+        return cls(height, width).set_from_constant(init_value)
 
     @property
     def height(self) -> int:
@@ -82,20 +84,54 @@ class ColorMatrix:
         return self
 
     def set_from_matrix(self, srce):
+        srce_mat = srce.matrix
         for row in range(0, self._height):
             for col in range(0, self._width):
-                self._mat[row][col] = srce.matrix[row][col]
+                self._mat[row][col] = srce_mat[row][col]
         return self
 
     def get_colors(self):
         return [self._standardize_raw(param) for param in self.as_list()]
 
+    def convert_units(self, srce_mode, dest_mode):
+        """
+        A new matrix of the same type, with the colors from get_colors()
+        converted from one units.UnitMode to another.
+        """
+        xform_fn = units.convert_fn(srce_mode, dest_mode)
+        colors = self.get_colors()
+        if xform_fn is not None:
+            colors = (xform_fn(color) for color in colors)
+        return type(self).new_from_iterable(self.height, self.width, colors)
+
     def find_replace(self, to_find, replacement):
         for row in range(0, self.height):
             for column in range(0, self.width):
                 if self._mat[row][column] == to_find:
                     self._mat[row][column] = replacement.copy()
 
+    def is_complete(self) -> bool:
+        # True if no cell is None.
+        return all(color is not None for row in self._mat for color in row)
+
+    def pack_into(self, buffer, offset, top, left, height, width) -> None:
+        """
+        Write the colors in a section of the matrix into buffer, starting
+        at offset, row by row. Each color is clamped, rounded, and packed as
+        4 little-endian unsigned 16-bit integers. None becomes zero.
+        """
+        pack = tile_packet.PIXEL.pack_into
+        for row in range(top, top + height):
+            cells = self._mat[row]
+            for column in range(left, left + width):
+                color = cells[column]
+                if color is None:
+                    pack(buffer, offset, 0, 0, 0, 0)
+                else:
+                    pack(buffer, offset, _raw(color[0]), _raw(color[1]),
+                         _raw(color[2]), _raw(color[3]))
+                offset += 8
+
     def as_list(self):
         return [self._mat[row][column]
                 for row in range(0, self.height)
@@ -151,4 +187,12 @@ class ColorMatrix:
                 rect.left = rect.right
             case False, True:
                 rect.right = rect.left
-        return rect
\ No newline at end of file
+        return rect
+
+
+def _raw(param):
+    if param < 0.0:
+        return 0
+    if param > 65535.0:
+        return 65535
+    return round(param)
@@ -2,7 +2,17 @@ import logging
 
 functional = {
     'default_num_lights': None,
-    'sleep_time': 0.01, # seconds
+
+    # Discovery runs in the background, and lights become available to
+    # scripts as they respond. Metadata queries run in parallel, on up to
+    # discovery_workers threads.
+    'background_discovery': True,
+    'discovery_workers': 8,
+
+    # Lights found by earlier discoveries, used until discovery finishes.
+    # Set inventory_file to None to turn this off.
+    'inventory_file': '~/.cache/bardolph/inventory.json',
+    'inventory_ttl': 24 * 60 * 60, # seconds
 
     'generated_path': 'generated',
     'log_date_format': '%D %H:%M:%S',
@@ -18,10 +28,71 @@ functional = {
     'refresh_sleep_time': 60, # seconds, used when there was no problem.
     'failure_sleep_time': 20, # seconds, used when the last one failed.
 
+    # Commands to a group or location go to all of its lights at once, using
+    # up to batch_workers threads, and wait no longer than batch_deadline.
+    'batch_workers': 16,
+    'batch_deadline': 2.0, # seconds
+
+    # How writes are sent to the lights: "acked" waits for each one to be
+    # acknowledged, "rapid" sends without waiting, and "rapid*n" sends each
+    # write n times. light_delivery_modes can override this for individual
+    # lights, with a dict of light name to mode.
+    'delivery_mode': 'rapid',
+    'light_delivery_modes': None,
+
+    # The most writes per second to send to any one light. Writes that
+    # arrive faster are coalesced, with the latest one winning. Zero means
+    # no limit.
+    'max_write_rate': 20,
+
+    # How long the last known state of a light is trusted. Within this time,
+    # reads are answered from memory, and writes that wouldn't change
+    # anything aren't sent. Zero turns this off.
+    'shadow_max_age': 10.0, # seconds
+
+    # Keep matrix variables in NumPy arrays, if NumPy is installed.
+    'use_array_matrix': True,
+
     # How long to wait before pruning lights that seem to have disappeared.
     'light_gc_time': 300, # seconds
 
+    # Which implementation of the LAN protocol to use: "lifxlan", or "async"
+    # for the asyncio version, which shares one socket among all the lights.
+    # For "async", discovery is broadcast to lan_broadcast, as "address" or
+    # "address:port", and waits lan_discovery_time for responses.
+    'light_api': 'lifxlan',
+    'lan_broadcast': '255.255.255.255',
+    'lan_discovery_time': 1.0, # seconds
+
+    # Which passes the optimizer makes over each compiled script: "all",
+    # "none", or a list of names separated by commas. See optimizer.py.
+    'optimizer_passes': 'all',
+
+    # Statements at the start of a script that are the same as the start of
+    # one parsed before aren't parsed again. parse_cache_size limits how many
+    # statements are kept.
+    'parse_cache': True,
+    'parse_cache_size': 1000,
+
+    # Run scripts in up to process_pool_size worker processes, or one for
+    # each CPU if that is 0, with the light calls sent back to this one.
+    'process_pool': False,
+    'process_pool_size': 0,
+
+    # Compiled scripts are kept in memory, keyed on a hash of their text, so
+    # that running one again skips parsing and optimization. If
+    # script_cache_dir isn't None, they are also saved there as files.
+    'script_cache': True,
+    'script_cache_dir': None,
+    'script_cache_size': 64,
+
     'script_path': 'scripts',
     'single_light_discover': False,
-    'use_fakes': False
+    'use_fakes': False,
+
+    # Decode the program into bound handlers before running it.
+    'vm_predecode': True,
+
+    # Record op-code, routine, clock, and light timings while a script runs.
+    'vm_profile': False
 }
@@ -0,0 +1,124 @@
+import re
+import threading
+
+from bardolph.lib import i_lib
+from bardolph.lib.injection import bind_instance, inject
+
+
+class Delivery:
+    """
+    How a write is sent to a device. In acknowledged mode, each write waits
+    for the device to confirm it. In rapid mode, nothing is acknowledged, and
+    each write can be sent more than once to make up for lost packets.
+
+    As a string: "acked", "rapid", or "rapid*n" to send each write n times.
+    """
+    _pattern = re.compile(r'^\s*(acked|rapid)\s*(?:\*\s*(\d+))?\s*$')
+
+    def __init__(self, acked=False, repeats=1):
+        self.acked = acked
+        self.repeats = 1 if acked else max(1, repeats)
+
+    def __eq__(self, other):
+        return (isinstance(other, Delivery) and self.acked == other.acked
+                and self.repeats == other.repeats)
+
+    def __hash__(self):
+        return hash((self.acked, self.repeats))
+
+    def __repr__(self):
+        return 'Delivery.from_string("{}")'.format(self)
+
+    def __str__(self):
+        if self.acked:
+            return 'acked'
+        if self.repeats == 1:
+            return 'rapid'
+        return 'rapid*{}'.format(self.repeats)
+
+    @classmethod
+    def from_string(cls, text):
+        """ Raises ValueError if text isn't a valid delivery mode. """
+        match = cls._pattern.match(str(text).lower())
+        if match is None:
+            raise ValueError('Invalid delivery mode: "{}"'.format(text))
+        if match.group(1) == 'acked':
+            return cls(True)
+        return cls(False, int(match.group(2) or 1))
+
+
+class DeliveryModes:
+    """
+    The delivery for each light according to the settings: its entry in the
+    light_delivery_modes dict, if there is one, otherwise delivery_mode.
+    The settings are parsed once, when this is created, so that an invalid
+    mode raises ValueError at startup rather than in the middle of a script.
+    """
+    @inject(i_lib.Settings)
+    def __init__(self, settings):
+        self._default = Delivery.from_string(
+            settings.get_value('delivery_mode', 'rapid'))
+        per_light = settings.get_value('light_delivery_modes', None) or {}
+        self._per_light = {
+            light_name: Delivery.from_string(text)
+            for light_name, text in per_light.items() if text}
+
+    def get_delivery(self, light_name) -> Delivery:
+        return self._per_light.get(light_name, self._default)
+
+
+@inject(DeliveryModes)
+def default_delivery(light_name, modes) -> Delivery:
+    return modes.get_delivery(light_name)
+
+
+class DeliveryStats:
+    """
+    Counters for each delivery mode. The latency is how long it took to
+    hand a write to the network, including waiting for the acknowledgement,
+    if any. A loss is an acknowledged write that never got one; for rapid
+    writes, losses can't be detected.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = {}
+
+    def record(self, delivery, latency, lost=False) -> None:
+        with self._lock:
+            counters = self._counters.get(delivery)
+            if counters is None:
+                counters = self._counters[delivery] = [0, 0, 0.0, 0.0]
+            counters[0] += 1
+            if lost:
+                counters[1] += 1
+            counters[2] += latency
+            counters[3] = max(counters[3], latency)
+
+    def reset(self) -> None:
+        with self._lock:
+            self._counters.clear()
+
+    def get_stats(self) -> dict:
+        """
+        Keyed on the name of the mode, for example "rapid*2". Each value is a
+        dict with writes, losses, mean_latency, and max_latency. Latencies
+        are in seconds.
+        """
+        with self._lock:
+            return {
+                str(delivery): {
+                    'writes': writes,
+                    'losses': losses,
+                    'mean_latency': total / writes,
+                    'max_latency': longest
+                }
+                for delivery, (writes, losses, total, longest)
+                in self._counters.items()
+            }
+
+
+the_stats = DeliveryStats()
+
+
+def configure():
+    bind_instance(DeliveryModes()).to(DeliveryModes)
@@ -5,6 +5,7 @@ class LightException(Exception):
 
 class LightApi:
     def get_lights(self): pass
+    def get_cached_lights(self): return []
     def set_color_all_lights(self, color, duration): pass
     def set_power_all_lights(self, power_level, duration): pass
 
@@ -22,6 +23,9 @@ class LightSet:
     def get_location_lights(self, loc_name): pass
     def set_color_all_lights(self, color, duration): pass
     def set_power_all_lights(self, power_level, duration): pass
+    def set_color_lights(self, lights, color, duration): pass
+    def set_power_lights(self, lights, power_level, duration): pass
+    def flush_writes(self): pass
     def get_successful_discoveries(self): pass
     def get_failed_discoveries(self): pass
 
@@ -46,6 +50,7 @@ class MultizoneLight(Light):
     def get_width(self) -> int: pass
     def get_zone_colors(self, first_zone, last_zone): pass
     def set_zone_colors(self, first_zone, last_zone, color, duration): pass
+    def set_zone_list(self, first_zone, colors, duration): pass
 
 
 class MatrixLight(Light):
@@ -0,0 +1,67 @@
+import json
+import logging
+import os
+import threading
+import time
+
+
+class Inventory:
+    """
+    Persistent record of the devices found by discovery, stored in a JSON
+    file and keyed on MAC address. Each record is a dict holding whatever
+    is needed to rebuild a light without talking to it: its address,
+    product, label, group, location, and its zone count or matrix size.
+
+    Records older than ttl seconds are ignored when the file is loaded.
+    """
+    def __init__(self, file_name, ttl):
+        self._file_name = os.path.expanduser(file_name)
+        self._ttl = ttl
+        self._records = {}
+        self._lock = threading.Lock()
+
+    def load(self) -> list:
+        """ Returns the list of unexpired records. """
+        try:
+            with open(self._file_name) as srce:
+                records = json.load(srce)
+        except FileNotFoundError:
+            return []
+        except (OSError, ValueError) as ex:
+            logging.warning(
+                "Unable to read inventory {}: {}".format(self._file_name, ex))
+            return []
+
+        oldest = time.time() - self._ttl
+        with self._lock:
+            self._records = {
+                mac: record for mac, record in records.items()
+                if record.get('time', 0) >= oldest
+            }
+            return list(self._records.values())
+
+    def put(self, record) -> None:
+        # Safe to call from more than one thread.
+        record['time'] = time.time()
+        with self._lock:
+            self._records[record['mac']] = record
+
+    def save(self) -> None:
+        # Writes to a temporary file first, so that a concurrent load never
+        # sees a partial file. The temporary file's name is unique to the
+        # process and thread, so that two saves at once, such as from lsrun
+        # and the web server, don't write into the same one.
+        with self._lock:
+            text = json.dumps(self._records, indent=1, sort_keys=True)
+        temp_name = '{}.{}.{}.tmp'.format(
+            self._file_name, os.getpid(), threading.get_ident())
+        try:
+            dir_name = os.path.dirname(self._file_name)
+            if dir_name:
+                os.makedirs(dir_name, exist_ok=True)
+            with open(temp_name, 'w') as dest:
+                dest.write(text)
+            os.replace(temp_name, self._file_name)
+        except OSError as ex:
+            logging.warning(
+                "Unable to write inventory {}: {}".format(self._file_name, ex))
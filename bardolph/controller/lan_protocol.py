@@ -0,0 +1,352 @@
+"""
+Encoding and decoding of LIFX LAN protocol messages, for the messages that
+Bardolph uses. Each message is a 36-byte header followed by a payload.
+
+Payloads are handled as dicts. Colors are lists of 4 unsigned 16-bit
+integers: hue, saturation, brightness, and kelvin.
+"""
+
+import struct
+from collections import namedtuple
+
+HEADER_SIZE = 36
+DEFAULT_PORT = 56700
+
+_HEADER = struct.Struct('<HHI8s6sBBQHH')
+_PROTOCOL = 1024
+_ADDRESSABLE = 1 << 12
+_TAGGED = 1 << 13
+_RES_REQUIRED = 1
+_ACK_REQUIRED = 2
+
+GET_SERVICE = 2
+STATE_SERVICE = 3
+GET_HOST_FIRMWARE = 14
+STATE_HOST_FIRMWARE = 15
+GET_LABEL = 23
+STATE_LABEL = 25
+GET_VERSION = 32
+STATE_VERSION = 33
+ACKNOWLEDGEMENT = 45
+GET_LOCATION = 48
+STATE_LOCATION = 50
+GET_GROUP = 51
+STATE_GROUP = 53
+LIGHT_GET = 101
+LIGHT_SET_COLOR = 102
+LIGHT_STATE = 107
+LIGHT_GET_POWER = 116
+LIGHT_SET_POWER = 117
+LIGHT_STATE_POWER = 118
+SET_COLOR_ZONES = 501
+GET_COLOR_ZONES = 502
+STATE_ZONE = 503
+STATE_MULTI_ZONE = 506
+SET_EXTENDED_COLOR_ZONES = 510
+GET_EXTENDED_COLOR_ZONES = 511
+STATE_EXTENDED_COLOR_ZONES = 512
+GET_DEVICE_CHAIN = 701
+STATE_DEVICE_CHAIN = 702
+GET_64 = 707
+STATE_64 = 711
+SET_64 = 715
+
+MAX_EXTENDED_ZONES = 82
+MAX_TILE_PIXELS = 64
+MAX_CHAIN_TILES = 16
+
+Header = namedtuple(
+    'Header',
+    'size tagged source target ack_required res_required sequence msg_type')
+
+
+class ProtocolError(Exception):
+    pass
+
+
+def mac_to_bytes(mac_addr) -> bytes:
+    return bytes.fromhex(mac_addr.replace(':', '')) + bytes(2)
+
+
+def bytes_to_mac(target) -> str:
+    return ':'.join('{:02x}'.format(b) for b in target[0:6])
+
+
+def pack_message(msg_type, payload=b'', target=None, source=0, sequence=0,
+                 ack_required=False, res_required=False) -> bytes:
+    """ If target is None, the message is tagged and goes to every device. """
+    flags = _PROTOCOL | _ADDRESSABLE
+    if target is None:
+        flags |= _TAGGED
+        target_bytes = bytes(8)
+    else:
+        target_bytes = mac_to_bytes(target)
+    response_flags = ((_ACK_REQUIRED if ack_required else 0)
+                      | (_RES_REQUIRED if res_required else 0))
+    header = _HEADER.pack(
+        HEADER_SIZE + len(payload), flags, source, target_bytes, bytes(6),
+        response_flags, sequence & 0xff, 0, msg_type, 0)
+    return header + payload
+
+
+def unpack_message(data):
+    """ Returns a (Header, payload bytes) tuple. """
+    if len(data) < HEADER_SIZE:
+        raise ProtocolError('Message too short: {} bytes'.format(len(data)))
+    (size, flags, source, target, _, response_flags, sequence, _, msg_type,
+     _) = _HEADER.unpack_from(data)
+    if size != len(data):
+        raise ProtocolError(
+            'Size is {}, but {} bytes arrived'.format(size, len(data)))
+    header = Header(
+        size, bool(flags & _TAGGED), source, bytes_to_mac(target),
+        bool(response_flags & _ACK_REQUIRED),
+        bool(response_flags & _RES_REQUIRED), sequence, msg_type)
+    return header, bytes(data[HEADER_SIZE:])
+
+
+_COLOR = struct.Struct('<4H')
+
+
+def _pack_colors(colors, count) -> bytes:
+    # Exactly count colors, padded with zeros.
+    result = bytearray(count * _COLOR.size)
+    for index, color in enumerate(colors[0:count]):
+        _COLOR.pack_into(result, index * _COLOR.size, *color)
+    return bytes(result)
+
+
+def _unpack_colors(data, offset, count) -> list:
+    return [list(_COLOR.unpack_from(data, offset + index * _COLOR.size))
+            for index in range(0, count)]
+
+
+def _pack_text(text, size) -> bytes:
+    return text.encode('utf-8')[0:size].ljust(size, b'\0')
+
+
+def _unpack_text(data) -> str:
+    return data.split(b'\0', 1)[0].decode('utf-8', errors='replace')
+
+
+# Each codec is (pack function, unpack function). A pack function takes
+# the payload's fields as keyword arguments and returns bytes; an unpack
+# function takes bytes and returns a dict.
+
+def _fixed(fmt, *names):
+    fixed = struct.Struct(fmt)
+    return (lambda **fields: fixed.pack(*(fields[name] for name in names)),
+            lambda data: dict(zip(names, fixed.unpack_from(data))))
+
+
+def _empty():
+    return (lambda **_: b''), (lambda _: {})
+
+
+def _pack_labeled(**fields):
+    return (fields.get('id', bytes(16))[0:16].ljust(16, b'\0')
+            + _pack_text(fields['label'], 32)
+            + struct.pack('<Q', fields.get('updated_at', 0)))
+
+
+def _unpack_labeled(data):
+    return {
+        'id': data[0:16],
+        'label': _unpack_text(data[16:48]),
+        'updated_at': struct.unpack_from('<Q', data, 48)[0]
+    }
+
+
+def _pack_light_state(**fields):
+    return (_COLOR.pack(*fields['color'])
+            + struct.pack('<hH', 0, fields['power'])
+            + _pack_text(fields['label'], 32) + bytes(8))
+
+
+def _unpack_light_state(data):
+    return {
+        'color': list(_COLOR.unpack_from(data)),
+        'power': struct.unpack_from('<H', data, 10)[0],
+        'label': _unpack_text(data[12:44])
+    }
+
+
+def _pack_set_color(**fields):
+    return (b'\0' + _COLOR.pack(*fields['color'])
+            + struct.pack('<I', fields['duration']))
+
+
+def _unpack_set_color(data):
+    return {
+        'color': list(_COLOR.unpack_from(data, 1)),
+        'duration': struct.unpack_from('<I', data, 9)[0]
+    }
+
+
+def _pack_set_color_zones(**fields):
+    return (struct.pack('<BB', fields['start_index'], fields['end_index'])
+            + _COLOR.pack(*fields['color'])
+            + struct.pack('<IB', fields['duration'], fields.get('apply', 1)))
+
+
+def _unpack_set_color_zones(data):
+    start_index, end_index = struct.unpack_from('<BB', data)
+    duration, apply = struct.unpack_from('<IB', data, 10)
+    return {
+        'start_index': start_index, 'end_index': end_index,
+        'color': list(_COLOR.unpack_from(data, 2)),
+        'duration': duration, 'apply': apply
+    }
+
+
+def _pack_state_zone(**fields):
+    return (struct.pack('<BB', fields['count'], fields['index'])
+            + _COLOR.pack(*fields['color']))
+
+
+def _unpack_state_zone(data):
+    count, index = struct.unpack_from('<BB', data)
+    return {'count': count, 'index': index,
+            'colors': [list(_COLOR.unpack_from(data, 2))]}
+
+
+def _pack_state_multi_zone(**fields):
+    return (struct.pack('<BB', fields['count'], fields['index'])
+            + _pack_colors(fields['colors'], 8))
+
+
+def _unpack_state_multi_zone(data):
+    count, index = struct.unpack_from('<BB', data)
+    return {'count': count, 'index': index,
+            'colors': _unpack_colors(data, 2, 8)}
+
+
+def _pack_set_extended(**fields):
+    colors = fields['colors']
+    return (struct.pack('<IBHB', fields['duration'], fields.get('apply', 1),
+                        fields['index'], len(colors))
+            + _pack_colors(colors, MAX_EXTENDED_ZONES))
+
+
+def _unpack_set_extended(data):
+    duration, apply, index, count = struct.unpack_from('<IBHB', data)
+    return {'duration': duration, 'apply': apply, 'index': index,
+            'colors': _unpack_colors(data, 8, count)}
+
+
+def _pack_state_extended(**fields):
+    colors = fields['colors']
+    return (struct.pack('<HHB', fields['count'], fields['index'], len(colors))
+            + _pack_colors(colors, MAX_EXTENDED_ZONES))
+
+
+def _unpack_state_extended(data):
+    count, index, colors_count = struct.unpack_from('<HHB', data)
+    return {'count': count, 'index': index,
+            'colors': _unpack_colors(data, 5, colors_count)}
+
+
+_TILE = struct.Struct('<4h2f3B3I2Q2HI')
+
+
+def _pack_device_chain(**fields):
+    tiles = fields['tiles']
+    result = bytearray(struct.pack('<B', fields.get('start_index', 0)))
+    for index in range(0, MAX_CHAIN_TILES):
+        width, height = tiles[index] if index < len(tiles) else (0, 0)
+        result += _TILE.pack(
+            0, 0, 0, 0, 0.0, 0.0, width, height, 0, 0, 0, 0, 0, 0, 0, 0, 0)
+    result += struct.pack('<B', len(tiles))
+    return bytes(result)
+
+
+def _unpack_device_chain(data):
+    start_index = data[0]
+    total_count = data[1 + MAX_CHAIN_TILES * _TILE.size]
+    tiles = []
+    for index in range(start_index, start_index + total_count):
+        fields = _TILE.unpack_from(data, 1 + index * _TILE.size)
+        tiles.append((fields[6], fields[7]))
+    return {'start_index': start_index, 'tiles': tiles}
+
+
+def _pack_state_64(**fields):
+    return (struct.pack('<5B', fields['tile_index'], 0, 0, fields['y'],
+                        fields['width'])
+            + _pack_colors(fields['colors'], MAX_TILE_PIXELS))
+
+
+def _unpack_state_64(data):
+    tile_index, _, _, y, width = struct.unpack_from('<5B', data)
+    return {'tile_index': tile_index, 'y': y, 'width': width,
+            'colors': _unpack_colors(data, 5, MAX_TILE_PIXELS)}
+
+
+def _pack_set_64(**fields):
+    return (struct.pack('<6BI', fields['tile_index'], fields.get('length', 1),
+                        0, 0, fields['y'], fields['width'],
+                        fields['duration'])
+            + _pack_colors(fields['colors'], MAX_TILE_PIXELS))
+
+
+def _unpack_set_64(data):
+    tile_index, length, _, _, y, width, duration = struct.unpack_from(
+        '<6BI', data)
+    return {'tile_index': tile_index, 'length': length, 'y': y,
+            'width': width, 'duration': duration,
+            'colors': _unpack_colors(data, 10, MAX_TILE_PIXELS)}
+
+
+_CODECS = {
+    GET_SERVICE: _empty(),
+    STATE_SERVICE: _fixed('<BI', 'service', 'port'),
+    GET_HOST_FIRMWARE: _empty(),
+    STATE_HOST_FIRMWARE: _fixed('<QQI', 'build', 'reserved', 'version'),
+    GET_LABEL: _empty(),
+    STATE_LABEL: (lambda **fields: _pack_text(fields['label'], 32),
+                  lambda data: {'label': _unpack_text(data[0:32])}),
+    GET_VERSION: _empty(),
+    STATE_VERSION: _fixed('<III', 'vendor', 'product', 'version'),
+    ACKNOWLEDGEMENT: _empty(),
+    GET_LOCATION: _empty(),
+    STATE_LOCATION: (_pack_labeled, _unpack_labeled),
+    GET_GROUP: _empty(),
+    STATE_GROUP: (_pack_labeled, _unpack_labeled),
+    LIGHT_GET: _empty(),
+    LIGHT_SET_COLOR: (_pack_set_color, _unpack_set_color),
+    LIGHT_STATE: (_pack_light_state, _unpack_light_state),
+    LIGHT_GET_POWER: _empty(),
+    LIGHT_SET_POWER: _fixed('<HI', 'level', 'duration'),
+    LIGHT_STATE_POWER: _fixed('<H', 'level'),
+    SET_COLOR_ZONES: (_pack_set_color_zones, _unpack_set_color_zones),
+    GET_COLOR_ZONES: _fixed('<BB', 'start_index', 'end_index'),
+    STATE_ZONE: (_pack_state_zone, _unpack_state_zone),
+    STATE_MULTI_ZONE: (_pack_state_multi_zone, _unpack_state_multi_zone),
+    SET_EXTENDED_COLOR_ZONES: (_pack_set_extended, _unpack_set_extended),
+    GET_EXTENDED_COLOR_ZONES: _empty(),
+    STATE_EXTENDED_COLOR_ZONES: (_pack_state_extended, _unpack_state_extended),
+    GET_DEVICE_CHAIN: _empty(),
+    STATE_DEVICE_CHAIN: (_pack_device_chain, _unpack_device_chain),
+    GET_64: _fixed('<6B', 'tile_index', 'length', 'reserved', 'x', 'y',
+                   'width'),
+    STATE_64: (_pack_state_64, _unpack_state_64),
+    SET_64: (_pack_set_64, _unpack_set_64),
+}
+
+
+def encode(msg_type, **fields) -> bytes:
+    codec = _CODECS.get(msg_type)
+    if codec is None:
+        raise ProtocolError('Unknown message type: {}'.format(msg_type))
+    return codec[0](**fields)
+
+
+def decode(msg_type, payload) -> dict:
+    codec = _CODECS.get(msg_type)
+    if codec is None:
+        raise ProtocolError('Unknown message type: {}'.format(msg_type))
+    try:
+        return codec[1](payload)
+    except (struct.error, IndexError) as ex:
+        raise ProtocolError(
+            'Bad payload for message type {}: {}'.format(msg_type, ex))
@@ -1,11 +1,14 @@
 import logging
 
 import lifxlan
+from lifxlan.msgtypes import GetService, StateService
 
 from bardolph.controller import i_controller, lifx_lan_light
+from bardolph.controller.inventory import Inventory
 from bardolph.lib import i_lib
 from bardolph.lib.injection import bind, inject
 from bardolph.lib.param_helper import param_color, param_16, param_32
+from bardolph.lib.worker_pool import WorkerPool
 
 
 class LifxLanApi(i_controller.LightApi):
@@ -13,25 +16,68 @@ class LifxLanApi(i_controller.LightApi):
     def __init__(self, settings):
         num_expected = settings.get_value('default_num_lights', None)
         self._lifxlan = lifxlan.LifxLAN(num_expected)
+        file_name = settings.get_value('inventory_file', None)
+        if file_name:
+            ttl = float(settings.get_value('inventory_ttl', 24 * 60 * 60))
+            self._inventory = Inventory(file_name, ttl)
+        else:
+            self._inventory = None
+
+    def get_cached_lights(self):
+        """
+        Lights rebuilt from the inventory, without any network traffic. Empty
+        if there is no inventory.
+        """
+        if self._inventory is None:
+            return []
+        lights = []
+        for record in self._inventory.load():
+            try:
+                lights.append(self._light_from_record(record))
+            except (KeyError, TypeError) as ex:
+                logging.warning("Bad inventory record: {}".format(ex))
+        return lights
 
     @inject(i_lib.Settings)
     def get_lights(self, settings):
+        """
+        Generator: after a single broadcast, the metadata queries for each
+        device run concurrently, and each light is yielded as soon as it has
+        been built. If any device failed to respond, LightException is raised
+        after all of the other lights have been yielded.
+        """
         try:
-            lights = [
-                self._build_light(impl)
-                for impl in self._lifxlan.get_lights()
-            ]
+            responses = self._lifxlan.broadcast_with_resp(
+                GetService, StateService)
         except lifxlan.errors.WorkflowException as ex:
             logging.error("In get_lights(): {}".format(ex))
             raise i_controller.LightException(ex)
 
+        num_workers = int(settings.get_value('discovery_workers', 8))
+        actual = 0
+        errors = []
+        pool = WorkerPool(num_workers, 'discovery')
+        for task in pool.imap_unordered(self._build_light, responses):
+            if isinstance(task.exception, lifxlan.errors.WorkflowException):
+                logging.warning("In get_lights(): {}".format(task.exception))
+                errors.append(task.exception)
+            elif task.exception is not None:
+                raise task.exception
+            elif task.result is not None:
+                actual += 1
+                if self._inventory is not None:
+                    self._inventory.put(task.result.get_record())
+                yield task.result
+        if self._inventory is not None:
+            self._inventory.save()
+
         expected = settings.get_value('default_num_lights', None)
-        if expected is not None:
-            actual = len(lights)
-            if actual < expected:
-                logging.info(
-                    "Expected {} devices, found {}".format(expected, actual))
-        return lights
+        if expected is not None and actual < expected:
+            logging.info(
+                "Expected {} devices, found {}".format(expected, actual))
+        if len(errors) > 0:
+            raise i_controller.LightException(
+                "{} device(s) did not respond".format(len(errors)))
 
     def set_color_all_lights(self, color, duration):
         color = param_color(color)
@@ -41,14 +87,44 @@ class LifxLanApi(i_controller.LightApi):
         self._lifxlan.set_power_all_lights(
             param_16(power_level), param_32(duration), True)
 
-    def _build_light(self, impl):
+    def _build_light(self, response):
+        # Runs in a worker thread. Returns None if the device is not a light.
+        address = (response.target_addr, response.ip_addr, response.service,
+                   response.port)
+        impl = self._new_impl(lifxlan.Light, address)
+        if not impl.is_light():
+            return None
         features = impl.get_product_features()
         if features.get('multizone', False):
+            impl = self._new_impl(
+                lifxlan.MultiZoneLight, address,
+                (impl.vendor, impl.product, impl.version))
             return lifx_lan_light.MultizoneLight(impl)
-        elif impl.get_product_features().get('matrix', False):
+        elif features.get('matrix', False):
             return lifx_lan_light.MatrixLight(impl)
         return lifx_lan_light.Light(impl)
 
+    def _light_from_record(self, record):
+        address = (record['mac'], record['ip'], record['service'],
+                   record['port'])
+        version = (record['vendor'], record['product'], record['version'])
+        features = record['features']
+        if features.get('multizone', False):
+            impl = self._new_impl(lifxlan.MultiZoneLight, address, version)
+            return lifx_lan_light.MultizoneLight(impl, info=record)
+        impl = self._new_impl(lifxlan.Light, address, version)
+        if features.get('matrix', False):
+            return lifx_lan_light.MatrixLight(impl, info=record)
+        return lifx_lan_light.Light(impl, info=record)
+
+    def _new_impl(self, cls, address, version=None):
+        # address is (mac, ip, service, port). If the (vendor, product,
+        # version) tuple is already known, it won't be fetched again.
+        impl = cls(*address, self._lifxlan.source_id)
+        if version is not None:
+            impl.vendor, impl.product, impl.version = version
+        return impl
+
 
 def configure():
     bind(LifxLanApi).to(i_controller.LightApi)
@@ -1,68 +1,210 @@
 import logging
+import time
 
 from bardolph.lib.cache import Cache
 from lifxlan.errors import WorkflowException
-from lifxlan.msgtypes import (GetDeviceChain, GetTileState64, SetTileState64,
-                              StateDeviceChain, StateTileState64)
+from lifxlan.msgtypes import (GetDeviceChain, GetHostFirmware, GetTileState64,
+                              SetTileState64, StateDeviceChain,
+                              StateHostFirmware, StateTileState64)
 
-from bardolph.controller import i_controller, light
+from bardolph.controller import (delivery, i_controller, light, shadow_state,
+                                 tile_packet)
 from bardolph.controller.color_matrix import ColorMatrix
+from bardolph.controller.shadow_state import COLOR, MATRIX, POWER, ZONES
+from bardolph.lib import i_lib
+from bardolph.lib.injection import inject
 from bardolph.lib.param_helper import param_16, param_32, param_8, param_color
 from bardolph.lib.retry import tries
 
 _MAX_TRIES = 3
 
+# Multizone products that always support the extended messages, and those
+# that support them as of firmware 2.77.
+_EXTENDED_PRODUCTS = frozenset((117, 118, 119, 120, 141, 142, 143, 144))
+_EXTENDED_FIRMWARE_PRODUCTS = frozenset((31, 32, 38))
+_EXTENDED_MIN_FIRMWARE = (2, 77)
+
+_PIXEL = tile_packet.PIXEL
+
 
 class _SizeCache(Cache):
     def get(self, light):
-        # returns (height, width) tuple or None if not cached.
+        # returns a list of (width, height) tuples, one for each tile, or None
+        # if not cached.
         return super().get(light.get_uid())
 
     def put(self, light) -> None:
-        super().put(light.get_uid(), (light.get_height(), light.get_width()))
+        super().put(light.get_uid(), light.get_tiles())
 
 
 _the_cache = _SizeCache()
 
 
 class Light(light.Light):
-    def __init__(self, impl):
-        super().__init__(
-            hash(impl.get_mac_addr()), impl.get_label(), impl.get_group(),
-            impl.get_location())
+    """
+    If info is supplied, it is an inventory record, and the light's
+    metadata comes from there instead of from the device itself.
+
+    Writes are sent according to a delivery.Delivery, which can be set for
+    the individual light. Otherwise, it comes from the settings.
+
+    The device's last known state is kept in a shadow_state.ShadowState.
+    Reads are answered from there unless it is older than the shadow_max_age
+    setting, and writes that wouldn't change that state aren't sent. When the
+    light is discovered, its color and power are read to refresh the shadow.
+    """
+    def __init__(self, impl, info=None):
+        if info is None:
+            super().__init__(
+                hash(impl.get_mac_addr()), impl.get_label(), impl.get_group(),
+                impl.get_location())
+            self.product_features = impl.get_product_features()
+        else:
+            super().__init__(
+                hash(impl.get_mac_addr()), info['label'], info['group'],
+                info['location'])
+            self.product_features = info['features']
         self._impl = impl
-        self.product_features = impl.get_product_features()
         self._is_color = self.product_features.get('color', False)
+        self._delivery = None
+        self._shadow = shadow_state.for_device(self.get_uid())
+        if info is None and self._max_age() > 0.0:
+            self._refresh_shadow()
 
     def is_color(self):
         return self._is_color
 
+    def get_delivery(self) -> delivery.Delivery:
+        if self._delivery is not None:
+            return self._delivery
+        return delivery.default_delivery(self.get_name())
+
+    def set_delivery(self, new_delivery) -> None:
+        # None reverts to the delivery in the settings.
+        self._delivery = new_delivery
+
+    def _deliver(self, send) -> bool:
+        # Calls send(rapid) once for each time the write is to be sent.
+        # Returns True if the write was acknowledged by the device.
+        mode = self.get_delivery()
+        start = time.perf_counter()
+        try:
+            for _ in range(0, mode.repeats):
+                send(not mode.acked)
+        except WorkflowException:
+            delivery.the_stats.record(
+                mode, time.perf_counter() - start, mode.acked)
+            raise
+        delivery.the_stats.record(mode, time.perf_counter() - start)
+        return mode.acked
+
+    @inject(i_lib.Settings)
+    def _max_age(self, settings) -> float:
+        # Zero turns off the shadow state.
+        return float(settings.get_value('shadow_max_age', 0) or 0)
+
+    def _refresh_shadow(self) -> None:
+        # One LightGet returns both the color and the power.
+        try:
+            color = self._impl.get_color()
+        except WorkflowException as ex:
+            logging.debug('Unable to refresh shadow: {}'.format(ex))
+            return
+        self._shadow.put_color(list(color))
+        self._shadow.put(POWER, self._impl.power_level)
+
+    def get_record(self) -> dict:
+        # Everything needed to rebuild this light from the inventory.
+        impl = self._impl
+        return {
+            'mac': impl.mac_addr,
+            'ip': impl.ip_addr,
+            'service': impl.service,
+            'port': impl.port,
+            'vendor': impl.vendor,
+            'product': impl.product,
+            'version': impl.version,
+            'label': self.get_name(),
+            'group': self.get_group(),
+            'location': self.get_location(),
+            'features': self.product_features
+        }
+
     @tries(_MAX_TRIES, WorkflowException, [-1] * 4)
     def get_color(self):
-        return self._impl.get_color()
+        color = self._shadow.get(COLOR, self._max_age())
+        if color is None:
+            color = list(self._impl.get_color())
+            self._shadow.put_color(color)
+        return color
 
     @tries(_MAX_TRIES, WorkflowException)
     def set_color(self, color, duration):
         color = param_color(color)
+        if self._shadow.matches(COLOR, color, self._max_age()):
+            return
         duration = param_32(duration)
-        self._impl.set_color(color, duration, True)
+        acked = self._deliver(
+            lambda rapid: self._impl.set_color(color, duration, rapid))
+        self._shadow.put_color(color, acked)
 
     @tries(_MAX_TRIES, WorkflowException)
     def get_power(self) -> int:
-        return round(self._impl.get_power())
+        power = self._shadow.get(POWER, self._max_age())
+        if power is None:
+            power = round(self._impl.get_power())
+            self._shadow.put(POWER, power)
+        return power
 
     @tries(_MAX_TRIES, WorkflowException)
-    def set_power(self, power, duration, rapid=True):
+    def set_power(self, power, duration):
         power = param_16(power)
+        if self._shadow.matches(POWER, power, self._max_age()):
+            return
         duration = param_32(duration)
-        return self._impl.set_power(power, duration, rapid)
+        acked = self._deliver(
+            lambda rapid: self._impl.set_power(power, duration, rapid))
+        self._shadow.put(POWER, power, acked)
 
 
 class MultizoneLight(Light, i_controller.MultizoneLight):
-    def __init__(self, impl, num_zones=None):
-        super().__init__(impl)
+    """
+    Zone writes are compared with the last known colors of the zones, and
+    only the zones that change are sent. If the device supports extended
+    multizone messages, up to 82 zones go out in a single packet. Otherwise,
+    neighboring zones that get the same color share one range message.
+    """
+    def __init__(self, impl, num_zones=None, info=None):
+        super().__init__(impl, info)
+        if info is None:
+            self._extended = self._supports_extended()
+        else:
+            num_zones = num_zones or info.get('num_zones')
+            self._extended = info.get('extended_multizone', False)
         self._num_zones = num_zones or len(self.get_zone_colors())
 
+    def get_record(self) -> dict:
+        record = super().get_record()
+        record['num_zones'] = self._num_zones
+        record['extended_multizone'] = self._extended
+        return record
+
+    def _supports_extended(self) -> bool:
+        if 'extended_multizone' in self.product_features:
+            return self.product_features['extended_multizone']
+        product = self._impl.product
+        if product in _EXTENDED_PRODUCTS:
+            return True
+        if product not in _EXTENDED_FIRMWARE_PRODUCTS:
+            return False
+        try:
+            version = self._impl.req_with_resp(
+                GetHostFirmware, StateHostFirmware).version
+        except WorkflowException as ex:
+            logging.debug('Unable to get firmware version: {}'.format(ex))
+            return False
+        return (version >> 16, version & 0xffff) >= _EXTENDED_MIN_FIRMWARE
+
     def get_height(self) -> int:
         return 1
 
@@ -75,42 +217,166 @@ class MultizoneLight(Light, i_controller.MultizoneLight):
             first_zone = param_16(first_zone)
         if last_zone is not None:
             last_zone = param_16(first_zone)
-        return self._impl.get_color_zones(first_zone, last_zone)
+        if first_zone is not None or last_zone is not None:
+            return self._impl.get_color_zones(first_zone, last_zone)
+        zones = self._shadow.get(ZONES, self._max_age())
+        if zones is None:
+            zones = [list(color) for color in self._impl.get_color_zones()]
+            self._shadow.put(ZONES, zones)
+        return zones
 
-    @tries(_MAX_TRIES, WorkflowException)
     def set_zone_colors(self, first_zone, last_zone, color, duration) -> None:
+        self.set_zone_list(
+            first_zone, [color] * (last_zone - first_zone), duration)
+
+    @tries(_MAX_TRIES, WorkflowException)
+    def set_zone_list(self, first_zone, colors, duration) -> None:
         # Unknown why this happens.
         if not hasattr(self._impl, 'set_zone_color'):
             logging.error(
                 'No set_zone_color for light of type', type(self._impl))
+            return
+        first_zone = param_16(first_zone)
+        duration = param_32(duration)
+        changes = {
+            first_zone + offset: param_color(color)
+            for offset, color in enumerate(colors) if color is not None
+        }
+        # Unchanged zones are skipped only if their colors are confirmed.
+        zones = self._known_zones()
+        if self._shadow.get(ZONES, self._max_age(), True) is not None:
+            changes = {
+                zone: color for zone, color in changes.items()
+                if zone >= len(zones) or zones[zone] != color
+            }
+        if len(changes) == 0:
+            return
+        if self._extended:
+            acked = self._deliver(lambda rapid: self._send_extended(
+                changes, zones, duration, rapid))
         else:
-            color = param_color(color)
-            first_zone = param_16(first_zone)
-            last_zone = param_16(last_zone)
-            duration = param_32(duration)
-            self._impl.set_zone_color(first_zone, last_zone, color, duration)
+            acked = self._deliver(lambda rapid: self._send_ranges(
+                changes, duration, rapid))
+        self._shadow.put_zones(changes, acked)
+
+    def _known_zones(self):
+        # The current colors of all the zones, read from the device if they
+        # aren't in the shadow. None if the shadow is turned off.
+        if self._max_age() <= 0.0:
+            return None
+        zones = self._shadow.get(ZONES, self._max_age())
+        if zones is None:
+            zones = self.get_zone_colors()
+        return zones
+
+    def _send_extended(self, changes, zones, duration, rapid) -> None:
+        # Zones between the changed ones are filled in from the known colors,
+        # so that each span goes out as one message.
+        spans = []
+        for zone in sorted(changes):
+            if len(spans) > 0:
+                span_start, span_colors = spans[-1]
+                gap = range(span_start + len(span_colors), zone)
+                if zones is not None and zone < len(zones):
+                    span_colors.extend(zones[fill] for fill in gap)
+                if span_start + len(span_colors) == zone:
+                    span_colors.append(changes[zone])
+                    continue
+            spans.append((zone, [changes[zone]]))
+        for i, (span_start, span_colors) in enumerate(spans):
+            self._impl.extended_set_zone_color(
+                span_colors, span_start, duration, rapid,
+                1 if i == len(spans) - 1 else 0)
+
+    def _send_ranges(self, changes, duration, rapid) -> None:
+        # Each range is (first zone, last zone inclusive, color).
+        ranges = []
+        for zone in sorted(changes):
+            color = changes[zone]
+            if (len(ranges) > 0 and ranges[-1][1] == zone - 1
+                    and ranges[-1][2] == color):
+                ranges[-1][1] = zone
+            else:
+                ranges.append([zone, zone, color])
+        for i, (first_zone, last_zone, color) in enumerate(ranges):
+            self._impl.set_zone_color(
+                first_zone, last_zone, color, duration, rapid,
+                1 if i == len(ranges) - 1 else 0)
 
 
 class MatrixLight(Light, i_controller.MatrixLight):
-    def __init__(self, impl):
-        super().__init__(impl)
-        self._height = self._width = 0
-        self._get_size()
+    """
+    Models the whole chain of tiles in a device, laid out from left to right
+    in chain order. The height is that of the tallest tile, and the width is
+    the sum of the widths.
+
+    Only the tiles whose pixels change are sent. Consecutive changed tiles
+    that get the same pixels share one SetTileState64 message. In rapid
+    delivery, the pixels are packed straight into a reusable
+    tile_packet.TilePacket and sent from there.
+    """
+    def __init__(self, impl, info=None):
+        super().__init__(impl, info)
+        self._tiles = []
+        if info is not None and info.get('tiles'):
+            self._tiles = [tuple(tile) for tile in info['tiles']]
+            _the_cache.put(self)
+        elif info is not None and info.get('height') and info.get('width'):
+            self._tiles = [(info['width'], info['height'])]
+            _the_cache.put(self)
+        else:
+            self._get_size()
+        self._set_dimensions()
+
+    def get_record(self) -> dict:
+        record = super().get_record()
+        record['height'] = self._height
+        record['width'] = self._width
+        record['tiles'] = [list(tile) for tile in self._tiles]
+        return record
+
+    def get_tiles(self) -> list:
+        # A (width, height) tuple for each tile in the chain.
+        return list(self._tiles)
 
     @tries(_MAX_TRIES, WorkflowException)
     def _get_size(self) -> None:
         cached = _the_cache.get(self)
         if cached is not None:
-            self._height, self._width = cached
+            self._tiles = cached
         else:
             result = self._impl.req_with_resp(
                 GetDeviceChain, StateDeviceChain)
-            tile = result.tile_devices[result.start_index]
-            self._width = tile.get('width', 0)
-            self._height = tile.get('height', 0)
-            if self._width > 0 and self._height > 0:
+            chain = result.tile_devices[
+                result.start_index:result.start_index + result.total_count]
+            self._tiles = [
+                (tile.get('width', 0), tile.get('height', 0))
+                for tile in chain]
+            if len(self._tiles) > 0 and all(
+                    width > 0 and height > 0 for width, height in self._tiles):
                 _the_cache.put(self)
 
+    def _set_dimensions(self) -> None:
+        self._width = sum(width for width, _ in self._tiles)
+        self._height = max((height for _, height in self._tiles), default=0)
+
+        # Each segment is the part of a tile that fits into one message:
+        # (tile index, first row, number of rows, width, left column, offset
+        # into the frame, whole tile).
+        self._segments = []
+        offset = left = 0
+        for tile_index, (width, height) in enumerate(self._tiles):
+            rows = max(1, tile_packet.MAX_PIXELS // width) if width else 1
+            for y in range(0, height, rows):
+                num_rows = min(rows, height - y)
+                self._segments.append((
+                    tile_index, y, num_rows, width, left, offset,
+                    rows >= height))
+                offset += num_rows * width * tile_packet.PIXEL_SIZE
+            left += width
+        self._frame = bytearray(offset)
+        self._packet = None
+
     def get_height(self) -> int:
         return self._height
 
@@ -131,34 +397,145 @@ class MatrixLight(Light, i_controller.MatrixLight):
 
     @tries(_MAX_TRIES, WorkflowException)
     def set_matrix(self, matrix, duration=0) -> None:
-        if self._valid_width_height():
-            payload = {
-                "tile_index": 0,
-                "length": 1,
-                "reserved": 0,
-                "x": 0,
-                "y": 0,
-                "width": param_8(self._width),
-                "height": param_8(self._height),
-                "duration": param_32(duration),
-                "colors": matrix.get_colors()
-            }
+        """
+        The whole chain is packed into one frame buffer, which is compared,
+        segment by segment, with the frame that was last sent.
+        """
+        if not self._valid_width_height():
+            return
+        if not matrix.is_complete():
+            # A cell that is None stays the way it is.
+            known = self.get_matrix().get_colors()
+            matrix = ColorMatrix.new_from_iterable(
+                self._height, self._width,
+                (old if new is None else new
+                 for old, new in zip(known, matrix.get_colors())))
+        self.pack_frame(matrix, self._frame)
+        self._send_frame(self._frame, duration)
+
+    def new_frame(self) -> bytearray:
+        """ A buffer for pack_frame(), big enough for the whole chain. """
+        return bytearray(len(self._frame))
+
+    def pack_frame(self, matrix, frame) -> None:
+        """
+        Packs a matrix with no None cells into frame, laid out the way
+        set_frame() sends it.
+        """
+        for _, y, rows, width, left, offset, _ in self._segments:
+            matrix.pack_into(frame, offset, y, left, rows, width)
+
+    @tries(_MAX_TRIES, WorkflowException)
+    def set_frame(self, frame, duration=0) -> None:
+        """
+        The same as set_matrix(), for a frame that has already been packed
+        by pack_frame(). The frame is only read, so the caller can reuse it.
+        """
+        if not self._valid_width_height():
+            return
+        if len(frame) != len(self._frame):
+            logging.error(
+                'Frame does not fit light "{}".'.format(self.get_name()))
+            return
+        self._send_frame(frame, duration)
+
+    def _send_frame(self, frame, duration) -> None:
+        known = self._shadow.get(MATRIX, self._max_age(), True)
+        if known is not None and len(known) != len(frame):
+            known = None
+        if known is not None and known == frame:
+            return
+
+        frame_view = memoryview(frame)
+        known_view = None if known is None else memoryview(known)
+        runs = []
+        for index, segment in enumerate(self._segments):
+            offset = segment[5]
+            end = offset + segment[2] * segment[3] * tile_packet.PIXEL_SIZE
+            pixels = frame_view[offset:end]
+            if known_view is not None and pixels == known_view[offset:end]:
+                continue
+            if len(runs) > 0:
+                run = runs[-1]
+                prev = self._segments[run[0]]
+                if (segment[6] and prev[6] and run[0] + run[1] == index
+                        and prev[0] + run[1] == segment[0]
+                        and self._tiles[prev[0]] == self._tiles[segment[0]]
+                        and pixels == run[2]):
+                    run[1] += 1
+                    continue
+            runs.append([index, 1, pixels])
+        duration = param_32(duration)
+        acked = self._deliver(
+            lambda rapid: self._send_runs(runs, duration, rapid))
+        self._shadow.invalidate(COLOR)
+        self._shadow.put(MATRIX, bytes(frame), acked)
+
+    def _send_runs(self, runs, duration, rapid) -> None:
+        # Each run is [segment index, number of tiles, pixels].
+        for index, length, pixels in runs:
+            tile_index, y, _, width, _, _, _ = self._segments[index]
+            if rapid and self._impl.ip_addr:
+                packet = self._get_packet()
+                packet.colors[0:len(pixels)] = pixels
+                packet.set_fields(tile_index, length, y, width, duration)
+                packet.send((self._impl.ip_addr, self._impl.port))
+            else:
+                self._send_tile_state({
+                    "tile_index": tile_index,
+                    "length": length,
+                    "reserved": 0,
+                    "x": 0,
+                    "y": y,
+                    "width": width,
+                    "duration": duration,
+                    "colors": list(_PIXEL.iter_unpack(pixels))
+                }, rapid)
+
+    def _get_packet(self) -> tile_packet.TilePacket:
+        if self._packet is None:
+            self._packet = tile_packet.TilePacket(
+                self._impl.mac_addr, self._impl.source_id)
+        return self._packet
+
+    def _send_tile_state(self, payload, rapid) -> None:
+        if rapid:
             self._impl.fire_and_forget(SetTileState64, payload, num_repeats=1)
+        else:
+            self._impl.req_with_ack(SetTileState64, payload)
 
     @tries(_MAX_TRIES, WorkflowException)
     def get_matrix(self) -> ColorMatrix:
         if not self._valid_width_height():
             return ColorMatrix(0, 0)
-        payload = {
-            "tile_index": 0,
-            "length": 1,
-            "reserved": 0,
-            "x": 0,
-            "y": 0,
-            "width": param_8(self._width),
-            "height": param_8(self._height)
-        }
-        colors = self._impl.req_with_resp(
-            GetTileState64, StateTileState64, payload).colors
+        frame = self._shadow.get(MATRIX, self._max_age())
+        if frame is None or len(frame) != len(self._frame):
+            frame = bytearray(len(self._frame))
+            for tile_index, y, rows, width, _, offset, _ in self._segments:
+                payload = {
+                    "tile_index": tile_index,
+                    "length": 1,
+                    "reserved": 0,
+                    "x": 0,
+                    "y": y,
+                    "width": param_8(width)
+                }
+                pixels = self._impl.req_with_resp(
+                    GetTileState64, StateTileState64, payload).colors
+                for pixel in pixels[:rows * width]:
+                    _PIXEL.pack_into(frame, offset, *pixel)
+                    offset += tile_packet.PIXEL_SIZE
+            frame = bytes(frame)
+            self._shadow.put(MATRIX, frame)
+
+        colors = [None] * (self._height * self._width)
+        for _, y, rows, width, left, offset, _ in self._segments:
+            for row in range(y, y + rows):
+                for column in range(left, left + width):
+                    colors[row * self._width + column] = list(
+                        _PIXEL.unpack_from(frame, offset))
+                    offset += tile_packet.PIXEL_SIZE
         return ColorMatrix.new_from_iterable(
-                self._height, self._width, colors)
+                self._height, self._width,
+                ([0, 0, 0, 0] if color is None else color
+                 for color in colors))
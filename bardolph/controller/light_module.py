@@ -1,4 +1,5 @@
-from bardolph.controller import light_set
+from bardolph.controller import (delivery, light_set, process_pool,
+                                 program_cache)
 from bardolph.lib import clock, log_config, std_out_output
 from bardolph.lib.i_lib import Settings
 from bardolph.lib.injection import provide
@@ -10,12 +11,18 @@ def configure():
     clock.configure()
     std_out_output.configure()
 
+    delivery.configure()
     settings = provide(Settings)
     if settings.get_value('use_fakes'):
         from bardolph.fakes import fake_light_api
         fake_light_api.configure()
+    elif settings.get_value('light_api', 'lifxlan') == 'async':
+        from bardolph.controller import async_adapter
+        async_adapter.configure()
     else:
         from bardolph.controller import lifx_lan_api
         lifx_lan_api.configure()
 
     light_set.configure()
+    program_cache.configure()
+    process_pool.configure()
@@ -2,7 +2,8 @@ import logging
 import threading
 import time
 
-from bardolph.controller import i_controller
+from bardolph.controller import i_controller, output_queue, shadow_state
+from bardolph.controller.batch import Batch
 from bardolph.lib.color import rounded_color
 from bardolph.lib import i_lib
 from bardolph.lib.injection import bind_instance, inject, provide
@@ -18,6 +19,18 @@ class LightSet(i_controller.LightSet):
     Locations and groups are stored in _location_dict (key is location name)
     and _group_dict (key is group name). Each value in the location or group
     dict is a list of strings containing light names.
+
+    Lights are published one at a time, as the LightApi delivers them. While
+    a discovery started by discover_in_background() is still running for the
+    first time, a lookup of a light by name waits only until that light
+    arrives, and lookups of groups, locations, or all lights wait until the
+    discovery is finished.
+
+    Lights loaded from the inventory by load_inventory() are provisional:
+    any of them that a successful discovery doesn't find again are removed.
+
+    If the max_write_rate setting is non-zero, each light is wrapped in an
+    output_queue.QueuedLight, which limits how fast writes are sent to it.
     """
     def __init__(self):
         self._lights = {}
@@ -26,33 +39,109 @@ class LightSet(i_controller.LightSet):
         self._locations = {}
         self._num_successful_discovers = 0
         self._num_failed_discovers = 0
+        self._cond = threading.Condition()
+        self._initial_discovery = False
+        self._provisional = set()
+        self._batch = None
+        self._max_write_rate = None
 
     @inject(i_controller.LightApi)
     def discover(self, light_api):
         try:
             for light in light_api.get_lights():
-                light_name = light.get_name()
-                self._light_names.add(light_name)
-                self._lights[light_name] = light
-                LightSet._update_memberships(
-                    light, light.get_group(), self._groups)
-                LightSet._update_memberships(
-                    light, light.get_location(), self._locations)
+                self._publish(light)
         except i_controller.LightException as ex:
             self._num_failed_discovers += 1
             logging.warning("In discover():\n{}".format(ex))
             return False
+        finally:
+            self._end_initial_discovery()
 
+        self._remove_provisional()
         self._num_successful_discovers += 1
         logging.debug('discover. successes: {}, fails: {}'
                       .format(self._num_successful_discovers,
                               self._num_failed_discovers))
         return True
 
+    @inject(i_controller.LightApi)
+    def load_inventory(self, light_api) -> int:
+        """
+        Publish the lights remembered from earlier discoveries. Returns the
+        number of lights loaded.
+        """
+        lights = light_api.get_cached_lights()
+        for light in lights:
+            self._publish(light, True)
+        logging.debug("{} lights from inventory".format(len(lights)))
+        return len(lights)
+
+    def discover_in_background(self):
+        # Lookups block only if there's nothing to go on yet.
+        with self._cond:
+            self._initial_discovery = len(self._lights) == 0
+        threading.Thread(
+            target=self.discover, name='initial_discovery', daemon=True).start()
+
     def refresh(self):
         self.discover()
         self._garbage_collect()
 
+    def _publish(self, light, provisional=False):
+        with self._cond:
+            light = self._queued(light)
+            light_name = light.get_name()
+            if provisional:
+                self._provisional.add(light_name)
+            else:
+                self._provisional.discard(light_name)
+            self._light_names.add(light_name)
+            self._lights[light_name] = light
+            LightSet._update_memberships(
+                light, light.get_group(), self._groups)
+            LightSet._update_memberships(
+                light, light.get_location(), self._locations)
+            self._cond.notify_all()
+
+    @inject(i_lib.Settings)
+    def _queued(self, light, settings):
+        # If there is a rate limit, the light gets an output queue. A newly
+        # discovered instance of a light already in the set keeps the
+        # existing queue.
+        if self._max_write_rate is None:
+            self._max_write_rate = float(
+                settings.get_value('max_write_rate', 0) or 0)
+        if self._max_write_rate <= 0.0:
+            return light
+        existing = self._lights.get(light.get_name())
+        if (isinstance(existing, output_queue.QueuedLight)
+                and type(existing.get_target()) is type(light)):
+            existing.set_target(light)
+            return existing
+        return output_queue.queued(light, self._max_write_rate)
+
+    def _remove_provisional(self):
+        with self._cond:
+            for light_name in self._provisional:
+                light = self._lights.pop(light_name, None)
+                if light is not None:
+                    logging.debug("{} is no longer present".format(light_name))
+                    LightSet._remove_memberships(light, self._groups)
+                    LightSet._remove_memberships(light, self._locations)
+                    self._light_names.remove(light_name)
+            self._provisional.clear()
+
+    def _end_initial_discovery(self):
+        with self._cond:
+            self._initial_discovery = False
+            self._cond.notify_all()
+
+    def _wait_for_discovery(self, light_name=None):
+        # Returns immediately unless the initial discovery is still running.
+        with self._cond:
+            self._cond.wait_for(lambda: (
+                not self._initial_discovery or light_name in self._lights))
+
     @staticmethod
     def _update_memberships(light, name, target_dict):
         """
@@ -94,52 +183,65 @@ class LightSet(i_controller.LightSet):
         logging.debug("garbage collect, currently have {} lights"
                       .format(len(self._lights)))
         max_age = int(settings.get_value('light_gc_time', 20 * 60))
-        target_lights = []
-        for light in self._lights.values():
-            if light.get_age() > max_age:
-                LightSet._remove_memberships(light, self._groups)
-                LightSet._remove_memberships(light, self._locations)
-                target_lights.append(light.get_name())
-        for light_name in target_lights:
-            logging.debug("_garbage_collect() deleting {}".format(light_name))
-            self._light_names.remove(light_name)
-            self._lights[light_name] = None
-            del self._lights[light_name]
+        with self._cond:
+            target_lights = []
+            for light in self._lights.values():
+                if light.get_age() > max_age:
+                    LightSet._remove_memberships(light, self._groups)
+                    LightSet._remove_memberships(light, self._locations)
+                    target_lights.append(light.get_name())
+            for light_name in target_lights:
+                logging.debug(
+                    "_garbage_collect() deleting {}".format(light_name))
+                self._light_names.remove(light_name)
+                self._lights[light_name] = None
+                del self._lights[light_name]
 
     def get_lights(self):
+        self._wait_for_discovery()
         return list(self._lights.values())
 
     def get_light_count(self) -> int:
+        self._wait_for_discovery()
         return len(self._lights)
 
     def get_light_names(self) -> SortedList:
         """ SortedList of strings """
+        self._wait_for_discovery()
         return self._light_names
 
     def get_light(self, light_name):
         """ instance of i_controller.Light or None """
+        self._wait_for_discovery(light_name)
         return self._lights.get(light_name)
 
     def get_group_names(self) -> SortedList:
         """ list of strings """
+        self._wait_for_discovery()
         return SortedList(self._groups.keys())
 
     def get_group_lights(self, group_name):
         """ list of light names or None """
+        self._wait_for_discovery()
         return self._groups.get(group_name)
 
     def get_location_names(self) -> SortedList:
         """ list of strings, each containing a location name """
+        self._wait_for_discovery()
         return SortedList(self._locations.keys())
 
     def get_location_lights(self, loc_name):
         """ list of light names or None """
+        self._wait_for_discovery()
         return self._locations.get(loc_name)
 
     @inject(i_controller.LightApi)
     def set_color_all_lights(self, color, duration, light_api):
         color = param_color(color)
         duration = param_32(duration)
+        self._cancel_queued(False)
+        shadow_state.invalidate_all(
+            shadow_state.COLOR, shadow_state.ZONES, shadow_state.MATRIX)
         light_api.set_color_all_lights(rounded_color(color), duration)
         return True
 
@@ -147,9 +249,43 @@ class LightSet(i_controller.LightSet):
     def set_power_all_lights(self, power_level, duration, light_api):
         power_level = param_bool(power_level)
         duration = param_32(duration)
+        self._cancel_queued(True)
+        shadow_state.invalidate_all(shadow_state.POWER)
         light_api.set_power_all_lights(power_level, duration)
         return True
 
+    def flush_writes(self) -> None:
+        # Send whatever is waiting in the output queues right away.
+        for light in list(self._lights.values()):
+            if isinstance(light, output_queue.QueuedLight):
+                light.flush()
+
+    def _cancel_queued(self, power) -> None:
+        # A broadcast supersedes any writes still waiting in output queues.
+        for light in list(self._lights.values()):
+            if isinstance(light, output_queue.QueuedLight):
+                light.cancel(power)
+
+    def set_color_lights(self, lights, color, duration):
+        """ Returns a list of (light_name, reason) for lights that failed. """
+        color = param_color(color)
+        duration = param_32(duration)
+        return self._get_batch().run(
+            lights, lambda light: light.set_color(color, duration))
+
+    def set_power_lights(self, lights, power_level, duration):
+        """ Returns a list of (light_name, reason) for lights that failed. """
+        return self._get_batch().run(
+            lights, lambda light: light.set_power(power_level, duration))
+
+    @inject(i_lib.Settings)
+    def _get_batch(self, settings):
+        if self._batch is None:
+            self._batch = Batch(
+                int(settings.get_value('batch_workers', 16)),
+                float(settings.get_value('batch_deadline', 2.0)))
+        return self._batch
+
     def get_successful_discovers(self):
         return self._num_successful_discovers
 
@@ -184,8 +320,12 @@ def _light_refresh():
 @inject(i_lib.Settings)
 def configure(settings):
     light_set = LightSet()
-    light_set.discover()
+    bind_instance(light_set).to(i_controller.LightSet)
+    from_inventory = light_set.load_inventory() > 0
+    if from_inventory or bool(
+            settings.get_value('background_discovery', True)):
+        light_set.discover_in_background()
+    else:
+        light_set.discover()
     if not bool(settings.get_value('single_light_discover', False)):
         _start_light_refresh()
-
-    bind_instance(light_set).to(i_controller.LightSet)
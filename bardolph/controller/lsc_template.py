@@ -54,9 +54,7 @@ def main():
     arg_helper.add_n_argument(ap)
     args = ap.parse_args()
 
-    overrides = {
-        'sleep_time': 0.1
-    }
+    overrides = {}
     if args.verbose:
         overrides['log_level'] = logging.DEBUG
         overrides['log_to_console'] = True
@@ -0,0 +1,361 @@
+"""
+Per-light output queues that sit between the VM and the lights.
+
+Writes to a light go out no faster than a maximum rate. A write that can't
+be sent yet waits in the light's queue, where a later write of the same kind
+replaces it (last writer wins). A write that is identical to the one before
+it is dropped if it comes too soon to be sent anyway. Zone writes that are
+waiting are merged, so that painting a strip one zone at a time goes out as
+a single write.
+"""
+
+import heapq
+import itertools
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+from bardolph.controller import i_controller
+
+_COLOR = ('color',)
+_POWER = ('power',)
+_MATRIX = ('matrix',)
+_ZONES = ('zones',)
+
+
+def _now():
+    return time.monotonic()
+
+
+class _Dispatcher:
+    """
+    One background thread that sends the queued writes for every light,
+    each one when its light's rate allows.
+    """
+    def __init__(self):
+        self._heap = []
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._thread = None
+
+    def schedule(self, due_time, light_queue) -> None:
+        with self._cond:
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._run, name='output_queue', daemon=True)
+                self._thread.start()
+            entry = (due_time, next(self._seq), light_queue)
+            heapq.heappush(self._heap, entry)
+            if self._heap[0] is entry:
+                self._cond.notify()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._heap or self._heap[0][0] > _now():
+                    if self._heap:
+                        self._cond.wait(self._heap[0][0] - _now())
+                    else:
+                        self._cond.wait()
+                light_queue = heapq.heappop(self._heap)[2]
+            try:
+                light_queue.send_next()
+            except Exception as ex:
+                logging.error("Queued write failed: {}".format(ex))
+
+
+_dispatcher = _Dispatcher()
+
+
+class _LightQueue:
+    def __init__(self, light, max_rate):
+        self._light = light
+        self._interval = 1.0 / max_rate
+        self._lock = threading.Lock()
+        self._send_lock = threading.Lock()
+        self._pending = OrderedDict()
+        self._last = None
+        self._next_time = 0.0
+        self._scheduled = False
+
+    def set_light(self, light) -> None:
+        self._light = light
+
+    def write(self, kind, value, send_fn, merge=None) -> None:
+        """
+        kind identifies what gets replaced: a write to the whole light
+        replaces pending color, zone, and matrix writes, but not power.
+        value is used to detect duplicates, and send_fn(light) does the
+        actual write.
+
+        If merge is supplied, a pending write of the same kind is combined
+        with this one instead of being replaced: merge(pending_value, value)
+        returns a (value, send_fn) tuple to take the pending write's place.
+        """
+        with self._lock:
+            if merge is not None and kind in self._pending:
+                self._pending[kind] = merge(self._pending[kind][0], value)
+                return
+            if kind in (_COLOR, _MATRIX):
+                for pending_kind in list(self._pending.keys()):
+                    if pending_kind is not _POWER:
+                        del self._pending[pending_kind]
+            elif kind in self._pending:
+                if self._pending[kind][0] == value:
+                    return
+                del self._pending[kind]
+
+            now = _now()
+            if now < self._next_time or len(self._pending) > 0:
+                if (len(self._pending) == 0
+                        and self._last == (kind, value)):
+                    return
+                self._pending[kind] = (value, send_fn)
+                self._schedule()
+                return
+            self._next_time = now + self._interval
+            self._last = (kind, value)
+            self._send_lock.acquire()
+        try:
+            send_fn(self._light)
+        finally:
+            self._send_lock.release()
+
+    def cancel(self, power) -> None:
+        # Forget pending writes that have been overridden from outside the
+        # queue, either the power or everything else.
+        with self._lock:
+            for kind in list(self._pending.keys()):
+                if (kind is _POWER) == power:
+                    del self._pending[kind]
+            self._last = None
+
+    def send_next(self) -> None:
+        # Called from the dispatcher thread when this queue is due.
+        with self._lock:
+            self._scheduled = False
+            if len(self._pending) == 0:
+                return
+            now = _now()
+            if now < self._next_time:
+                self._schedule()
+                return
+            kind, (value, send_fn) = self._pending.popitem(last=False)
+            self._next_time = now + self._interval
+            self._last = (kind, value)
+            if len(self._pending) > 0:
+                self._schedule()
+            self._send_lock.acquire()
+        try:
+            send_fn(self._light)
+        finally:
+            self._send_lock.release()
+
+    def flush(self) -> None:
+        # Send everything that's pending right away, to be followed by a read.
+        with self._lock:
+            items = list(self._pending.items())
+            self._pending.clear()
+            if len(items) > 0:
+                self._next_time = _now() + self._interval
+                self._last = (items[-1][0], items[-1][1][0])
+            self._send_lock.acquire()
+        try:
+            for _, (_, send_fn) in items:
+                send_fn(self._light)
+        finally:
+            self._send_lock.release()
+
+    def _schedule(self) -> None:
+        if not self._scheduled:
+            self._scheduled = True
+            _dispatcher.schedule(self._next_time, self)
+
+
+class QueuedLight(i_controller.Light):
+    """
+    Stands in for a light, passing reads straight through and sending writes
+    through a _LightQueue. Pending writes are sent before any read.
+    """
+    def __init__(self, light, max_rate):
+        self._light = light
+        self._queue = _LightQueue(light, max_rate)
+
+    def __getattr__(self, name):
+        return getattr(self._light, name)
+
+    def get_target(self):
+        return self._light
+
+    def set_target(self, light) -> None:
+        # A newly-discovered instance of the same light.
+        self._light = light
+        self._queue.set_light(light)
+
+    def cancel(self, power=False) -> None:
+        self._queue.cancel(power)
+
+    def flush(self) -> None:
+        self._queue.flush()
+
+    def get_uid(self):
+        return self._light.get_uid()
+
+    def get_name(self):
+        return self._light.get_name()
+
+    def get_group(self):
+        return self._light.get_group()
+
+    def get_location(self):
+        return self._light.get_location()
+
+    def get_height(self) -> int:
+        return self._light.get_height()
+
+    def get_width(self) -> int:
+        return self._light.get_width()
+
+    def is_color(self) -> bool:
+        return self._light.is_color()
+
+    def get_age(self) -> float:
+        return self._light.get_age()
+
+    def get_color(self):
+        self._queue.flush()
+        return self._light.get_color()
+
+    def set_color(self, color, duration) -> None:
+        color = list(color)
+        self._queue.write(
+            _COLOR, (color, duration),
+            lambda light: light.set_color(color, duration))
+
+    def get_power(self):
+        self._queue.flush()
+        return self._light.get_power()
+
+    def set_power(self, power, duration) -> None:
+        self._queue.write(
+            _POWER, (power, duration),
+            lambda light: light.set_power(power, duration))
+
+
+class QueuedMultizoneLight(QueuedLight, i_controller.MultizoneLight):
+    def get_zone_colors(self, first_zone=None, last_zone=None):
+        self._queue.flush()
+        return self._light.get_zone_colors(first_zone, last_zone)
+
+    def set_zone_colors(self, first_zone, last_zone, color, duration) -> None:
+        self.set_zone_list(
+            first_zone, [color] * (last_zone - first_zone), duration)
+
+    def set_zone_list(self, first_zone, colors, duration) -> None:
+        value = (first_zone,
+                 [None if color is None else list(color) for color in colors],
+                 duration)
+        self._queue.write(
+            _ZONES, value, QueuedMultizoneLight._zone_writer(value),
+            QueuedMultizoneLight._merge_zones)
+
+    @staticmethod
+    def _zone_writer(value):
+        return lambda light: light.set_zone_list(*value)
+
+    @staticmethod
+    def _merge_zones(pending, value):
+        # The later write wins for any zone that is in both, and so does its
+        # duration.
+        first_zone = min(pending[0], value[0])
+        end_zone = max(pending[0] + len(pending[1]), value[0] + len(value[1]))
+        colors = [None] * (end_zone - first_zone)
+        for start, zone_colors, _ in (pending, value):
+            for offset, color in enumerate(zone_colors):
+                if color is not None:
+                    colors[start - first_zone + offset] = color
+        merged = (first_zone, colors, value[2])
+        return merged, QueuedMultizoneLight._zone_writer(merged)
+
+
+class QueuedMatrixLight(QueuedLight, i_controller.MatrixLight):
+    """
+    If the light can take a frame that is already packed, as a
+    lifx_lan_light.MatrixLight can, each matrix is packed into a buffer that
+    belongs to this light and is compared with the one before it. Only the
+    latest frame is kept for sending, so no memory is allocated for a frame.
+    Otherwise, and for a matrix with None cells, the queue gets a copy of
+    the matrix.
+    """
+    def __init__(self, light, max_rate):
+        super().__init__(light, max_rate)
+        self._frame_lock = threading.Lock()
+        self._version = 0
+        self._reset_frames()
+        self._frame_writer = self._write_frame
+
+    def set_target(self, light) -> None:
+        # The new instance may have a different layout.
+        with self._frame_lock:
+            super().set_target(light)
+            self._reset_frames()
+
+    def get_matrix(self):
+        self._queue.flush()
+        return self._light.get_matrix()
+
+    def set_matrix(self, matrix, duration=0) -> None:
+        light = self._light
+        if not hasattr(light, 'set_frame') or not matrix.is_complete():
+            self._set_matrix_copy(matrix, duration)
+            return
+        with self._frame_lock:
+            if self._latest is None:
+                self._latest = light.new_frame()
+                self._scratch = light.new_frame()
+                self._sending = light.new_frame()
+                self._version += 1
+            light.pack_frame(matrix, self._scratch)
+            if self._scratch != self._latest or duration != self._duration:
+                self._latest, self._scratch = self._scratch, self._latest
+                self._duration = duration
+                self._version += 1
+            version = self._version
+        self._queue.write(_MATRIX, version, self._frame_writer)
+
+    def _write_frame(self, light) -> None:
+        # Sends are never concurrent, so they can all use one buffer, which
+        # lets set_matrix() go on while a frame is being sent.
+        with self._frame_lock:
+            if self._latest is None:
+                return
+            frame = self._sending
+            frame[:] = self._latest
+            duration = self._duration
+        light.set_frame(frame, duration)
+
+    def _reset_frames(self) -> None:
+        self._latest = self._scratch = self._sending = None
+        self._duration = 0
+
+    def _set_matrix_copy(self, matrix, duration) -> None:
+        # The VM may keep modifying its matrix, so the queue gets a copy. The
+        # packed pixels, with the None cells marked, detect duplicates.
+        copy = type(matrix)(matrix.height, matrix.width).set_from_matrix(
+            matrix)
+        pixels = bytearray(matrix.height * matrix.width * 8)
+        matrix.pack_into(pixels, 0, 0, 0, matrix.height, matrix.width)
+        value = (bytes(pixels), matrix.is_complete() or tuple(
+            color is None for color in matrix.as_list()), duration)
+        self._queue.write(
+            _MATRIX, value, lambda light: light.set_matrix(copy, duration))
+
+
+def queued(light, max_rate):
+    """ Wrap light in the QueuedLight subclass that matches its type. """
+    if isinstance(light, i_controller.MatrixLight):
+        return QueuedMatrixLight(light, max_rate)
+    if isinstance(light, i_controller.MultizoneLight):
+        return QueuedMultizoneLight(light, max_rate)
+    return QueuedLight(light, max_rate)
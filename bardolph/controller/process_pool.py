@@ -0,0 +1,248 @@
+"""
+Worker processes that run compiled scripts, so that scripts running at the
+same time don't all compete for one interpreter lock.
+
+The lights stay in the process that started the workers, which is the only
+one that talks to them. Inside a worker, the LightSet is a stand-in that
+sends each light call back over a socket, as a tuple that starts with a
+small integer for the kind of message. Calls that return something, such
+as get_color, wait for the reply. Calls that return nothing, such as
+set_color, don't wait, and are sent together in one message when the
+script is about to wait for the clock, needs a reply, or is done, so they
+still reach the lights at the same time as they would have otherwise. The
+worker's side of this is in process_worker.
+
+While a script runs in a worker, the thread that handed it over carries out
+its light calls and returns when the script is done. To JobControl, that
+thread looks the same as one running the script itself.
+"""
+
+import logging
+import os
+import socket
+import subprocess
+import sys
+import threading
+from multiprocessing import connection
+
+from bardolph.controller import i_controller, process_worker
+from bardolph.controller.i_controller import (LightException, LightSet,
+                                              MatrixLight, MultizoneLight)
+from bardolph.lib.i_lib import Clock, Settings
+from bardolph.lib.injection import bind_instance, inject
+
+# The calls that a worker can make in this process.
+_METHODS = frozenset(
+    name
+    for intf in (LightSet, i_controller.Light, MultizoneLight, MatrixLight)
+    for name in vars(intf) if not name.startswith('_'))
+
+_MULTIPLE = ('set_color_lights', 'set_power_lights')
+
+
+class ProcessPool:
+    """
+    Up to process_pool_size worker processes, or one for each CPU if that
+    is 0. Workers are started as they are needed, and are kept for the next
+    script when one finishes. If the process_pool setting is False, the pool
+    is disabled, and scripts run in the thread that executes them. The pool
+    needs to pass a socket to each worker, so it is also disabled on
+    Windows.
+    """
+    @inject(Settings)
+    def __init__(self, settings):
+        self._enabled = bool(settings.get_value('process_pool', False))
+        if self._enabled and os.name == 'nt':
+            logging.warning('The process pool is not available on Windows.')
+            self._enabled = False
+        size = int(settings.get_value('process_pool_size', 0) or 0)
+        self._max_workers = size if size > 0 else (os.cpu_count() or 1)
+        self._idle = []
+        self._num_workers = 0
+        self._closed = False
+        self._cond = threading.Condition()
+
+    @property
+    def enabled(self) -> bool:
+        return self._enabled
+
+    def acquire(self, cancelled=None):
+        """
+        Returns a worker that isn't running anything, starting a new one if
+        there are fewer than the maximum. Otherwise, waits for one to be
+        released. If cancelled, a threading.Event, gets set first, returns
+        None.
+        """
+        with self._cond:
+            while True:
+                if cancelled is not None and cancelled.is_set():
+                    return None
+                if len(self._idle) > 0:
+                    return self._idle.pop()
+                if self._num_workers < self._max_workers:
+                    self._num_workers += 1
+                    break
+                self._cond.wait()
+        try:
+            return self._start_worker()
+        except Exception:
+            with self._cond:
+                self._num_workers -= 1
+                self._cond.notify()
+            raise
+
+    def release(self, worker) -> None:
+        with self._cond:
+            if self._closed or not worker.is_alive():
+                self._num_workers -= 1
+                worker.close()
+            else:
+                self._idle.append(worker)
+            self._cond.notify()
+
+    def cancel(self, cancelled) -> None:
+        # Wakes up acquire() calls that are waiting on the event.
+        with self._cond:
+            cancelled.set()
+            self._cond.notify_all()
+
+    def close(self) -> None:
+        """
+        Shuts down the idle workers now, and the busy ones as they are
+        released.
+        """
+        with self._cond:
+            self._closed = True
+            idle, self._idle = self._idle, []
+            self._num_workers -= len(idle)
+        for worker in idle:
+            worker.close()
+
+    @inject(Clock)
+    @inject(Settings)
+    def _start_worker(self, clock, settings):
+        # They get the same settings and kind of Clock as this process.
+        return _Worker(settings.get_all(), type(clock))
+
+
+class _Worker:
+    """
+    A worker process, started with its own module as the main one. Neither
+    forking, which isn't safe in a process that already has threads, such
+    as the web server's, nor multiprocessing's spawn, which imports this
+    process's main module again, is used.
+    """
+    def __init__(self, config, clock_type):
+        parent_socket, child_socket = socket.socketpair()
+        with child_socket:
+            fd = child_socket.fileno()
+            self._process = subprocess.Popen(
+                [sys.executable, '-m', process_worker.__name__, str(fd)],
+                pass_fds=(fd,), env=_worker_env())
+        self._conn = connection.Connection(parent_socket.detach())
+        self._send_lock = threading.Lock()
+        self._send((config, clock_type))
+
+    def is_alive(self) -> bool:
+        return self._process.poll() is None
+
+    @inject(LightSet)
+    def run(self, program, light_set):
+        """
+        Runs the program in the worker, carrying out its light calls in the
+        current thread. Returns the worker's MachineState when the program
+        is done, or None if the state couldn't be sent back.
+        """
+        self._send((process_worker.RUN, program))
+        while True:
+            try:
+                message = self._conn.recv()
+            except (EOFError, OSError):
+                logging.error('Script worker process exited.')
+                return None
+            kind = message[0]
+            if kind == process_worker.DONE:
+                return message[1]
+            if kind == process_worker.CALLS:
+                for call in message[1]:
+                    try:
+                        _carry_out(light_set, *call)
+                    except Exception as ex:
+                        logging.warning('Unable to {}: {}'.format(call[1], ex))
+                continue
+            try:
+                result = _carry_out(light_set, *message[1:])
+            except Exception as ex:
+                self._send((process_worker.ERROR, str(ex)))
+                continue
+            self._send((process_worker.REPLY, result))
+
+    def stop(self) -> None:
+        self._send((process_worker.STOP,))
+
+    def close(self) -> None:
+        # Closing the socket tells the worker to exit.
+        self._conn.close()
+        try:
+            self._process.wait(1.0)
+        except subprocess.TimeoutExpired:
+            self._process.terminate()
+            self._process.wait()
+
+    def _send(self, message) -> None:
+        with self._send_lock:
+            try:
+                self._conn.send(message)
+            except OSError as ex:
+                logging.error('Unable to reach script worker: {}'.format(ex))
+
+
+def _carry_out(light_set, name, method, args):
+    # Makes a worker's light call. A name of None is for the LightSet.
+    if method not in _METHODS:
+        raise LightException('Unknown light call: {}'.format(method))
+    if name is None:
+        target = light_set
+        if method in _MULTIPLE:
+            lights = (light_set.get_light(light_name)
+                      for light_name in args[0])
+            args = ([light for light in lights if light is not None],
+                    *args[1:])
+    else:
+        target = light_set.get_light(name)
+        if target is None:
+            return None
+    result = getattr(target, method)(*args)
+    if method == 'get_light':
+        return _describe(result)
+    if method == 'get_lights':
+        return [_describe(light) for light in result]
+    return result
+
+
+def _describe(light):
+    # Whatever a worker needs to stand in for the light.
+    if light is None:
+        return None
+    if isinstance(light, MatrixLight):
+        kind = process_worker.MATRIX_LIGHT
+    elif isinstance(light, MultizoneLight):
+        kind = process_worker.MULTIZONE_LIGHT
+    else:
+        kind = process_worker.PLAIN_LIGHT
+    return (kind, light.get_name(), light.get_uid(), light.get_group(),
+            light.get_location(), light.get_height(), light.get_width(),
+            light.is_color())
+
+
+def _worker_env():
+    # The worker finds modules where this process does, which can include
+    # directories that were added to sys.path after it started.
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(
+        os.path.abspath(path) if path else os.getcwd() for path in sys.path)
+    return env
+
+
+def configure():
+    bind_instance(ProcessPool()).to(ProcessPool)
@@ -0,0 +1,332 @@
+"""
+The worker side of the process pool. A worker is started as
+
+    python -m bardolph.controller.process_worker <fd>
+
+where fd is its end of a socket pair with the process that started it. The
+first message over the socket is the settings and the kind of Clock to use.
+Because the worker starts from this module, it never imports the main module
+of the process that started it.
+
+Messages are tuples that start with one of the small integers below.
+"""
+
+import logging
+import queue
+import sys
+import threading
+from multiprocessing import connection
+
+from bardolph.controller import i_controller
+from bardolph.controller.i_controller import (LightException, LightSet,
+                                              MatrixLight, MultizoneLight)
+from bardolph.lib import injection, log_config, settings, std_out_output
+from bardolph.lib.i_lib import Clock
+from bardolph.lib.injection import bind, bind_instance
+from bardolph.runtime import runtime_module
+from bardolph.vm.machine import Machine
+
+# Messages to a worker.
+RUN = 0
+STOP = 1
+REPLY = 2
+ERROR = 3
+
+# Messages from a worker.
+CALLS = 4
+QUERY = 5
+DONE = 6
+
+# The kinds of light, as described by the main process.
+PLAIN_LIGHT = 0
+MULTIZONE_LIGHT = 1
+MATRIX_LIGHT = 2
+
+# The most calls that a worker holds on to before sending them.
+_MAX_CALLS = 100
+
+
+class _Channel:
+    """
+    The worker's end of the socket. Calls are only made from the thread that
+    runs the script, so only it sends. Another thread receives, passing
+    replies back through a queue.
+    """
+    def __init__(self, conn):
+        self._conn = conn
+        self._replies = queue.SimpleQueue()
+        self._calls = []
+
+    def call(self, name, method, args) -> None:
+        self._calls.append((name, method, args))
+        if len(self._calls) >= _MAX_CALLS:
+            self.flush()
+
+    def flush(self) -> None:
+        if len(self._calls) > 0:
+            calls, self._calls = self._calls, []
+            self._conn.send((CALLS, calls))
+
+    def query(self, name, method, args):
+        self.flush()
+        self._conn.send((QUERY, name, method, args))
+        kind, value = self._replies.get()
+        if kind == ERROR:
+            raise LightException(value)
+        return value
+
+    def reply(self, kind, value) -> None:
+        self._replies.put((kind, value))
+
+
+class _FlushingClock(Clock):
+    """ Sends the calls that are being held before waiting. """
+    def __init__(self, clock, channel):
+        self._clock = clock
+        self._channel = channel
+
+    def start(self):
+        self._clock.start()
+
+    def stop(self):
+        self._clock.stop()
+
+    def reset(self):
+        self._clock.reset()
+
+    def pause_for(self, delay):
+        self._channel.flush()
+        self._clock.pause_for(delay)
+
+    def wait_until(self, time_pattern):
+        self._channel.flush()
+        self._clock.wait_until(time_pattern)
+
+
+def _call(method):
+    def call(self, *args):
+        self._channel.call(self._name, method, args)
+    call.__name__ = method
+    return call
+
+
+def _query(method):
+    def query(self, *args):
+        return self._channel.query(self._name, method, args)
+    query.__name__ = method
+    return query
+
+
+class _RemoteLight(i_controller.Light):
+    """
+    Stands in for a light in the main process. What doesn't change, such as
+    the name, comes along with the light, while everything else is a call.
+    """
+    def __init__(self, channel, name, uid, group, location, height, width,
+                 is_color):
+        self._channel = channel
+        self._name = name
+        self._uid = uid
+        self._group = group
+        self._location = location
+        self._height = height
+        self._width = width
+        self._is_color = is_color
+
+    def get_uid(self):
+        return self._uid
+
+    def get_name(self):
+        return self._name
+
+    def get_group(self):
+        return self._group
+
+    def get_location(self):
+        return self._location
+
+    def get_height(self):
+        return self._height
+
+    def get_width(self):
+        return self._width
+
+    def is_color(self):
+        return self._is_color
+
+    get_age = _query('get_age')
+    get_color = _query('get_color')
+    set_color = _call('set_color')
+    get_power = _query('get_power')
+    set_power = _call('set_power')
+
+
+class _RemoteMultizoneLight(_RemoteLight, MultizoneLight):
+    get_height = _RemoteLight.get_height
+    get_width = _RemoteLight.get_width
+    get_zone_colors = _query('get_zone_colors')
+    set_zone_colors = _call('set_zone_colors')
+    set_zone_list = _call('set_zone_list')
+
+
+class _RemoteMatrixLight(_RemoteLight, MatrixLight):
+    get_height = _RemoteLight.get_height
+    get_width = _RemoteLight.get_width
+    get_matrix = _query('get_matrix')
+    set_matrix = _call('set_matrix')
+
+
+_LIGHT_TYPES = {
+    PLAIN_LIGHT: _RemoteLight,
+    MULTIZONE_LIGHT: _RemoteMultizoneLight,
+    MATRIX_LIGHT: _RemoteMatrixLight
+}
+
+
+def _remote_light(channel, description):
+    if description is None:
+        return None
+    kind, *fields = description
+    return _LIGHT_TYPES[kind](channel, *fields)
+
+
+class _RemoteLightSet(LightSet):
+    """
+    The LightSet in a worker. Lights are remembered for the rest of the
+    script once they have been found.
+    """
+    def __init__(self, channel):
+        self._channel = channel
+        self._name = None
+        self._lights = {}
+
+    def clear(self) -> None:
+        self._lights.clear()
+
+    def get_light(self, light_name):
+        light = self._lights.get(light_name)
+        if light is None:
+            light = _remote_light(
+                self._channel,
+                self._channel.query(None, 'get_light', (light_name,)))
+            if light is not None:
+                self._lights[light_name] = light
+        return light
+
+    def get_lights(self):
+        return [_remote_light(self._channel, description)
+                for description in self._channel.query(
+                    None, 'get_lights', ())]
+
+    def set_color_lights(self, lights, color, duration):
+        self._channel.call(
+            None, 'set_color_lights',
+            ([light.get_name() for light in lights], color, duration))
+
+    def set_power_lights(self, lights, power_level, duration):
+        self._channel.call(
+            None, 'set_power_lights',
+            ([light.get_name() for light in lights], power_level, duration))
+
+    discover = _call('discover')
+    refresh = _call('refresh')
+    get_light_count = _query('get_light_count')
+    get_light_names = _query('get_light_names')
+    get_group_names = _query('get_group_names')
+    get_group_lights = _query('get_group_lights')
+    get_location_names = _query('get_location_names')
+    get_location_lights = _query('get_location_lights')
+    set_color_all_lights = _call('set_color_all_lights')
+    set_power_all_lights = _call('set_power_all_lights')
+    flush_writes = _call('flush_writes')
+
+
+class _WorkerMain:
+    """
+    Runs scripts, one at a time, in the worker's main thread, while another
+    thread reads the socket.
+    """
+    def __init__(self, conn, clock_type):
+        self._conn = conn
+        self._channel = _Channel(conn)
+        self._clock_type = clock_type
+        self._light_set = _RemoteLightSet(self._channel)
+        self._programs = queue.SimpleQueue()
+        self._machine = None
+        self._lock = threading.Lock()
+
+    def run(self) -> None:
+        bind(self._new_clock).to(Clock)
+        bind_instance(self._light_set).to(LightSet)
+        threading.Thread(target=self._read, daemon=True).start()
+        machine = Machine()
+        while True:
+            program = self._programs.get()
+            if program is None:
+                return
+            self._light_set.clear()
+            with self._lock:
+                self._machine = machine
+                machine.reset()
+            machine.run(program)
+            with self._lock:
+                self._machine = None
+            profile = machine.get_profile()
+            if profile is not None:
+                logging.info('Profile:\n{}'.format(profile.report()))
+            self._done(machine.get_state())
+
+    def _new_clock(self):
+        return _FlushingClock(self._clock_type(), self._channel)
+
+    def _done(self, state) -> None:
+        self._channel.flush()
+        try:
+            self._conn.send((DONE, state))
+        except Exception as ex:
+            # Nothing has been sent if the state can't be pickled.
+            logging.debug('Unable to send machine state: {}'.format(ex))
+            self._conn.send((DONE, None))
+
+    def _read(self) -> None:
+        while True:
+            try:
+                message = self._conn.recv()
+            except (EOFError, OSError):
+                # The main process is done with this worker.
+                self._channel.reply(ERROR, 'Main process went away.')
+                self._stop()
+                self._programs.put(None)
+                return
+            kind = message[0]
+            if kind == RUN:
+                self._programs.put(message[1])
+            elif kind == STOP:
+                self._stop()
+            else:
+                self._channel.reply(kind, message[1])
+
+    def _stop(self) -> None:
+        # A stop that arrives after the script is done is for that script,
+        # so it's ignored.
+        with self._lock:
+            if self._machine is not None:
+                self._machine.stop()
+
+
+def main() -> None:
+    conn = connection.Connection(int(sys.argv[1]))
+    try:
+        config, clock_type = conn.recv()
+    except (EOFError, OSError):
+        return
+    injection.configure()
+    settings.using(config).configure()
+    log_config.configure()
+    std_out_output.configure()
+    runtime_module.configure()
+    _WorkerMain(conn, clock_type).run()
+
+
+if __name__ == '__main__':
+    main()
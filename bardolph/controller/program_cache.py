@@ -0,0 +1,153 @@
+import hashlib
+import logging
+import os
+import pickle
+import stat
+import threading
+from importlib import metadata
+
+from bardolph.lib.cache import Cache
+from bardolph.lib.i_lib import Settings
+from bardolph.lib.injection import bind_instance, inject
+from bardolph.parser import optimizer
+from bardolph.vm.loader import CompiledProgram, Loader
+
+# Change this whenever the instructions or CompiledProgram change, so that
+# files written by an older version are ignored.
+_FORMAT = 2
+_SUFFIX = '.lsc'
+
+
+class ProgramCache:
+    """
+    Compiled scripts, keyed on a hash of their source text. A script that
+    has been compiled before is run without lexing, parsing, or optimizing
+    it again.
+
+    Programs are kept in memory and, if script_cache_dir is set, also saved
+    as files in that directory, so that they outlive the process, much like
+    .pyc files. If the script_cache setting is False, nothing is cached, and
+    add() returns the program unchanged.
+
+    The files are loaded with pickle, so they are read only if they, and the
+    directory they're in, belong to the current user and can't be written
+    by anyone else.
+    """
+    @inject(Settings)
+    def __init__(self, settings):
+        self._enabled = bool(settings.get_value('script_cache', False))
+        self._memory = Cache(int(settings.get_value('script_cache_size', 64)))
+        dir_name = settings.get_value('script_cache_dir', None)
+        self._dir_name = None if dir_name is None else os.path.expanduser(
+            dir_name)
+        self._lock = threading.Lock()
+        # The same source compiles differently with other optimizer passes
+        # or another version of Bardolph.
+        self._prefix = '{}\n{}\n{}\n'.format(
+            _FORMAT, _version(), ' '.join(optimizer.pass_names(
+                settings.get_value('optimizer_passes', None))))
+
+    def key(self, source) -> str:
+        text = self._prefix + source
+        return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+    def get(self, source):
+        """ Returns a CompiledProgram, or None if the source isn't cached. """
+        if not self._enabled:
+            return None
+        key = self.key(source)
+        with self._lock:
+            compiled = self._memory.get(key)
+        if compiled is None:
+            compiled = self._read(key)
+            if compiled is not None:
+                with self._lock:
+                    self._memory.put(key, compiled)
+        return compiled
+
+    def add(self, source, program):
+        """
+        Compiles the Parser's output for the source and caches the result.
+        Returns whatever the Machine should run: the CompiledProgram, or the
+        program itself if caching is off.
+        """
+        if not self._enabled:
+            return program
+        loader = Loader()
+        loader.load(program)
+        compiled = loader.get_compiled()
+        key = self.key(source)
+        with self._lock:
+            self._memory.put(key, compiled)
+        self._write(key, compiled)
+        return compiled
+
+    def _file_name(self, key) -> str:
+        return os.path.join(self._dir_name, key + _SUFFIX)
+
+    def _read(self, key):
+        if self._dir_name is None:
+            return None
+        file_name = self._file_name(key)
+        try:
+            with open(file_name, 'rb') as srce:
+                if not (_is_private(os.stat(self._dir_name))
+                        and _is_private(os.fstat(srce.fileno()))):
+                    logging.warning(
+                        "Not reading compiled script {}: it or its directory "
+                        "can be written by another user".format(file_name))
+                    return None
+                contents = pickle.load(srce)
+        except FileNotFoundError:
+            return None
+        except (OSError, pickle.UnpicklingError, AttributeError, EOFError,
+                ImportError, IndexError, TypeError, ValueError) as ex:
+            logging.warning(
+                "Unable to read compiled script {}: {}".format(file_name, ex))
+            return None
+        if not isinstance(contents, tuple) or len(contents) != 3:
+            return None
+        file_format, code, routines = contents
+        if file_format != _FORMAT:
+            return None
+        return CompiledProgram(code, routines)
+
+    def _write(self, key, compiled) -> None:
+        # Writes to a temporary file first, so that a concurrent read never
+        # sees a partial file. The temporary file's name is unique to the
+        # process and thread, because other processes can share the
+        # directory.
+        if self._dir_name is None:
+            return
+        file_name = self._file_name(key)
+        temp_name = '{}.{}.{}.tmp'.format(
+            file_name, os.getpid(), threading.get_ident())
+        try:
+            contents = pickle.dumps(
+                (_FORMAT, compiled.code, compiled.routines))
+            os.makedirs(self._dir_name, mode=0o700, exist_ok=True)
+            with open(temp_name, 'wb') as dest:
+                dest.write(contents)
+            os.replace(temp_name, file_name)
+        except (OSError, pickle.PicklingError) as ex:
+            logging.warning(
+                "Unable to write compiled script {}: {}".format(file_name, ex))
+
+
+def _version() -> str:
+    try:
+        return metadata.version('bardolph')
+    except metadata.PackageNotFoundError:
+        # Running from a source tree that isn't installed.
+        return 'unknown'
+
+
+def _is_private(status) -> bool:
+    # Owned by the current user, and not writable by the group or others.
+    if hasattr(os, 'getuid') and status.st_uid != os.getuid():
+        return False
+    return status.st_mode & (stat.S_IWGRP | stat.S_IWOTH) == 0
+
+
+def configure():
+    bind_instance(ProgramCache()).to(ProgramCache)
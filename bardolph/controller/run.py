@@ -30,7 +30,11 @@ def init_args():
     parser.add_argument(
         '-s', '--script', help='run script from command line', action='store')
     parser.add_argument(
-        '-v', '--verbose', help='verbose output', action='store_true')
+        '-v', '--verbose', action='store_true',
+        help='verbose output, including a profile of each script')
+    parser.add_argument(
+        '-d', '--delivery',
+        help='how to send writes: acked, rapid, or rapid*n to send n times')
     return parser.parse_args()
 
 
@@ -39,11 +43,14 @@ def init_settings(args):
         'log_date_format': "%I:%M:%S %p",
         'log_format': '%(asctime)s %(filename)s(%(lineno)d): %(message)s',
         'log_level': logging.DEBUG if args.verbose else logging.INFO,
-        'log_to_console': True,
-        'sleep_time': 0.1
+        'log_to_console': True
     }
+    if args.verbose:
+        overrides['vm_profile'] = True
     if args.fakes:
         overrides['use_fakes'] = True
+    if args.delivery is not None:
+        overrides['delivery_mode'] = args.delivery
 
     settings_init = settings.using(
         config_values.functional).add_overrides(overrides)
@@ -1,5 +1,10 @@
 import logging
+import threading
 
+from bardolph.controller.process_pool import ProcessPool
+from bardolph.controller.program_cache import ProgramCache
+from bardolph.lib.i_lib import Settings
+from bardolph.lib.injection import inject
 from bardolph.lib.job_control import Job
 from bardolph.vm.machine import Machine, MachineState, Registers
 from bardolph.parser.parse import Parser
@@ -9,8 +14,19 @@ class ScriptJob(Job):
     def __init__(self):
         super().__init__()
         self._program = None
-        self._parser = Parser()
+        self._parser = self._new_parser()
         self._machine = Machine()
+        self._worker = None
+        self._worker_lock = threading.Lock()
+        self._cancelled = threading.Event()
+        self._remote_state = None
+
+    @staticmethod
+    @inject(Settings)
+    def _new_parser(settings):
+        if settings.get_value('parse_cache', False):
+            return Parser(int(settings.get_value('parse_cache_size', 1000)))
+        return Parser()
 
     @staticmethod
     def from_file(file_name):
@@ -25,21 +41,32 @@ class ScriptJob(Job):
         return new_instance
 
     def load_file(self, file_name):
-        if self._parser.parse_file(file_name):
-            self._program = self._parser.get_program()
-        else:
-            logging.error("{}, {}".format(file_name, self._parser.get_errors()))
+        input_string = Parser.read_file(file_name)
+        if input_string is None:
             self._program = []
+        else:
+            self._program = self._compile(input_string)
+            if self._program is None:
+                logging.error(
+                    "{}, {}".format(file_name, self._parser.get_errors()))
+                self._program = []
         return self._program
 
     def load_string(self, input_string):
-        if self._parser.parse(input_string):
-            self._program = self._parser.get_program()
-        else:
-            self._program = None
+        self._program = self._compile(input_string)
+        if self._program is None:
             logging.error(self._parser.get_errors())
         return self._program
 
+    @inject(ProgramCache)
+    def _compile(self, input_string, program_cache):
+        # Returns None if the script doesn't compile.
+        program = program_cache.get(input_string)
+        if program is None and self._parser.parse(input_string):
+            program = program_cache.add(
+                input_string, self._parser.get_program())
+        return program
+
     @property
     def program(self):
         return self._program
@@ -49,12 +76,46 @@ class ScriptJob(Job):
         return self._parser.get_errors()
 
     def get_machine_state(self) -> MachineState:
+        if self._remote_state is not None:
+            return self._remote_state
         return self._machine.get_state()
 
-    def execute(self):
-        if self._program is not None:
+    @inject(ProcessPool)
+    def execute(self, pool):
+        if self._program is None:
+            return
+        if pool.enabled:
+            self._execute_remote(pool)
+        else:
             self._machine.reset()
             self._machine.run(self._program)
+            profile = self._machine.get_profile()
+            if profile is not None:
+                logging.info('Profile:\n{}'.format(profile.report()))
+
+    def _execute_remote(self, pool):
+        # The program runs in one of the pool's processes, while this thread
+        # carries out its light calls, until the program is done.
+        self._cancelled.clear()
+        worker = pool.acquire(self._cancelled)
+        if worker is None:
+            return
+        with self._worker_lock:
+            self._worker = worker
+        try:
+            self._remote_state = worker.run(self._program)
+        finally:
+            # A stop sent while this job has the worker reaches the worker
+            # before the next job's program does.
+            with self._worker_lock:
+                self._worker = None
+            pool.release(worker)
 
-    def request_stop(self):
+    @inject(ProcessPool)
+    def request_stop(self, pool):
         self._machine.stop()
+        if pool.enabled:
+            pool.cancel(self._cancelled)
+            with self._worker_lock:
+                if self._worker is not None:
+                    self._worker.stop()
@@ -0,0 +1,115 @@
+"""
+The last known state of each device, as of its most recent successful read
+or write. Values older than a given age are treated as unknown.
+
+A value is confirmed if it was read from the device or written with an
+acknowledgement. Only a confirmed value can cause a write to be skipped as
+redundant, so that a lost rapid-mode packet doesn't also suppress the retries.
+"""
+
+import copy
+import threading
+import time
+
+from bardolph.controller import tile_packet
+
+COLOR = 'color'
+POWER = 'power'
+ZONES = 'zones'
+MATRIX = 'matrix'
+
+
+class ShadowState:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def get(self, kind, max_age, confirmed=False):
+        """
+        A copy of the value if it's no older than max_age, else None. If
+        confirmed is True, an unconfirmed value is also treated as unknown.
+        """
+        with self._lock:
+            entry = self._values.get(kind)
+            if (entry is None or time.monotonic() - entry[1] > max_age
+                    or (confirmed and not entry[2])):
+                return None
+            return copy.deepcopy(entry[0])
+
+    def matches(self, kind, value, max_age) -> bool:
+        # Used to skip redundant writes, so only a confirmed value counts.
+        with self._lock:
+            entry = self._values.get(kind)
+            return (entry is not None
+                    and time.monotonic() - entry[1] <= max_age
+                    and entry[2]
+                    and entry[0] == value)
+
+    def put(self, kind, value, confirmed=True) -> None:
+        with self._lock:
+            self._values[kind] = (
+                copy.deepcopy(value), time.monotonic(), confirmed)
+
+    def put_color(self, color, confirmed=True) -> None:
+        # The whole device is set to one color, so every zone or cell that
+        # is known now has that color. A matrix is kept as a packed frame of
+        # pixels, the same size as before.
+        with self._lock:
+            now = time.monotonic()
+            self._values[COLOR] = (list(color), now, confirmed)
+            entry = self._values.get(ZONES)
+            if entry is not None:
+                self._values[ZONES] = (
+                    [list(color) for _ in entry[0]], now, confirmed)
+            entry = self._values.get(MATRIX)
+            if entry is not None:
+                pixel = tile_packet.PIXEL.pack(*color)
+                self._values[MATRIX] = (
+                    pixel * (len(entry[0]) // len(pixel)), now, confirmed)
+
+    def put_zones(self, changes, confirmed=True) -> None:
+        # changes is a dict of zone number to color. The zones stay
+        # confirmed only if they were before and this write is too.
+        with self._lock:
+            self._values.pop(COLOR, None)
+            entry = self._values.get(ZONES)
+            if entry is not None:
+                zones = entry[0]
+                for zone, color in changes.items():
+                    if zone < len(zones):
+                        zones[zone] = list(color)
+                self._values[ZONES] = (
+                    zones, time.monotonic(), entry[2] and confirmed)
+
+    def invalidate(self, *kinds) -> None:
+        with self._lock:
+            for kind in kinds:
+                self._values.pop(kind, None)
+
+
+_shadows = {}
+_shadows_lock = threading.Lock()
+
+
+def for_device(uid) -> ShadowState:
+    """
+    The ShadowState for a device. The same one is returned every time, so
+    that the state survives when discovery builds a new proxy for the same
+    device.
+    """
+    with _shadows_lock:
+        shadow = _shadows.get(uid)
+        if shadow is None:
+            shadow = _shadows[uid] = ShadowState()
+        return shadow
+
+
+def invalidate_all(*kinds) -> None:
+    """
+    Forget the given kinds of values for every device, as after a broadcast,
+    which reaches every device but isn't acknowledged by any of them.
+    """
+    with _shadows_lock:
+        shadows = list(_shadows.values())
+    for shadow in shadows:
+        shadow.invalidate(*kinds)
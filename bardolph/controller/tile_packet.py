@@ -0,0 +1,71 @@
+"""
+A SetTileState64 message kept in a preallocated buffer. The header is
+packed once for each light. Before each send, only the payload fields and
+the pixels are written in place, so the matrix output path doesn't build a
+message object for every frame.
+"""
+
+import socket
+import struct
+import threading
+
+from lifxlan.errors import WorkflowException
+
+_HEADER_SIZE = 36
+_FIELDS = struct.Struct('<BBBBBBI')
+_COLORS_OFFSET = _HEADER_SIZE + _FIELDS.size
+_SET_TILE_STATE_64 = 715
+_PROTOCOL = 1024
+_ADDRESSABLE = 1 << 12
+
+# The most pixels in one message, and the format and size of each pixel:
+# h, s, b, k as uint16.
+MAX_PIXELS = 64
+PIXEL = struct.Struct('<4H')
+PIXEL_SIZE = PIXEL.size
+SIZE = _COLORS_OFFSET + MAX_PIXELS * PIXEL_SIZE
+
+
+class TilePacket:
+    def __init__(self, mac_addr, source_id):
+        self._buffer = bytearray(SIZE)
+        self._view = memoryview(self._buffer)
+        struct.pack_into(
+            '<HHI', self._buffer, 0, SIZE, _PROTOCOL | _ADDRESSABLE,
+            source_id)
+        self._buffer[8:14] = bytes.fromhex(mac_addr.replace(':', ''))
+        struct.pack_into('<H', self._buffer, 32, _SET_TILE_STATE_64)
+
+    @property
+    def colors(self) -> memoryview:
+        """ Where the pixels go, 8 bytes each: h, s, b, k as uint16. """
+        return self._view[_COLORS_OFFSET:]
+
+    @property
+    def message(self) -> memoryview:
+        return self._view
+
+    def set_fields(self, tile_index, length, y, width, duration) -> None:
+        _FIELDS.pack_into(
+            self._buffer, _HEADER_SIZE, tile_index, length, 0, 0, y, width,
+            duration)
+
+    def send(self, address) -> None:
+        """ Send without asking for an acknowledgement. """
+        try:
+            _get_socket().sendto(self._view, address)
+        except OSError as ex:
+            raise WorkflowException(
+                'Unable to send to {}: {}'.format(address, ex))
+
+
+_socket = None
+_socket_lock = threading.Lock()
+
+
+def _get_socket():
+    global _socket
+    with _socket_lock:
+        if _socket is None:
+            _socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        return _socket
@@ -123,6 +123,18 @@ class MultizoneLight(Light, i_controller.MultizoneLight):
         for zone in range(start_index, end_index):
             self._zone_colors[zone] = color.copy()
 
+    def set_zone_list(self, first_zone, colors, duration):
+        # Consecutive zones of the same color are set together, and None
+        # leaves a zone unchanged.
+        start = 0
+        for offset in range(1, len(colors) + 1):
+            if offset == len(colors) or colors[offset] != colors[start]:
+                if colors[start] is not None:
+                    self.set_zone_colors(
+                        first_zone + start, first_zone + offset,
+                        colors[start], duration)
+                start = offset
+
 
 class MatrixLight(Light, i_controller.MatrixLight):
     def __init__(self, name, group, location, height=6, width=5):
@@ -0,0 +1,451 @@
+"""
+LIFX devices simulated on a local UDP socket, for testing the LAN code
+without any lights. Every simulated device shares the one socket, and a
+message goes to the device whose MAC address is its target, or, if the
+message is tagged, to all of them.
+
+The simulator runs in a daemon thread:
+
+    simulator = LanSimulator()
+    simulator.add_device(SimulatedBulb('d0:73:d5:00:00:01', 'Top'))
+    simulator.start()
+    ... send to simulator.get_address() ...
+    simulator.stop()
+
+Latency, packet loss, and a per-device rate limit can be added, to see how
+the code copes with a slow or congested network. To run it on its own, for
+load testing with real scripts:
+
+    python -m bardolph.fakes.lan_simulator --bulbs 50 --loss 0.02
+"""
+
+import argparse
+import collections
+import heapq
+import itertools
+import logging
+import random
+import socket
+import threading
+import time
+
+from bardolph.controller import lan_protocol as lp
+
+_SERVICE_UDP = 1
+_BUFFER_SIZE = 2048
+_POLL_TIME = 0.1 # seconds
+_MAC_PREFIX = 'd0:73:d5:'
+
+
+class SimulatedBulb:
+    product = 27
+    firmware = (3, 70)
+
+    def __init__(self, mac_addr, label, group='', location='',
+                 color=None, power=0):
+        self.mac_addr = mac_addr
+        self.label = label
+        self.group = group
+        self.location = location
+        self.color = list(color or [0, 0, 0, 0])
+        self.power = power
+        self.received = []
+
+    def handle(self, msg_type, fields, port):
+        """
+        Apply a message and return a list of (message type, fields) for the
+        responses, not counting the acknowledgement.
+        """
+        self.received.append(msg_type)
+        if msg_type == lp.GET_SERVICE:
+            return [(lp.STATE_SERVICE,
+                     {'service': _SERVICE_UDP, 'port': port})]
+        if msg_type == lp.GET_HOST_FIRMWARE:
+            major, minor = self.firmware
+            return [(lp.STATE_HOST_FIRMWARE, {
+                'build': 0, 'reserved': 0, 'version': (major << 16) | minor
+            })]
+        if msg_type == lp.GET_VERSION:
+            return [(lp.STATE_VERSION,
+                     {'vendor': 1, 'product': self.product, 'version': 0})]
+        if msg_type == lp.GET_LABEL:
+            return [(lp.STATE_LABEL, {'label': self.label})]
+        if msg_type == lp.GET_GROUP:
+            return [(lp.STATE_GROUP, {'label': self.group})]
+        if msg_type == lp.GET_LOCATION:
+            return [(lp.STATE_LOCATION, {'label': self.location})]
+        if msg_type == lp.LIGHT_GET:
+            return [(lp.LIGHT_STATE, {
+                'color': self.color, 'power': self.power, 'label': self.label
+            })]
+        if msg_type == lp.LIGHT_SET_COLOR:
+            self.color = fields['color']
+            return [(lp.LIGHT_STATE, {
+                'color': self.color, 'power': self.power, 'label': self.label
+            })]
+        if msg_type == lp.LIGHT_GET_POWER:
+            return [(lp.LIGHT_STATE_POWER, {'level': self.power})]
+        if msg_type == lp.LIGHT_SET_POWER:
+            self.power = fields['level']
+            return [(lp.LIGHT_STATE_POWER, {'level': self.power})]
+        return []
+
+
+class SimulatedMultizone(SimulatedBulb):
+    """
+    If extended is False, the extended multizone messages are ignored, and
+    the firmware is older than the version that supports them.
+    """
+    product = 32
+
+    def __init__(self, mac_addr, label, group='', location='', num_zones=16,
+                 extended=True):
+        super().__init__(mac_addr, label, group, location)
+        self.zones = [[0, 0, 0, 0] for _ in range(0, num_zones)]
+        self.extended = extended
+        if not extended:
+            self.firmware = (2, 76)
+
+    def handle(self, msg_type, fields, port):
+        if msg_type == lp.LIGHT_SET_COLOR:
+            self.zones = [list(fields['color']) for _ in self.zones]
+        if msg_type == lp.GET_COLOR_ZONES:
+            # One response for every 8 zones in the requested range.
+            self.received.append(msg_type)
+            count = len(self.zones)
+            end = min(fields['end_index'], count - 1)
+            return [(lp.STATE_MULTI_ZONE, {
+                'count': count, 'index': index,
+                'colors': self.zones[index:index + 8]
+            }) for index in range(fields['start_index'], end + 1, 8)]
+        if msg_type == lp.SET_COLOR_ZONES:
+            self.received.append(msg_type)
+            end = min(fields['end_index'], len(self.zones) - 1)
+            for zone in range(fields['start_index'], end + 1):
+                self.zones[zone] = fields['color']
+            return []
+        if self.extended and msg_type == lp.GET_EXTENDED_COLOR_ZONES:
+            self.received.append(msg_type)
+            return [(lp.STATE_EXTENDED_COLOR_ZONES, {
+                'count': len(self.zones), 'index': 0,
+                'colors': self.zones[0:lp.MAX_EXTENDED_ZONES]
+            })]
+        if self.extended and msg_type == lp.SET_EXTENDED_COLOR_ZONES:
+            self.received.append(msg_type)
+            index = fields['index']
+            colors = fields['colors'][0:len(self.zones) - index]
+            self.zones[index:index + len(colors)] = colors
+            return []
+        if msg_type in (lp.GET_EXTENDED_COLOR_ZONES,
+                        lp.SET_EXTENDED_COLOR_ZONES):
+            self.received.append(msg_type)
+            return []
+        return super().handle(msg_type, fields, port)
+
+
+class SimulatedMatrix(SimulatedBulb):
+    """ tiles is a list of (width, height) tuples. """
+    product = 55
+
+    def __init__(self, mac_addr, label, group='', location='', tiles=None):
+        super().__init__(mac_addr, label, group, location)
+        self.tiles = list(tiles or [(8, 8)])
+        self.pixels = [[[0, 0, 0, 0] for _ in range(0, width * height)]
+                       for width, height in self.tiles]
+
+    def handle(self, msg_type, fields, port):
+        if msg_type == lp.GET_DEVICE_CHAIN:
+            self.received.append(msg_type)
+            return [(lp.STATE_DEVICE_CHAIN,
+                     {'start_index': 0, 'tiles': self.tiles})]
+        if msg_type == lp.GET_64:
+            self.received.append(msg_type)
+            tile_index = fields['tile_index']
+            if tile_index >= len(self.tiles):
+                return []
+            width = self.tiles[tile_index][0]
+            start = fields['y'] * width
+            return [(lp.STATE_64, {
+                'tile_index': tile_index, 'y': fields['y'], 'width': width,
+                'colors': self.pixels[tile_index][
+                    start:start + lp.MAX_TILE_PIXELS]
+            })]
+        if msg_type == lp.SET_64:
+            self.received.append(msg_type)
+            first = fields['tile_index']
+            for tile_index in range(first, first + fields['length']):
+                if tile_index >= len(self.tiles):
+                    break
+                width, height = self.tiles[tile_index]
+                start = fields['y'] * fields['width']
+                count = min(lp.MAX_TILE_PIXELS, width * height - start)
+                self.pixels[tile_index][start:start + count] = (
+                    fields['colors'][0:count])
+            return []
+        return super().handle(msg_type, fields, port)
+
+
+class LanSimulator:
+    """
+    Network conditions, all off by default:
+        latency: seconds before each response goes out, plus a random amount
+            up to jitter.
+        loss: the probability that any one packet, in either direction, is
+            dropped.
+        rate_limit: the most messages per second that any one device will
+            handle. Messages beyond that are dropped, the way a real bulb
+            drops them when it's flooded. Zero means no limit.
+    """
+    def __init__(self, host='127.0.0.1', port=0, latency=0.0, jitter=0.0,
+                 loss=0.0, rate_limit=0, seed=None):
+        self._devices = {}
+        self._socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self._socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._socket.bind((host, port))
+        self._socket.settimeout(_POLL_TIME)
+        self._latency = latency
+        self._jitter = jitter
+        self._loss = loss
+        self._rate_limit = rate_limit
+        self._random = random.Random(seed)
+        self._arrivals = {}
+        self._outgoing = []
+        self._sequence = itertools.count()
+        self._stats = collections.Counter()
+        self._running = False
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def add_device(self, device):
+        with self._lock:
+            self._devices[device.mac_addr] = device
+        return device
+
+    def populate(self, num_bulbs=0, num_strips=0, num_tiles=0,
+                 group='Simulated', location='Simulated') -> list:
+        """
+        Add numbered bulbs, strips, and 5-tile chains, all in the same group
+        and location. Returns the new devices.
+        """
+        kinds = (
+            (num_bulbs, 'Bulb', SimulatedBulb, {}),
+            (num_strips, 'Strip', SimulatedMultizone, {}),
+            (num_tiles, 'Tile', SimulatedMatrix, {'tiles': [(8, 8)] * 5}))
+        devices = []
+        for count, name, cls, kwargs in kinds:
+            for number in range(1, count + 1):
+                devices.append(self.add_device(cls(
+                    self._new_mac(), '{} {}'.format(name, number), group,
+                    location, **kwargs)))
+        return devices
+
+    def _new_mac(self) -> str:
+        number = len(self._devices) + 1
+        while True:
+            mac_addr = _MAC_PREFIX + ':'.join(
+                '{:02x}'.format((number >> shift) & 0xff)
+                for shift in (16, 8, 0))
+            if mac_addr not in self._devices:
+                return mac_addr
+            number += 1
+
+    def get_device(self, mac_addr):
+        return self._devices.get(mac_addr)
+
+    def get_devices(self) -> list:
+        with self._lock:
+            return list(self._devices.values())
+
+    def get_address(self):
+        return self._socket.getsockname()
+
+    def get_stats(self) -> dict:
+        """
+        Counts of packets received, sent, lost (dropped on the way in or out),
+        and rate_limited.
+        """
+        with self._lock:
+            return {name: self._stats[name]
+                    for name in ('received', 'sent', 'lost', 'rate_limited')}
+
+    def reset_stats(self) -> None:
+        with self._lock:
+            self._stats.clear()
+
+    def start(self):
+        self._running = True
+        self._thread = threading.Thread(
+            target=self._serve, name='lan-simulator', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._running = False
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self._socket.close()
+
+    def serve_forever(self) -> None:
+        # Runs in the calling thread until stop() is called from another one.
+        self._running = True
+        self._serve()
+
+    def _serve(self) -> None:
+        while self._running:
+            data = None
+            timeout = self._time_to_next()
+            if timeout > 0.0:
+                self._socket.settimeout(timeout)
+                try:
+                    data, address = self._socket.recvfrom(_BUFFER_SIZE)
+                except socket.timeout:
+                    pass
+                except OSError:
+                    return
+            if data is not None:
+                try:
+                    self.receive(data, address)
+                except lp.ProtocolError as ex:
+                    logging.warning('LanSimulator: {}'.format(ex))
+            self._send_delayed()
+
+    def _time_to_next(self) -> float:
+        # How long to wait for a packet before a delayed one is due.
+        if len(self._outgoing) == 0:
+            return _POLL_TIME
+        due = self._outgoing[0][0] - time.monotonic()
+        return min(_POLL_TIME, max(0.0, due))
+
+    def receive(self, data, address) -> None:
+        header, payload = lp.unpack_message(data)
+        fields = lp.decode(header.msg_type, payload)
+        with self._lock:
+            self._stats['received'] += 1
+            if self._is_lost():
+                return
+            if header.tagged:
+                devices = list(self._devices.values())
+            else:
+                devices = [self._devices.get(header.target)]
+            for device in devices:
+                if device is not None and self._within_rate(device):
+                    self._respond(device, header, fields, address)
+
+    def _is_lost(self) -> bool:
+        if self._loss > 0.0 and self._random.random() < self._loss:
+            self._stats['lost'] += 1
+            return True
+        return False
+
+    def _within_rate(self, device) -> bool:
+        # Allows at most rate_limit messages to a device in any one second.
+        if self._rate_limit <= 0:
+            return True
+        arrivals = self._arrivals.setdefault(
+            device.mac_addr, collections.deque())
+        now = time.monotonic()
+        while len(arrivals) > 0 and now - arrivals[0] >= 1.0:
+            arrivals.popleft()
+        if len(arrivals) >= self._rate_limit:
+            self._stats['rate_limited'] += 1
+            return False
+        arrivals.append(now)
+        return True
+
+    def _respond(self, device, header, fields, address) -> None:
+        port = self.get_address()[1]
+        responses = device.handle(header.msg_type, fields, port)
+        if header.ack_required:
+            self._send(device, header, lp.ACKNOWLEDGEMENT, {}, address)
+        if header.res_required or header.msg_type not in _SETTERS:
+            for msg_type, response_fields in responses:
+                self._send(
+                    device, header, msg_type, response_fields, address)
+
+    def _send(self, device, header, msg_type, fields, address) -> None:
+        if self._is_lost():
+            return
+        message = lp.pack_message(
+            msg_type, lp.encode(msg_type, **fields), device.mac_addr,
+            header.source, header.sequence)
+        delay = self._latency
+        if self._jitter > 0.0:
+            delay += self._random.uniform(0.0, self._jitter)
+        if delay > 0.0:
+            heapq.heappush(self._outgoing, (
+                time.monotonic() + delay, next(self._sequence), message,
+                address))
+        else:
+            self._sendto(message, address)
+
+    def _send_delayed(self) -> None:
+        now = time.monotonic()
+        while len(self._outgoing) > 0 and self._outgoing[0][0] <= now:
+            _, _, message, address = heapq.heappop(self._outgoing)
+            self._sendto(message, address)
+
+    def _sendto(self, message, address) -> None:
+        try:
+            self._socket.sendto(message, address)
+            self._stats['sent'] += 1
+        except OSError as ex:
+            logging.debug('LanSimulator: {}'.format(ex))
+
+
+# Messages that only get a state response if res_required is set.
+_SETTERS = frozenset((
+    lp.LIGHT_SET_COLOR, lp.LIGHT_SET_POWER, lp.SET_COLOR_ZONES,
+    lp.SET_EXTENDED_COLOR_ZONES, lp.SET_64))
+
+
+def _init_args():
+    arg_parser = argparse.ArgumentParser(
+        description='Simulate LIFX devices on the local network.')
+    arg_parser.add_argument(
+        '-b', '--bulbs', type=int, default=4, help='number of bulbs')
+    arg_parser.add_argument(
+        '-s', '--strips', type=int, default=1, help='number of strips')
+    arg_parser.add_argument(
+        '-t', '--tiles', type=int, default=1, help='number of tile chains')
+    arg_parser.add_argument(
+        '-a', '--address', default='0.0.0.0', help='address to listen on')
+    arg_parser.add_argument(
+        '-p', '--port', type=int, default=lp.DEFAULT_PORT,
+        help='port to listen on')
+    arg_parser.add_argument(
+        '-l', '--latency', type=float, default=0.0,
+        help='seconds before each response')
+    arg_parser.add_argument(
+        '-j', '--jitter', type=float, default=0.0,
+        help='most random seconds added to the latency')
+    arg_parser.add_argument(
+        '-x', '--loss', type=float, default=0.0,
+        help='probability of dropping a packet')
+    arg_parser.add_argument(
+        '-r', '--rate-limit', type=int, default=0,
+        help='most messages per second for each device')
+    return arg_parser.parse_args()
+
+
+def main():
+    """
+    Run the simulator until interrupted. To use it from lsrun, for example,
+    set light_api to "async" and lan_broadcast to "127.0.0.1".
+    """
+    args = _init_args()
+    simulator = LanSimulator(
+        args.address, args.port, args.latency, args.jitter, args.loss,
+        args.rate_limit)
+    for device in simulator.populate(args.bulbs, args.strips, args.tiles):
+        print('{} {}'.format(device.mac_addr, device.label))
+    print('Listening on {}:{}'.format(*simulator.get_address()))
+    try:
+        simulator.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    print(simulator.get_stats())
+
+
+if __name__ == '__main__':
+    main()
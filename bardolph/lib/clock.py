@@ -1,73 +1,129 @@
+import heapq
+import itertools
 import threading
 import time
-from datetime import datetime
+from datetime import datetime, timedelta
 
 from bardolph.lib import i_lib, injection
 
 
 def now():
     # seconds
-    return time.time()
+    return time.monotonic()
 
 
 def configure():
     injection.bind(Clock).to(i_lib.Clock)
 
 
+class _TimerQueue:
+    """
+    Heap of deadlines shared by every Clock. A single daemon thread sleeps
+    until the earliest deadline and then sets the Event belonging to it. With
+    nothing scheduled, the thread blocks without a timeout.
+    """
+    def __init__(self):
+        self._heap = []
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._thread = None
+
+    def schedule(self, deadline) -> threading.Event:
+        event = threading.Event()
+        with self._cond:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, daemon=True)
+                self._thread.start()
+            entry = (deadline, next(self._seq), event)
+            heapq.heappush(self._heap, entry)
+            if self._heap[0] is entry:
+                self._cond.notify()
+        return event
+
+    def cancel(self, event) -> None:
+        with self._cond:
+            for i, entry in enumerate(self._heap):
+                if entry[2] is event:
+                    self._heap[i] = self._heap[-1]
+                    self._heap.pop()
+                    heapq.heapify(self._heap)
+                    break
+
+    def _run(self):
+        with self._cond:
+            while True:
+                if not self._heap:
+                    self._cond.wait()
+                    continue
+                delay = self._heap[0][0] - now()
+                if delay > 0.0:
+                    self._cond.wait(delay)
+                    continue
+                heapq.heappop(self._heap)[2].set()
+
+
+_timer_queue = _TimerQueue()
+
+
 # All time quantities are in seconds.
 class Clock(i_lib.Clock):
     def __init__(self):
-        self._event = threading.Event()
+        self._event = None
         self._start_time = 0.0
         self._cue_time = 0.0
         self._keep_going = True
 
     def start(self):
         self.reset()
-        threading.Thread(target=self.run, args=(), daemon=True).start()
-
-    @injection.inject(i_lib.Settings)
-    def run(self, settings):
         self._keep_going = True
-        sleep_time = float(settings.get_value('sleep_time'))
-        while self._keep_going:
-            if sleep_time > 0.0:
-                time.sleep(sleep_time)
-            self.fire()
 
     def stop(self):
         self._keep_going = False
+        event = self._event
+        if event is not None:
+            event.set()
 
     def reset(self):
         self._cue_time = 0.0
         self._start_time = now()
 
     def et(self):
-        return time.time() - self._start_time
-
-    def fire(self):
-        self._event.set()
-        self._event.clear()
-
-    def wait(self):
-        if self._keep_going:
-            self._event.wait()
-        return self._keep_going
+        return now() - self._start_time
 
     def pause_for(self, delay):
         self._cue_time += delay
-        while self.et() < self._cue_time:
-            if not self.wait():
-                break
+        self._sleep_until(self._start_time + self._cue_time)
 
     def wait_until(self, time_pattern):
-        hour, minute = Clock._hour_minute()
-        while not time_pattern.match(hour, minute):
-            self.wait()
-            hour, minute = Clock._hour_minute()
+        while self._keep_going:
+            current = datetime.now()
+            if time_pattern.match(current.hour, current.minute):
+                break
+            self._sleep_until(
+                now() + Clock.seconds_to_match(current, time_pattern))
         self.reset()
 
     @staticmethod
-    def _hour_minute():
-        now = datetime.now()
-        return (now.hour, now.minute)
+    def seconds_to_match(current, time_pattern):
+        """
+        Seconds from current until the start of the next minute that matches
+        time_pattern. If nothing matches in the next 24 hours, returns the
+        time to the next minute.
+        """
+        start = current.replace(second=0, microsecond=0)
+        for minutes in range(1, 24 * 60 + 1):
+            candidate = start + timedelta(minutes=minutes)
+            if time_pattern.match(candidate.hour, candidate.minute):
+                return (candidate - current).total_seconds()
+        return (start + timedelta(minutes=1) - current).total_seconds()
+
+    def _sleep_until(self, deadline):
+        # Returns early if stop() is called from another thread.
+        if deadline <= now():
+            return
+        event = _timer_queue.schedule(deadline)
+        self._event = event
+        if self._keep_going:
+            event.wait()
+        self._event = None
+        _timer_queue.cancel(event)
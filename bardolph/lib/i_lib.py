@@ -3,6 +3,7 @@ class Clock:
     def stop(self): pass
     def reset(self): pass
     def pause_for(self, _): pass
+    def wait_until(self, _): pass
 
 class Settings: pass
 
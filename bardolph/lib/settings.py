@@ -16,6 +16,9 @@ class Settings:
     def get_value(self, name, default=None):
         return self._config.get(name, default)
 
+    def get_all(self) -> dict:
+        return dict(self._config)
+
 
 class Builder:
     def __init__(self, initial=None):
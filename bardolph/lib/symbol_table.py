@@ -7,9 +7,19 @@ class SymbolTable:
     def __contains__(self, name):
         return name in self._dict
 
+    def __len__(self):
+        return len(self._dict)
+
     def clear(self):
         self._dict.clear()
 
+    def snapshot(self) -> dict:
+        # A copy of the contents, which restore() puts back.
+        return dict(self._dict)
+
+    def restore(self, snapshot) -> None:
+        self._dict = dict(snapshot)
+
     def add_symbol(self, name, symbol_type=SymbolType.UNKNOWN, value=None):
         self._dict[name] = Symbol(name, symbol_type, value)
 
@@ -0,0 +1,100 @@
+import queue
+import threading
+
+
+class Task:
+    """ The result of a function that has been submitted to a WorkerPool. """
+    def __init__(self, fn, args, done_queue):
+        self._fn = fn
+        self._args = args
+        self._done_queue = done_queue
+        self._done = threading.Event()
+        self.result = None
+        self.exception = None
+
+    def run(self) -> None:
+        try:
+            self.result = self._fn(*self._args)
+        except Exception as ex:
+            self.exception = ex
+        self._done.set()
+        if self._done_queue is not None:
+            self._done_queue.put(self)
+
+    def wait(self, timeout=None) -> bool:
+        """ Returns False if the task didn't finish within timeout. """
+        return self._done.wait(timeout)
+
+    def is_done(self) -> bool:
+        return self._done.is_set()
+
+
+class WorkerPool:
+    """
+    A fixed maximum number of daemon threads that run submitted functions.
+    Threads are started only as they are needed, and exit after they have
+    been idle for idle_time seconds.
+
+    Unlike concurrent.futures, this keeps working while the interpreter is
+    shutting down, which happens in a script's thread after the main thread
+    has returned.
+    """
+    def __init__(self, max_workers, name='worker', idle_time=30.0):
+        self._max_workers = max(1, max_workers)
+        self._name = name
+        self._idle_time = idle_time
+        self._tasks = queue.SimpleQueue()
+        self._lock = threading.Lock()
+        self._num_workers = 0
+        self._num_busy = 0
+        self._num_waiting = 0
+
+    def submit(self, fn, *args, done_queue=None) -> Task:
+        """
+        Run fn(*args) on one of the threads. If done_queue is not None, the
+        Task is put into it when the function returns.
+        """
+        task = Task(fn, args, done_queue)
+        with self._lock:
+            self._num_waiting += 1
+            num_idle = self._num_workers - self._num_busy
+            if (self._num_waiting > num_idle
+                    and self._num_workers < self._max_workers):
+                self._num_workers += 1
+                threading.Thread(
+                    target=self._work, daemon=True,
+                    name='{}_{}'.format(self._name, self._num_workers)).start()
+        self._tasks.put(task)
+        return task
+
+    def imap_unordered(self, fn, items):
+        """
+        Generator: run fn on each of the items concurrently, and yield each
+        Task in the order they finish.
+        """
+        done_queue = queue.SimpleQueue()
+        num_tasks = 0
+        for item in items:
+            self.submit(fn, item, done_queue=done_queue)
+            num_tasks += 1
+        for _ in range(0, num_tasks):
+            yield done_queue.get()
+
+    def _work(self):
+        while True:
+            try:
+                task = self._tasks.get(timeout=self._idle_time)
+            except queue.Empty:
+                with self._lock:
+                    # A task may have been submitted just now, counting on
+                    # this thread to run it.
+                    if self._num_waiting == 0:
+                        self._num_workers -= 1
+                        return
+                continue
+            with self._lock:
+                self._num_waiting -= 1
+                self._num_busy += 1
+            task.run()
+            with self._lock:
+                self._num_busy -= 1
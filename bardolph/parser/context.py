@@ -29,6 +29,17 @@ class Context:
         self._locals.clear()
         self._loop_stack.clear()
 
+    def snapshot_globals(self) -> dict:
+        return self._globals.snapshot()
+
+    def restore_globals(self, snapshot) -> None:
+        self._globals.restore(snapshot)
+
+    def at_top_level(self) -> bool:
+        # Outside of any routine, loop, or matrix, with no locals.
+        return (not self._in_routine and not self._in_matrix
+                and len(self._loop_stack) == 0 and len(self._locals) == 0)
+
     def enter_routine(self) -> None:
         self._in_routine = True
 
@@ -11,79 +11,88 @@ class Lex:
              'time')
     _REG_LIST = _REG.split()
     _NAME_SPEC = r'[a-zA-Z_][a-zA-Z0-9_]*'
-    _NON_ALNUM_LIST = [word for word in ('&&', '||', *list(r'[]{}()+-*/#:^!'))]
     _NON_ALNUM_SPEC = r'==|!=|<=|>=|&&|\|\||!|[\[\]\(\){}+\-*<>/#:\^]'
     _NUMBER_SPEC = r'[0-9]*\.?[0-9]+'
     _LITERAL_STRING_SPEC = r'"([^"]|(?<=\\)")*"'
     _DEFAULT_SPEC = '[^\s]+'
 
-    _STRING = re.compile(_LITERAL_STRING_SPEC)
-    _TOKEN_SPEC = '|'.join((
-        TimePattern.REGEX_SPEC,
-        _CMP_SPEC,
-        _LITERAL_STRING_SPEC,
-        _NUMBER_SPEC,
-        _NAME_SPEC,
-        _NON_ALNUM_SPEC,
-        _DEFAULT_SPEC))
+    # One scanner for everything, with each kind of token in its own named
+    # group, in order of precedence. The name of the group that matched
+    # gives the type of the token.
+    _SCANNER = re.compile('|'.join(
+        '(?P<{}>{})'.format(group, spec) for group, spec in (
+            ('time_pattern', TimePattern.REGEX_SPEC),
+            ('compare', _CMP_SPEC),
+            ('string', _LITERAL_STRING_SPEC),
+            ('number', _NUMBER_SPEC),
+            ('name', _NAME_SPEC),
+            ('mark', _NON_ALNUM_SPEC),
+            ('error', _DEFAULT_SPEC))))
+    _GROUP_TYPES = {
+        'time_pattern': TokenTypes.TIME_PATTERN,
+        'compare': TokenTypes.COMPARE,
+        'number': TokenTypes.NUMBER,
+        'mark': TokenTypes.MARK,
+        'error': TokenTypes.ERROR
+    }
+
+    # Keywords are recognized regardless of case. Registers have to be in
+    # lower case, unless abbreviated. Keywords take precedence, so that
+    # "default" is a keyword rather than a register.
+    _KEYWORDS = TokenTypes.__members__
+    _ABBREVIATIONS = {
+        'H': 'hue', 'S': 'saturation', 'B': 'brightness', 'K': 'kelvin'}
+    _WORDS = {
+        **{word: (TokenTypes.REGISTER, word) for word in _REG_LIST},
+        **{abbrev: (TokenTypes.REGISTER, word)
+           for abbrev, word in _ABBREVIATIONS.items()},
+        **{name.lower(): (token_type, name.lower())
+           for name, token_type in _KEYWORDS.items()}
+    }
 
-    _CMP = re.compile(_CMP_SPEC)
-    _TOKEN = re.compile(_TOKEN_SPEC)
-    _NAME = re.compile(_NAME_SPEC)
-    _NUMBER = re.compile(_NUMBER_SPEC)
-    _TIME_PATTERN = TimePattern.REGEX
     _INT = re.compile(r'^\-?[0-9]*$')
 
-    def __init__(self, input_string, source=''):
-        self._lines = iter(input_string.split('\n'))
+    def __init__(self, srce, source=''):
+        """
+        srce is either a string or a text file object. A file is read one
+        line at a time, as the tokens are consumed.
+        """
+        self._lines = srce.split('\n') if isinstance(srce, str) else srce
         self._source = source
 
     def tokens(self):
-        line_num = 0
-        for line in self._lines:
-            line_num += 1
-            for match in self._TOKEN.finditer(line):
-                matched = match.string[match.start():match.end()]
-                u_matched = self._unabbreviate(matched)
-                if u_matched == '#':
+        scanner = self._SCANNER.finditer
+        group_types = self._GROUP_TYPES
+        words = self._WORDS
+        keywords = self._KEYWORDS
+        source = self._source
+        for line_num, line in enumerate(self._lines, 1):
+            for match in scanner(line):
+                group = match.lastgroup
+                text = match.group()
+                if group == 'name':
+                    word = words.get(text)
+                    if word is not None:
+                        token_type, text = word
+                    elif text.islower():
+                        token_type = TokenTypes.NAME
+                    else:
+                        token_type = keywords.get(
+                            text.upper(), TokenTypes.NAME)
+                elif group == 'string':
+                    token_type = TokenTypes.LITERAL_STRING
+                    text = text[1:-1].replace(r'\"', '"')
+                elif text == '#':
                     break
-                if u_matched in self._NON_ALNUM_LIST:
-                    token_type = TokenTypes.MARK
                 else:
-                    token_type = self._token_type(u_matched)
-                    if token_type is TokenTypes.LITERAL_STRING:
-                        u_matched = u_matched[1:-1]
-                        u_matched = u_matched.replace(r'\"', '"')
-                yield Token(token_type, u_matched, line_num, self._source)
+                    token_type = group_types[group]
+                yield Token(token_type, text, line_num, source)
         yield Token(TokenTypes.EOF)
 
     @staticmethod
     def is_int(text):
         return Lex._INT.match(text) is not None
 
-    def _token_type(self, word):
-        token_type = TokenTypes.__members__.get(word.upper())
-        if token_type is not None:
-            return token_type
-        if word in self._REG_LIST:
-            return TokenTypes.REGISTER
-        pairs = (
-            (self._CMP, TokenTypes.COMPARE),
-            (self._TIME_PATTERN, TokenTypes.TIME_PATTERN),
-            (self._STRING, TokenTypes.LITERAL_STRING),
-            (self._NUMBER, TokenTypes.NUMBER),
-            (self._NAME, TokenTypes.NAME))
-        for reg_expr, token_type in pairs:
-            if reg_expr.match(word):
-                return token_type
-        return TokenTypes.ERROR
-
-    @staticmethod
-    def _unabbreviate(token):
-        return {
-            'H': 'hue', 'S': 'saturation', 'B': 'brightness', 'K': 'kelvin'
-        }.get(token, token)
-
 
 def main():
     args = sys.argv[1:]
@@ -1,88 +1,723 @@
+"""
+Rewrites the code produced by the Parser before the Loader lays it out for
+the Machine. The work is done in passes, each of which can be turned on or
+off by itself with the optimizer_passes setting:
+
+    unit_fold: removes "units" switches to the mode that is already in
+        effect, which would convert nothing. The mode is followed through
+        jumps and into and out of routines.
+    constant_fold: evaluates operators whose operands are constants.
+    dead_code: resolves conditional jumps on constants, and removes jumps to
+        the next instruction and code that can't be reached.
+    jump_thread: sends a jump to an unconditional jump straight to the
+        final target.
+    push_pop: replaces a push followed by a pop with a move.
+    redundant_store: removes stores to registers that are overwritten before
+        anything reads them, stores of the value a register already holds,
+        and moves from a register to itself.
+
+The passes run in that order, over and over, until none of them has
+anything more to do.
+
+The original list and the Instructions in it are never modified: an
+Instruction that changes is replaced with a new one, and the rest are shared
+with the original. A parsed program can therefore be optimized and loaded
+any number of times, by any number of Machines at once, without being copied
+first.
+
+Each routine, and the code outside of all of them, is optimized separately,
+because no jump crosses from one to another. In the result, the code outside
+of the routines comes first, followed by the routines.
+"""
+
+import logging
+
+from bardolph.controller.units import UnitMode
 from bardolph.vm.instruction import Instruction
-from bardolph.vm.vm_codes import OpCode
+from bardolph.vm.vm_codes import JumpCondition, OpCode, Operator, Register
+from bardolph.vm.vm_math import VmMath
+
+# Stop after this many rounds, even if the passes are still finding things.
+_MAX_ROUNDS = 10
+
+# Exponents larger than this are left for run time.
+_MAX_FOLDED_EXPONENT = 64
 
 
 class _InstFrame:
     def __init__(self, inst: Instruction):
         self.inst = inst
+        self.target = None      # For a jump, the frame it goes to.
+        self.targeted = False   # Can be arrived at other than by falling in.
+        self.pinned = False     # Can't be removed.
+        self.removed = False
+        self.forward = None     # Once removed, where jumps to it go instead.
         self.address = None
-        self.target = None
-        self.targeted = False
 
-class Optimizer:
-    def __init__(self):
-        self._program = None
-        self._frames = None
 
-    def optimize(self, program: list) -> list:
-        self._frames = [_InstFrame(inst) for inst in program]
-        any_jumps = self._find_jumps()
-        any_push_pop = self._fold_push_pop()
-        if any_push_pop:
-            if any_jumps:
-                self._set_addresses()
-                self._fix_jumps()
-            return [frame.inst for frame in self._frames
-                        if frame.inst.op_code is not OpCode.NOP]
-        return program
-
-    def _find_jumps(self) -> bool:
-        # Returns True if any jumps were found, False otherwise.
-        inst_pos = 0
-        any_jump = False
-        for frame in self._frames:
-            inst = frame.inst
-            if inst.op_code is OpCode.JUMP:
-                target_pos = inst_pos + inst.param1
-                frame.target = self._frames[target_pos]
+class _Segment:
+    """
+    A run of code that no jump enters or leaves: either the code outside of
+    all the routines, or the body of a routine, ending with its END. end is
+    an extra frame that stands for the address just past the last one.
+    """
+    def __init__(self, name=None):
+        self.name = name
+        self.header = None
+        self.frames = []
+        self.end = _InstFrame(None)
+        self.entry_mode = _UNSET
+        self.exit_mode = _UNSET
+        # dirty: changed in the last round, so the passes run over it again.
+        self.dirty = True
+        self.changed = False
+
+    def mark(self) -> None:
+        frames = self.frames
+        for frame in frames:
+            frame.targeted = False
+            frame.pinned = False
+        for pos, frame in enumerate(frames):
+            if frame.target is not None:
                 frame.target.targeted = True
-                any_jump = True
-            inst_pos += 1
-        return any_jump
+            elif frame.inst.op_code is OpCode.JSR:
+                # A routine that ends with "return" resumes one instruction
+                # past the one after the JSR, so that instruction has to
+                # stay where it is, and the one after it can be reached.
+                if pos + 1 < len(frames):
+                    frames[pos + 1].pinned = True
+                if pos + 2 < len(frames):
+                    frames[pos + 2].targeted = True
+        if self.name is not None and len(frames) > 0:
+            frames[-1].pinned = True
+
+    def compact(self) -> None:
+        # Drop the removed frames. A jump to one goes to the next frame that
+        # remains.
+        next_frame = self.end
+        for frame in reversed(self.frames):
+            if frame.removed:
+                frame.forward = next_frame
+            else:
+                next_frame = frame
+        self.frames = [frame for frame in self.frames if not frame.removed]
+        for frame in self.frames:
+            if frame.target is not None and frame.target.removed:
+                frame.target = frame.target.forward
+        self.mark()
+
+    def successors(self, pos, positions) -> list:
+        # The positions of the frames that can execute right after the one
+        # at pos, given the position of each frame. The end isn't included.
+        frame = self.frames[pos]
+        op_code = frame.inst.op_code
+        if op_code is OpCode.JUMP:
+            target_pos = positions.get(frame.target)
+            result = [] if target_pos is None else [target_pos]
+            if frame.inst.param0 is not JumpCondition.ALWAYS:
+                result.append(pos + 1)
+        elif op_code in (OpCode.RETURN, OpCode.STOP):
+            return []
+        elif op_code is OpCode.END and frame.inst.param0 == self.name:
+            return []
+        elif op_code is OpCode.JSR:
+            result = [pos + 1, pos + 2]
+        else:
+            result = [pos + 1]
+        return [succ_pos for succ_pos in result if succ_pos < len(self.frames)]
+
+    def next(self, pos):
+        return self.frames[pos + 1] if pos + 1 < len(self.frames) else self.end
+
+    def emit(self) -> list:
+        for address, frame in enumerate(self.frames):
+            frame.address = address
+        self.end.address = len(self.frames)
+        code = []
+        for frame in self.frames:
+            inst = frame.inst
+            if frame.target is not None:
+                offset = frame.target.address - frame.address
+                if offset != inst.param1:
+                    inst = Instruction(OpCode.JUMP, inst.param0, offset)
+            code.append(inst)
+        return code
+
+
+class _Unset:
+    def __repr__(self):
+        return '_UNSET'
+
+class _Unknown:
+    def __repr__(self):
+        return '_UNKNOWN'
 
-    def _fold_push_pop(self) -> bool:
+# Unit modes for the unit_fold pass: either a UnitMode, _UNSET if no path
+# reaches that point yet, or _UNKNOWN.
+_UNSET = _Unset()
+_UNKNOWN = _Unknown()
+
+
+def _meet(mode0, mode1):
+    if mode0 is _UNSET:
+        return mode1
+    if mode1 is _UNSET or mode0 is mode1:
+        return mode0
+    return _UNKNOWN
+
+
+def _constant(inst):
+    # Returns (True, value) if the instruction pushes a constant.
+    if inst.op_code is OpCode.PUSHQ:
+        return True, inst.param0
+    if inst.op_code is OpCode.PUSH and VmMath.is_constant_push(inst.param0):
+        return True, inst.param0
+    return False, None
+
+
+def _split(program):
+    """
+    Returns the segment for the code outside of the routines, followed by one
+    for each routine, or None if the program isn't laid out as expected.
+    Jumps outside of the routines that go to a routine are sent past it,
+    which is where execution would continue after the Loader has moved the
+    routine elsewhere.
+    """
+    frames = [_InstFrame(inst) for inst in program]
+    main = _Segment()
+    segments = [main]
+    owners = [main] * len(frames)
+    pos = 0
+    while pos < len(frames):
+        inst = frames[pos].inst
+        if inst.op_code is OpCode.ROUTINE:
+            routine = _Segment(inst.param0)
+            routine.header = frames[pos]
+            owners[pos] = None
+            pos += 1
+            while pos < len(frames) and not (
+                    frames[pos].inst.op_code is OpCode.END
+                    and frames[pos].inst.param0 == routine.name):
+                routine.frames.append(frames[pos])
+                owners[pos] = routine
+                pos += 1
+            if pos == len(frames):
+                return None
+            routine.frames.append(frames[pos])
+            owners[pos] = routine
+            segments.append(routine)
+        else:
+            main.frames.append(frames[pos])
+        pos += 1
+
+    # The main frame at or after each position.
+    main_at = [None] * (len(frames) + 1)
+    main_at[-1] = main.end
+    for pos in range(len(frames) - 1, -1, -1):
+        main_at[pos] = frames[pos] if owners[pos] is main else main_at[pos + 1]
+
+    for pos, frame in enumerate(frames):
+        if frame.inst.op_code is not OpCode.JUMP:
+            continue
+        owner = owners[pos]
+        target_pos = pos + frame.inst.param1
+        if not 0 <= target_pos <= len(frames):
+            return None
+        if owner is main:
+            frame.target = main_at[target_pos]
+        elif target_pos < len(frames) and owners[target_pos] is owner:
+            frame.target = frames[target_pos]
+        else:
+            return None
+    for segment in segments:
+        segment.mark()
+    return segments
+
+
+class _Pass:
+    name = None
+
+    def run(self, segments) -> None:
+        for segment in segments:
+            if segment.dirty:
+                if self.run_segment(segment):
+                    segment.compact()
+                    segment.changed = True
+
+    def run_segment(self, segment) -> bool:
+        return False
+
+
+class _UnitFold(_Pass):
+    """
+    Follows the unit mode through the program. The mode is unknown where the
+    program starts, and where a routine starts unless every JSR to it comes
+    with the same mode. After a JSR, the mode is the same as before if the
+    routine never changes it, directly or through other routines; otherwise,
+    it's whatever the routine leaves it as.
+    """
+    name = 'unit_fold'
+
+    def run(self, segments) -> None:
+        if not any(self._writes_mode(frame.inst)
+                   for segment in segments for frame in segment.frames):
+            return
+        for segment in segments:
+            segment.entry_mode = _UNSET
+            segment.exit_mode = _UNSET
+        segments[0].entry_mode = _UNKNOWN
+        self._routines = {
+            segment.name: segment for segment in segments[1:]}
+        self._writers = self._find_writers(segments)
+
+        modes = {}
+        changed = True
+        while changed:
+            changed = False
+            for segment in segments:
+                exit_mode = segment.exit_mode
+                modes[segment] = self._flow(segment)
+                if segment.exit_mode is not exit_mode:
+                    changed = True
+            for segment in segments[1:]:
+                if segment.entry_mode is not modes[segment][1]:
+                    changed = True
+
+        for segment in segments:
+            segment_changed = False
+            for frame, mode in zip(segment.frames, modes[segment][0]):
+                inst = frame.inst
+                if (inst.op_code is OpCode.MOVEQ
+                        and inst.param1 is Register.UNIT_MODE
+                        and inst.param0 is mode and not frame.pinned):
+                    frame.removed = True
+                    segment_changed = True
+            if segment_changed:
+                segment.compact()
+                segment.dirty = segment.changed = True
+
+    @staticmethod
+    def _writes_mode(inst) -> bool:
+        if inst.op_code in (OpCode.MOVE, OpCode.MOVEQ):
+            return inst.param1 is Register.UNIT_MODE
+        if inst.op_code is OpCode.POP:
+            return inst.param0 is Register.UNIT_MODE
+        return False
+
+    def _find_writers(self, segments) -> set:
+        # Names of the routines that can change the unit mode.
+        writers = set()
+        calls = {}
+        for segment in segments[1:]:
+            calls[segment.name] = set()
+            for frame in segment.frames:
+                if self._writes_mode(frame.inst):
+                    writers.add(segment.name)
+                elif frame.inst.op_code is OpCode.JSR:
+                    calls[segment.name].add(frame.inst.param0)
+        changed = True
+        while changed:
+            changed = False
+            for name, callees in calls.items():
+                if name not in writers and not callees.isdisjoint(writers):
+                    writers.add(name)
+                    changed = True
+        return writers
+
+    def _flow(self, segment):
+        """
+        Returns the mode coming into each frame of the segment, along with
+        the segment's entry mode as it was when the flow started. Updates
+        the entry modes of routines called from the segment and the exit
+        mode of the segment.
         """
-        Replace push followed by immediate pop with move.
+        frames = segment.frames
+        entry_mode = segment.entry_mode
+        modes = [_UNSET] * len(frames)
+        if len(frames) == 0 or entry_mode is _UNSET:
+            return modes, entry_mode
+        positions = {frame: pos for pos, frame in enumerate(frames)}
+        modes[0] = entry_mode
+        work = [0]
+        while len(work) > 0:
+            pos = work.pop()
+            mode = modes[pos]
+            inst = frames[pos].inst
+            if self._writes_mode(inst):
+                if (inst.op_code is OpCode.MOVEQ
+                        and isinstance(inst.param0, UnitMode)):
+                    mode = inst.param0
+                else:
+                    mode = _UNKNOWN
+            elif inst.op_code is OpCode.JSR:
+                callee = self._routines.get(inst.param0)
+                if callee is not None:
+                    callee.entry_mode = _meet(callee.entry_mode, mode)
+                    if inst.param0 in self._writers:
+                        mode = callee.exit_mode
+            elif inst.op_code is OpCode.RETURN or (
+                    inst.op_code is OpCode.END and inst.param0 == segment.name):
+                segment.exit_mode = _meet(segment.exit_mode, mode)
+            if mode is _UNSET:
+                continue
+            for succ_pos in segment.successors(pos, positions):
+                new_mode = _meet(modes[succ_pos], mode)
+                if new_mode is not modes[succ_pos]:
+                    modes[succ_pos] = new_mode
+                    work.append(succ_pos)
+        return modes, entry_mode
 
-        For example:
-            OpCode.PUSHQ, 1
-            OpCode.POP, Register.RESULT
-        becomes:
-            OpCode.MOVEQ, 1, Register.RESULT
 
-        Returns True if any changes were make, False otherwise.
+class _ConstantFold(_Pass):
+    name = 'constant_fold'
+
+    def run_segment(self, segment) -> bool:
+        # previous holds the frames that remain, so far, before the current
+        # one.
+        changed = False
+        previous = []
+        for frame in segment.frames:
+            if (frame.inst.op_code is OpCode.OP and not frame.targeted
+                    and not frame.pinned and self._fold(previous, frame)):
+                frame.removed = True
+                changed = True
+            else:
+                previous.append(frame)
+        return changed
+
+    @staticmethod
+    def _fold(previous, frame) -> bool:
+        operator = frame.inst.param0
+        arity = VmMath.arity(operator)
+        if len(previous) < arity:
+            return False
+        operand_frames = previous[-arity:]
+        operands = []
+        for operand_frame in operand_frames:
+            is_constant, value = _constant(operand_frame.inst)
+            if not is_constant:
+                return False
+            operands.append(value)
+        for operand_frame in operand_frames[1:]:
+            if operand_frame.targeted or operand_frame.pinned:
+                return False
+        if _ConstantFold._too_big(operator, operands):
+            return False
+        try:
+            value = VmMath.evaluate(operator, *operands)
+        except (ArithmeticError, TypeError, ValueError):
+            # Leave it to fail at run time, where the error gets reported.
+            return False
+        operand_frames[0].inst = Instruction(OpCode.PUSHQ, value)
+        for operand_frame in operand_frames[1:]:
+            operand_frame.removed = True
+            previous.pop()
+        return True
+
+    @staticmethod
+    def _too_big(operator, operands) -> bool:
+        if operator is not Operator.POW:
+            return False
+        exponent = operands[-1]
+        return (not isinstance(exponent, (int, float))
+                or abs(exponent) > _MAX_FOLDED_EXPONENT)
+
+
+class _DeadCode(_Pass):
+    name = 'dead_code'
+
+    def run_segment(self, segment) -> bool:
+        changed = self._fold_branches(segment)
+        changed = self._remove_jumps(segment) or changed
+        return self._remove_unreachable(segment) or changed
+
+    @staticmethod
+    def _fold_branches(segment) -> bool:
         """
-        inst_pos = 0
-        any_change = False
-        for frame in self._frames:
+        A conditional jump right after a constant push either always jumps
+        or never does. The jump would have popped the value into the result
+        register, so it still goes there.
+        """
+        changed = False
+        frames = segment.frames
+        for pos in range(1, len(frames)):
+            frame = frames[pos]
+            inst = frame.inst
+            if (inst.op_code is not OpCode.JUMP or frame.targeted
+                    or inst.param0 is JumpCondition.ALWAYS):
+                continue
+            is_constant, value = _constant(frames[pos - 1].inst)
+            if not is_constant:
+                continue
+            frames[pos - 1].inst = Instruction(
+                OpCode.MOVEQ, value, Register.RESULT)
+            if bool(value) ^ (inst.param0 is JumpCondition.IF_FALSE):
+                frame.inst = Instruction(
+                    OpCode.JUMP, JumpCondition.ALWAYS, inst.param1)
+            else:
+                frame.removed = True
+            changed = True
+        if changed:
+            segment.compact()
+        return changed
+
+    @staticmethod
+    def _remove_jumps(segment) -> bool:
+        # Jumps to the next instruction, and NOPs.
+        changed = False
+        frames = segment.frames
+        for pos, frame in enumerate(frames):
+            inst = frame.inst
+            if frame.pinned:
+                continue
+            if inst.op_code is OpCode.NOP:
+                frame.removed = True
+                changed = True
+            elif inst.op_code is OpCode.JUMP and (
+                    frame.target is segment.next(pos)):
+                if inst.param0 is JumpCondition.ALWAYS:
+                    frame.removed = True
+                else:
+                    frame.inst = Instruction(OpCode.POP, Register.RESULT)
+                    frame.target = None
+                changed = True
+        if changed:
+            segment.compact()
+        return changed
+
+    @staticmethod
+    def _remove_unreachable(segment) -> bool:
+        frames = segment.frames
+        if len(frames) == 0:
+            return False
+        positions = {frame: pos for pos, frame in enumerate(frames)}
+        reached = [False] * len(frames)
+        reached[0] = True
+        work = [0]
+        while len(work) > 0:
+            for succ_pos in segment.successors(work.pop(), positions):
+                if not reached[succ_pos]:
+                    reached[succ_pos] = True
+                    work.append(succ_pos)
+        changed = False
+        for frame, frame_reached in zip(frames, reached):
+            if not frame_reached and not frame.pinned:
+                frame.removed = True
+                changed = True
+        return changed
+
+
+class _JumpThread(_Pass):
+    name = 'jump_thread'
+
+    def run_segment(self, segment) -> bool:
+        changed = False
+        for frame in segment.frames:
+            if frame.target is None:
+                continue
+            target = frame.target
+            visited = {frame}
+            while (target.inst is not None and target not in visited
+                    and target.inst.op_code is OpCode.JUMP
+                    and target.inst.param0 is JumpCondition.ALWAYS):
+                visited.add(target)
+                target = target.target
+            if target is not frame.target:
+                frame.target = target
+                changed = True
+        return changed
+
+
+class _PushPop(_Pass):
+    """
+    Replace push followed by immediate pop with move.
+
+    For example:
+        OpCode.PUSHQ, 1
+        OpCode.POP, Register.RESULT
+    becomes:
+        OpCode.MOVEQ, 1, Register.RESULT
+    """
+    name = 'push_pop'
+
+    def run_segment(self, segment) -> bool:
+        changed = False
+        frames = segment.frames
+        pos = 0
+        while pos < len(frames) - 1:
+            frame = frames[pos]
+            next_frame = frames[pos + 1]
+            inst = frame.inst
+            next_inst = next_frame.inst
+            if (inst.op_code in (OpCode.PUSH, OpCode.PUSHQ)
+                    and next_inst.op_code is OpCode.POP
+                    and not frame.targeted and not next_frame.targeted
+                    and not next_frame.pinned):
+                if inst.op_code is OpCode.PUSH:
+                    op_code = OpCode.MOVE
+                else:
+                    op_code = OpCode.MOVEQ
+                frame.inst = Instruction(op_code, inst.param0, next_inst.param0)
+                next_frame.removed = True
+                changed = True
+                pos += 1
+            pos += 1
+        return changed
+
+
+# What the redundant_store pass knows about the registers that each op-code
+# reads and writes. Anything else might read or write any register.
+_ALL = object()
+_MODE_CHANGES = frozenset((
+    Register.HUE, Register.SATURATION, Register.BRIGHTNESS, Register.KELVIN,
+    Register.RED, Register.GREEN, Register.BLUE, Register.DURATION,
+    Register.TIME, Register.UNIT_MODE))
+
+class _RedundantStore(_Pass):
+    name = 'redundant_store'
+
+    def run_segment(self, segment) -> bool:
+        # known: register -> constant it holds.
+        # pending: register -> frame that stored into it, not yet read.
+        changed = False
+        known = {}
+        pending = {}
+        for frame in segment.frames:
+            if frame.targeted:
+                known.clear()
             inst = frame.inst
-            if inst.op_code in (OpCode.PUSH, OpCode.PUSHQ):
-                if not frame.targeted:
-                    next_pos = inst_pos + 1
-                    next_frame = self._frames[next_pos]
-                    next_inst = next_frame.inst
-                    if (next_inst.op_code is OpCode.POP
-                            and not next_frame.targeted):
-                        any_change = True
-                        if inst.op_code is OpCode.PUSH:
-                            inst.op_code = OpCode.MOVE
-                        else:
-                            inst.op_code = OpCode.MOVEQ
-                        inst.param1 = next_inst.param0
-                        next_inst.op_code = OpCode.NOP
-            inst_pos += 1
-        return any_change
-
-    def _set_addresses(self):
-        address = 0
-        for frame in self._frames:
-            if frame.inst.op_code is OpCode.NOP:
-                frame.address = None
+            op_code = inst.op_code
+            if op_code in (OpCode.MOVEQ, OpCode.MOVE):
+                srce, dest = inst.param0, inst.param1
+                if dest is Register.UNIT_MODE:
+                    reads = _MODE_CHANGES.union((srce, ))
+                    writes = _MODE_CHANGES
+                elif not isinstance(dest, Register):
+                    reads = (srce, ) if op_code is OpCode.MOVE else ()
+                    writes = ()
+                elif op_code is OpCode.MOVE and srce is dest:
+                    if not frame.pinned:
+                        frame.removed = True
+                        changed = True
+                    continue
+                else:
+                    if (op_code is OpCode.MOVEQ and dest in known
+                            and self._same(known[dest], srce)
+                            and not frame.pinned):
+                        frame.removed = True
+                        changed = True
+                        continue
+                    if op_code is OpCode.MOVE and srce in pending:
+                        del pending[srce]
+                    dead = pending.pop(dest, None)
+                    if dead is not None and not dead.pinned:
+                        dead.removed = True
+                        changed = True
+                    if op_code is OpCode.MOVEQ:
+                        known[dest] = srce
+                        pending[dest] = frame
+                    else:
+                        known.pop(dest, None)
+                        if isinstance(srce, Register):
+                            pending[dest] = frame
+                    continue
+            elif op_code is OpCode.PUSH:
+                reads, writes = (inst.param0, ), ()
+            elif op_code is OpCode.POP:
+                reads, writes = (), (inst.param0, )
+                dead = pending.pop(inst.param0, None)
+                if dead is not None and not dead.pinned:
+                    dead.removed = True
+                    changed = True
+            elif op_code in (OpCode.PUSHQ, OpCode.OP, OpCode.NOP):
+                reads = writes = ()
+            elif op_code in (OpCode.WAIT, OpCode.POWER):
+                reads, writes = _ALL, ()
+            elif op_code is OpCode.COLOR:
+                reads, writes = _ALL, (Register.DEFAULT, )
             else:
-                frame.address = address
-                address += 1
+                reads = writes = _ALL
+
+            if reads is _ALL:
+                pending.clear()
+            else:
+                for reg in reads:
+                    pending.pop(reg, None)
+            if writes is _ALL:
+                known.clear()
+            else:
+                for reg in writes:
+                    known.pop(reg, None)
+        return changed
+
+    @staticmethod
+    def _same(value0, value1) -> bool:
+        return type(value0) is type(value1) and value0 == value1
+
+
+_PASSES = (
+    _UnitFold, _ConstantFold, _DeadCode, _JumpThread, _PushPop,
+    _RedundantStore)
+
+ALL_PASSES = tuple(pass_class.name for pass_class in _PASSES)
+DEFAULT_PASSES = ('push_pop', )
+
+
+def pass_names(value) -> tuple:
+    """
+    The value of the optimizer_passes setting, which can be a list of names,
+    or a string of names separated by commas or spaces, as a tuple of names.
+    "all" stands for all of the passes, and "none" for none of them.
+    """
+    if value is None:
+        return DEFAULT_PASSES
+    if isinstance(value, str):
+        value = value.replace(',', ' ').split()
+    names = []
+    for name in value:
+        if name == 'all':
+            names.extend(ALL_PASSES)
+        elif name in ALL_PASSES:
+            names.append(name)
+        elif name != 'none':
+            logging.warning('Unknown optimizer pass: "{}"'.format(name))
+    return tuple(names)
+
+
+class Optimizer:
+    def __init__(self, passes=None):
+        names = pass_names(passes)
+        self._passes = [
+            pass_class() for pass_class in _PASSES if pass_class.name in names]
+
+    def optimize(self, program: list) -> list:
+        if len(self._passes) == 0:
+            return program
+        segments = _split(program)
+        if segments is None:
+            return program
+        any_change = False
+        for _ in range(0, _MAX_ROUNDS):
+            for segment in segments:
+                segment.changed = False
+            for optimizer_pass in self._passes:
+                optimizer_pass.run(segments)
+            for segment in segments:
+                segment.dirty = segment.changed
+            if not any(segment.changed for segment in segments):
+                break
+            any_change = True
+        code = segments[0].emit()
+        for segment in segments[1:]:
+            code.append(segment.header.inst)
+            code.extend(segment.emit())
+        if not any_change and self._all_shared(program, code):
+            return program
+        return code
 
-    def _fix_jumps(self):
-        for frame in self._frames:
-            if frame.inst.op_code is OpCode.JUMP:
-                frame.inst.param1 = frame.target.address - frame.address
+    @staticmethod
+    def _all_shared(program, code) -> bool:
+        # True if no Instruction had to be replaced, not even a jump that
+        # goes around a routine.
+        original = set(id(inst) for inst in program)
+        return all(id(inst) in original for inst in code)
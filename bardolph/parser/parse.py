@@ -3,12 +3,13 @@
 import argparse
 import logging
 
-from bardolph.controller.routine import Routine, RuntimeRoutine
+from bardolph.controller.routine import Routine
 from bardolph.controller.units import UnitMode
 from bardolph.lib import injection
 from bardolph.lib.injection import inject
 from bardolph.lib.symbol_table import SymbolType
 from bardolph.lib.time_pattern import TimePattern
+from bardolph.parser import statement_cache
 from bardolph.parser.code_gen import CodeGen
 from bardolph.parser.context import Context
 from bardolph.parser.expr_parser import ExpressionParser
@@ -17,14 +18,21 @@ from bardolph.parser.lex import Lex
 from bardolph.parser.loop_parser import LoopParser
 from bardolph.parser.matrix_parser import MatrixParser
 from bardolph.parser.token import Token, TokenTypes
-from bardolph.runtime import bardolph_fn, i_runtime, runtime_module
+from bardolph.runtime import i_runtime, runtime_module
 from bardolph.vm.loader import Loader
 from bardolph.vm.vm_codes import (JumpCondition, OpCode, Operand, Register,
                                   SetOp)
 
 
 class Parser:
-    def __init__(self):
+    """
+    If cache_size is given, the parser is incremental: statements at the
+    start of a script that match ones at the start of a script parsed
+    before, by any incremental Parser, aren't parsed again. cache_size
+    limits how many statements are kept. See statement_cache.py.
+    """
+    def __init__(self, cache_size=None):
+        self._cache_size = cache_size
         self._lexer = None
         self._error_output = ''
         self._context = Context()
@@ -32,6 +40,7 @@ class Parser:
         self._op_code = OpCode.NOP
         self._code_gen = CodeGen()
         self._tokens = None
+        self._cache = None
         self._command_map = {
             TokenTypes.ASSIGN: self._assignment,
             TokenTypes.BREAK: self._break,
@@ -61,11 +70,20 @@ class Parser:
         self._token_trace = False
 
     def parse(self, input_string) -> bool:
+        # input_string can also be a text file object, which is read as
+        # the tokens are needed.
         self._context.clear()
         self._code_gen.clear()
         self._error_output = ''
-        self._load_runtime()
+        self._current_token = Token(TokenTypes.UNKNOWN)
+        cache = self._get_cache()
+        self._context.restore_globals(cache.root.symbols)
         self._tokens = Lex(input_string).tokens()
+        if self._cache_size is None:
+            self._cache = None
+        else:
+            self._cache = cache
+            self._tokens = statement_cache.TokenStream(self._tokens)
         self.next_token()
         return self._script()
 
@@ -75,16 +93,27 @@ class Parser:
     def parse_file(self, file_name) -> bool:
         logging.debug('"{}"'.format(file_name))
         try:
-            srce = open(file_name, 'r')
-            input_string = srce.read()
-            srce.close()
-            return self.parse(input_string)
+            with open(file_name, 'r') as srce:
+                return self.parse(srce)
         except FileNotFoundError:
             logging.error('Error: file {} not found.'.format(file_name))
         except OSError:
             logging.error('Error accessing file {}'.format(file_name))
         return False
 
+    @staticmethod
+    def read_file(file_name):
+        # Returns the contents of the file, or None if it can't be read.
+        logging.debug('"{}"'.format(file_name))
+        try:
+            with open(file_name, 'r') as srce:
+                return srce.read()
+        except FileNotFoundError:
+            logging.error('Error: file {} not found.'.format(file_name))
+        except OSError:
+            logging.error('Error accessing file {}'.format(file_name))
+        return None
+
     def get_errors(self) -> str:
         return self._error_output
 
@@ -92,22 +121,60 @@ class Parser:
     def current_token(self):
         return self._current_token
 
+    @staticmethod
     @inject(i_runtime.Runtime)
-    def _load_runtime(self, runtime):
-        for name, fn in runtime.get_fns().items():
-            routine = RuntimeRoutine(name, fn)
-            routine.params = bardolph_fn.params(fn)
-            self._context.add_routine(routine)
+    def _get_cache(runtime):
+        # The symbols for the runtime routines are in the cache's root, so
+        # they're only built once, even if the cache isn't used.
+        return statement_cache.get_cache(runtime)
 
     def _script(self) -> bool:
         return self._body() and self._eof()
 
     def _body(self) -> bool:
+        if self._cache is not None and not self._cached_body():
+            return False
         while not self._current_token.is_a(TokenTypes.EOF):
             if not self._command():
                 return False
         return True
 
+    def _cached_body(self) -> bool:
+        """
+        Skips over the statements at the start of the script that are the
+        same as ones in the statement cache, and parses the rest, adding
+        them to the cache. Stops early, leaving the rest to _body(), if the
+        parser's state after a statement can't be cached.
+        """
+        cache = self._cache
+        tokens = self._tokens
+        node = cache.root
+        while not self._current_token.is_a(TokenTypes.EOF):
+            child, count = cache.find(node, self._current_token, tokens)
+            if child is not None:
+                tokens.skip(count - 1)
+                self._current_token = next(tokens)
+                self._code_gen.add_instructions(child.code)
+                self._context.restore_globals(child.symbols)
+                node = child
+                continue
+
+            first = self._current_token
+            start = self._code_gen.current_offset
+            tokens.recorded = []
+            result = self._command()
+            recorded, tokens.recorded = tokens.recorded, None
+            if not result:
+                return False
+            if len(recorded) == 0 or not self._context.at_top_level():
+                return True
+            key = (statement_cache.token_key(first),
+                   *(statement_cache.token_key(token) for token in recorded))
+            node = cache.add(
+                node, key, self._context.snapshot_globals(),
+                self._code_gen.program[start:], self._cache_size)
+        return True
+
     def _eof(self) -> bool:
         if not self._current_token.is_a(TokenTypes.EOF):
             return self.trigger_error("Didn't get to end of file.")
@@ -0,0 +1,137 @@
+"""
+Top-level statements that have already been parsed, shared by all of the
+Parsers, so that a script that starts out the same as one parsed earlier
+doesn't have to be parsed again from the beginning.
+
+The cache is a tree. The root holds the symbols for the runtime routines,
+which are what the parser starts out with. Every other node stands for the
+parser's state after the statements on the path to it: the global symbols,
+along with the code for its own statement. A child is keyed on the tokens
+of its statement, followed by the token after that, because the parser
+will have looked at that one before deciding that the statement was done.
+
+Following the tree while the tokens match means that the statements that
+come after the first difference are parsed again, even if they're the same
+as before, because they may depend on what came earlier.
+"""
+
+from collections import deque
+import threading
+import weakref
+
+from bardolph.controller.routine import RuntimeRoutine
+from bardolph.lib.symbol import SymbolType
+from bardolph.lib.symbol_table import SymbolTable
+from bardolph.runtime import bardolph_fn
+
+
+class _Node:
+    __slots__ = ('symbols', 'code', 'children')
+
+    def __init__(self, symbols, code=()):
+        self.symbols = symbols
+        self.code = code
+        self.children = {}
+
+
+def token_key(token) -> tuple:
+    return token.token_type, token.content
+
+
+class StatementCache:
+    def __init__(self, runtime):
+        symbols = SymbolTable()
+        for name, fn in runtime.get_fns().items():
+            routine = RuntimeRoutine(name, fn)
+            routine.params = bardolph_fn.params(fn)
+            symbols.add_symbol(name, SymbolType.ROUTINE, routine)
+        self._root = _Node(symbols.snapshot())
+        self._num_nodes = 0
+        self._lock = threading.Lock()
+
+    @property
+    def root(self) -> _Node:
+        return self._root
+
+    def find(self, node, current_token, tokens):
+        """
+        Returns the child of node whose statement starts with current_token
+        and continues with the upcoming tokens, along with the number of
+        tokens it takes up after current_token. If there isn't one, returns
+        (None, 0).
+        """
+        first = token_key(current_token)
+        for key, child in list(node.children.items()):
+            if key[0] == first and tokens.matches(key, 1):
+                return child, len(key) - 1
+        return None, 0
+
+    def add(self, node, key, symbols, code, max_nodes) -> _Node:
+        with self._lock:
+            child = node.children.get(key)
+            if child is None:
+                if self._num_nodes >= max_nodes:
+                    # Start over. Nodes already handed out still work, but
+                    # are no longer reachable from the root.
+                    self._root.children = {}
+                    self._num_nodes = 0
+                child = _Node(symbols, code)
+                node.children[key] = child
+                self._num_nodes += 1
+            return child
+
+
+class TokenStream:
+    """
+    Wraps the tokens from the lexer, so that upcoming tokens can be looked
+    at without consuming them, and the tokens that a statement consumes can
+    be recorded.
+    """
+    def __init__(self, tokens):
+        self._tokens = iter(tokens)
+        self._pending = deque()
+        self.recorded = None
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if len(self._pending) > 0:
+            token = self._pending.popleft()
+        else:
+            token = next(self._tokens)
+        if self.recorded is not None:
+            self.recorded.append(token)
+        return token
+
+    def matches(self, key, start) -> bool:
+        # True if the upcoming tokens match key[start:].
+        needed = len(key) - start
+        while len(self._pending) < needed:
+            try:
+                self._pending.append(next(self._tokens))
+            except StopIteration:
+                return False
+        for pos in range(0, needed):
+            if token_key(self._pending[pos]) != key[start + pos]:
+                return False
+        return True
+
+    def skip(self, count) -> None:
+        for _ in range(0, count):
+            self._pending.popleft()
+
+
+# One cache for each runtime, because the runtime routines are where every
+# parse starts out.
+_caches = weakref.WeakKeyDictionary()
+_caches_lock = threading.Lock()
+
+
+def get_cache(runtime) -> StatementCache:
+    with _caches_lock:
+        cache = _caches.get(runtime)
+        if cache is None:
+            cache = StatementCache(runtime)
+            _caches[runtime] = cache
+        return cache
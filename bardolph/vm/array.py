@@ -1,55 +1,86 @@
-class ArrayError: pass
+import array
 
-class Array:
-    def __init__(self, size):
-        self._pos = 0
-        self._root = _ArrayBranch(size)
-        self._child_ptr = self._root
-
-    def add_dimension(self, size):
-        self._child_ptr = self._child_ptr.add_dimension(size)
 
-    def deref(self, index=None):
-        self._child_ptr = self._root
-        self._pos = index
-        return self
+class ArrayError(Exception):
+    pass
 
-    def index(self, sub_index):
-        if self._pos is not None:
-            self._child_ptr = self._child_ptr.get_value(self._pos)
-        self._pos = sub_index
-        return self
 
-    def get_value(self):
-        if self._pos is not None:
-            return self._child_ptr.get_value(self._pos)
-        return self
+class Array:
+    """
+    A multi-dimensional array, kept in a single flat list. The offset of an
+    element is the sum of each subscript times the stride for its
+    dimension, which is the number of elements that one step in that
+    dimension skips over.
 
-    def set_value(self, value):
-        return self._child_ptr.set_value(self._pos, value)
+    Indexing has no state of its own: get() and set() take all of the
+    subscripts at once, and each one is checked against the size of its
+    dimension.
 
+    If typecode is given, the elements are kept in an array.array of that
+    type, such as 'd' for floats, instead of a list. With width greater
+    than 1, each element is a run of that many values, for example 4 for a
+    color, and get() returns it as a list.
+    """
+    def __init__(self, size, typecode=None, width=1):
+        self._typecode = typecode
+        self._width = width
+        self._dimensions = []
+        self._strides = []
+        self._data = None
+        self.add_dimension(size)
 
-class _ArrayBranch:
-    def __init__(self, size):
-        self._data = [None] * size
-        self._pos = None
-        self._leaf = True
+    def add_dimension(self, size) -> None:
+        """
+        Adds an innermost dimension. Any values already stored are lost, so
+        this is only for while the array is being declared.
+        """
+        if not isinstance(size, int) or size < 1:
+            raise ArrayError('Invalid array size: {}'.format(size))
+        self._dimensions.append(size)
+        self._strides = [0] * len(self._dimensions)
+        stride = self._width
+        for dim in range(len(self._dimensions) - 1, -1, -1):
+            self._strides[dim] = stride
+            stride *= self._dimensions[dim]
+        if self._typecode is None:
+            self._data = [None] * stride
+        else:
+            self._data = array.array(self._typecode, bytes(
+                stride * array.array(self._typecode).itemsize))
 
     @property
-    def is_leaf(self) -> bool:
-        return self._leaf
-
-    def add_dimension(self, size):
-        for i in range(0, len(self._data)):
-            self._data[i] = _ArrayBranch(size)
-        self._leaf = False
-        return self
+    def dimensions(self) -> tuple:
+        return tuple(self._dimensions)
 
-    def deref(self, index):
-        return self._data[index]
+    def offset(self, subscripts) -> int:
+        # Position in the flat data of the element at the subscripts.
+        if len(subscripts) != len(self._dimensions):
+            raise ArrayError(
+                'Array has {} dimensions, got {} subscripts'.format(
+                    len(self._dimensions), len(subscripts)))
+        offset = 0
+        for subscript, size, stride in zip(
+                subscripts, self._dimensions, self._strides):
+            if not isinstance(subscript, int) or not 0 <= subscript < size:
+                raise ArrayError(
+                    'Array subscript out of range: {}'.format(subscript))
+            offset += subscript * stride
+        return offset
 
-    def get_value(self, index):
-        return self._data[index]
+    def get(self, subscripts):
+        offset = self.offset(subscripts)
+        if self._width == 1:
+            return self._data[offset]
+        return list(self._data[offset:offset + self._width])
 
-    def set_value(self, index, value):
-        self._data[index] = value
+    def set(self, subscripts, value) -> None:
+        offset = self.offset(subscripts)
+        if self._width == 1:
+            self._data[offset] = value
+            return
+        if len(value) != self._width:
+            raise ArrayError('Expected {} values, got {}'.format(
+                self._width, len(value)))
+        if self._typecode is not None:
+            value = array.array(self._typecode, value)
+        self._data[offset:offset + self._width] = value
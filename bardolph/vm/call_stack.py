@@ -6,10 +6,24 @@ class StackFrame:
     def __init__(self, parent=None):
         self.parent = parent
         self.vars = parent.vars if parent is not None else {}
-        self.constants = parent.constants if parent is not None else None
+        self.constants = parent.constants if parent is not None else {}
         self.globals = parent.globals if parent is not None else self.vars
         self.params = {}
         self.return_addr = None
+        self.find_scopes()
+
+    def find_scopes(self) -> None:
+        """
+        Builds the list of places that get_variable() searches, in order.
+        Outside of routines, the vars are the globals, and inside a routine,
+        they're the params, so each place is only listed once. Must be called
+        again whenever vars, params, or globals are replaced.
+        """
+        scopes = []
+        for place in (self.constants, self.vars, self.params, self.globals):
+            if all(place is not scope for scope in scopes):
+                scopes.append(place)
+        self._scopes = tuple(scopes)
 
     def put_variable(self, index, value) -> None:
         if index in self.params:
@@ -24,7 +38,7 @@ class StackFrame:
         self.constants[name] = value
 
     def get_variable(self, identifier):
-        for place in (self.constants, self.vars, self.params, self.globals):
+        for place in self._scopes:
             if identifier in place:
                 return place[identifier]
         return None
@@ -64,7 +78,6 @@ class CallStack:
 
     def reset(self) -> None:
         self._top = StackFrame()
-        self._top.constants = {}
 
     def get_top(self) -> StackFrame:
         return self._top
@@ -78,6 +91,7 @@ class CallStack:
 
     def enter_routine(self) -> None:
         self._top.vars = self._top.params
+        self._top.find_scopes()
 
     def exit_routine(self) -> None:
         self._top = self._top.parent
@@ -96,6 +110,22 @@ class CallStack:
             return self._top.get_loop_var(index)
         return self._top.get_variable(index)
 
+    def variable_getter(self, index):
+        """
+        A function that does the same as get_variable(index), with the kind
+        of index sorted out once, up front. It reads from whichever frame is
+        on top at the time it's called.
+        """
+        if isinstance(index, LoopVar):
+            return lambda: self._top.get_loop_var(index)
+        return lambda: self._top.get_variable(index)
+
+    def variable_setter(self, index):
+        # Like variable_getter(), for put_variable().
+        if isinstance(index, LoopVar):
+            return lambda value: self._top.set_loop_var(index, value)
+        return lambda value: self._top.put_variable(index, value)
+
     def set_return(self, address) -> None:
         self._top.return_addr = address
 
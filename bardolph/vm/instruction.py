@@ -6,6 +6,9 @@ from .vm_codes import OpCode
 
 
 class Instruction:
+    # A loaded program can hold thousands of these, so they have no __dict__.
+    __slots__ = ('op_code', 'param0', 'param1')
+
     def __init__(self, op_code, param0=None, param1=None):
         self.op_code = op_code
         self.param0 = param0
@@ -33,9 +36,6 @@ class Instruction:
                 and self.param0 == other.param0
                 and self.param1 == other.param1)
 
-    def nop(self):
-        self.op_code = OpCode.NOP
-
     def as_list_text(self) -> str:
         if self.param0 is None and self.param1 is None:
             return str(self.op_code)
@@ -1,7 +1,6 @@
 #!/usr/bin/env python
 
 import argparse
-import copy ###
 import logging
 
 from bardolph.controller.routine import Routine, RuntimeRoutine
@@ -10,12 +9,25 @@ from bardolph.parser.optimizer import Optimizer
 if __name__ == '__main__':
     from bardolph.parser.parse import Parser
 
+from bardolph.lib.i_lib import Settings
 from bardolph.lib.injection import inject
 from bardolph.runtime import i_runtime
 from bardolph.vm.instruction import Instruction
 from bardolph.vm.vm_codes import JumpCondition, OpCode
 
 
+class CompiledProgram:
+    """
+    What the Loader produces from a script: the optimized code, with the
+    routines already laid out, and the routines defined by the script. The
+    Machine runs it without loading or optimizing it again. Once built, it
+    isn't modified, so the same instance can be run any number of times.
+    """
+    def __init__(self, code, routines):
+        self.code = code
+        self.routines = routines
+
+
 class Loader:
     def __init__(self):
         self._main_segment = []
@@ -32,14 +44,15 @@ class Loader:
             self._iter = None
             return None
 
-    def load(self, instructions: list):
+    @inject(Settings)
+    def load(self, instructions: list, settings):
         self._main_segment.clear()
         self._routine_segment.clear()
         self._routines.clear()
         self._load_runtime()
         if instructions is not None:
-            original = copy.deepcopy(instructions) ###
-            optimized = Optimizer().optimize(instructions)
+            optimizer = Optimizer(settings.get_value('optimizer_passes', None))
+            optimized = optimizer.optimize(instructions)
             self._iter = iter(optimized)
             inst = self._next_inst()
             while inst is not None:
@@ -50,6 +63,19 @@ class Loader:
                     self._main_segment.append(inst)
                 inst = self._next_inst()
 
+    def load_compiled(self, compiled: CompiledProgram):
+        self._main_segment = list(compiled.code)
+        self._routine_segment.clear()
+        self._routines.clear()
+        self._load_runtime()
+        self._routines.update(compiled.routines)
+
+    def get_compiled(self) -> CompiledProgram:
+        routines = {
+            name: rtn for name, rtn in self._routines.items()
+            if not isinstance(rtn, RuntimeRoutine)}
+        return CompiledProgram(self.get_code(), routines)
+
     @inject(i_runtime.Runtime)
     def _load_runtime(self, runtime):
         for name, fn in runtime.get_fns().items():
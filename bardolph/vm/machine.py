@@ -1,28 +1,40 @@
 import logging
+import time
 import traceback
 
-from bardolph.controller import units
-from bardolph.controller.color_matrix import ColorMatrix
+from bardolph.controller import array_matrix, units
 from bardolph.controller.color_matrix import Rect
 from bardolph.controller.get_key import getch
 from bardolph.controller.i_controller import (LightSet, MatrixLight,
                                               MultizoneLight)
 from bardolph.controller.routine import RuntimeRoutine
 from bardolph.controller.units import UnitMode
-from bardolph.lib.i_lib import Clock, TimePattern
+from bardolph.lib.i_lib import Clock, Settings, TimePattern
 from bardolph.lib.injection import inject, provide
 from bardolph.lib.symbol import Symbol
 from bardolph.vm.array import Array
 from bardolph.vm.call_stack import CallStack
-from bardolph.vm.loader import Loader
+from bardolph.vm.loader import CompiledProgram, Loader
 from bardolph.vm.vm_codes import (JumpCondition, LoopVar, OpCode, Operand,
                                   Register, SetOp)
 from bardolph.vm.vm_discover import VmDiscover
 from bardolph.vm.vm_io import VmIo
 from bardolph.vm.vm_math import VmMath
+from bardolph.vm import vm_profile
 
 
 class Registers:
+    """
+    Each register is a slot, named after its Register in lower case. For
+    access by enum, _SLOT_NAMES maps each Register to its slot, so that
+    the name doesn't have to be derived every time.
+    """
+    __slots__ = (
+        'blue', 'brightness', 'default', 'disc_forward', 'duration',
+        'first_column', 'first_row', 'first_zone', 'green', 'hue', 'kelvin',
+        'last_column', 'last_row', 'last_zone', 'matrix', 'name', 'operand',
+        'pc', 'power', 'red', 'result', 'saturation', 'time', 'unit_mode')
+
     def __init__(self):
         self.blue = 0.0
         self.brightness = 0.0
@@ -61,10 +73,14 @@ class Registers:
             self.red, self.green, self.blue, self.kelvin = color
 
     def get_by_enum(self, reg):
-        return getattr(self, reg.name.lower())
+        return getattr(self, _SLOT_NAMES[reg])
 
     def set_by_enum(self, reg, value):
-        setattr(self, reg.name.lower(), value)
+        setattr(self, _SLOT_NAMES[reg], value)
+
+    @staticmethod
+    def slot_name(reg) -> str:
+        return _SLOT_NAMES[reg]
 
     def reset(self):
         self.__init__()
@@ -73,10 +89,17 @@ class Registers:
         return 65535 if self.power else 0
 
 
+_SLOT_NAMES = {
+    reg: reg.name.lower() for reg in Register
+    if reg.name.lower() in Registers.__slots__}
+
+
 class MachineState:
-    def __init__(self, reg, call_stack):
+    """ profile is a vm_profile.Profile, or None if profiling was off. """
+    def __init__(self, reg, call_stack, profile=None):
         self.reg = reg
         self.call_stack = call_stack
+        self.profile = profile
 
 
 class Machine:
@@ -92,6 +115,11 @@ class Machine:
         self._vm_discover = VmDiscover(self._call_stack, self._reg)
         self._enable_pause = True
         self._keep_running = True
+        self._light_set = None
+        self._profile = None
+        # Subscripts from DEREF and INDEX, for the next MOVE to or from an
+        # array, or None.
+        self._subscripts = None
         excluded = (OpCode.STOP, OpCode.ROUTINE)
         op_codes = [code for code in OpCode if code not in excluded]
         self._fn_table = {
@@ -99,6 +127,33 @@ class Machine:
             for op_code in (op_codes)
         }
         self._fn_table[OpCode.STOP] = self.stop
+        self._decoders = {
+            OpCode.JUMP: self._decode_jump,
+            OpCode.MOVE: self._decode_move,
+            OpCode.MOVEQ: self._decode_moveq,
+            OpCode.NOP: self._decode_nop,
+            OpCode.OP: self._decode_op,
+            OpCode.POP: self._decode_pop,
+            OpCode.PUSH: self._decode_push,
+            OpCode.PUSHQ: self._decode_pushq,
+            OpCode.STOP: self._decode_stop
+        }
+        self._color_fns = {
+            Operand.ALL: self._color_all,
+            Operand.DEFAULT: self._color_default,
+            Operand.LIGHT: self._color_light,
+            Operand.GROUP: self._color_group,
+            Operand.LOCATION: self._color_location,
+            Operand.MATRIX: self._color_matrix,
+            Operand.MATRIX_LIGHT: self._color_matrix_light,
+            Operand.MZ_LIGHT: self._color_mz_light
+        }
+        self._power_fns = {
+            Operand.ALL: self._power_all,
+            Operand.LIGHT: self._power_light,
+            Operand.GROUP: self._power_group,
+            Operand.LOCATION: self._power_location
+        }
 
     def reset(self) -> None:
         self._reg.reset()
@@ -106,30 +161,42 @@ class Machine:
         self._cue_time = 0
         self._call_stack.reset()
         self._vm_math.reset()
+        self._subscripts = None
         self._keep_running = True
         self._enable_pause = True
 
-    def run(self, program) -> None:
+    @inject(Settings)
+    def run(self, program, settings) -> None:
+        # The program is either the Parser's output or a CompiledProgram.
         loader = Loader()
-        loader.load(program)
+        if isinstance(program, CompiledProgram):
+            loader.load_compiled(program)
+        else:
+            loader.load(program)
         self._routines = loader.get_routines()
         self._program = loader.get_code()
         self._keep_running = True
+        self._light_set = provide(LightSet)
+        self._profile = None
+        if settings.get_value('vm_profile', False):
+            self._start_profile()
 
         logging.debug('Starting to execute.')
         self._clock.start()
         program_len = len(self._program)
         try:
-            while self._keep_running and self._reg.pc < program_len:
-                inst = self._program[self._reg.pc]
-                if inst.op_code == OpCode.STOP:
-                    break
-                fn = self._fn_table[inst.op_code]
-                fn()
-                if inst.op_code not in (OpCode.END, OpCode.JSR, OpCode.JUMP):
-                    self._reg.pc += 1
+            if settings.get_value('vm_predecode', True):
+                steps = self._decode(self._program)
+                if self._profile is not None:
+                    steps = self._profile_steps(steps)
+                self._run_decoded(steps)
+            elif self._profile is None:
+                self._run_table(self._fn_table)
+            else:
+                self._run_table(self._profile_table())
             self._clock.stop()
             self._vm_io.flush()
+            self._flush_lights()
             logging.debug(
                 'Stopped, _keep_running = {}, _pc = {}, program_len = {}'
                 .format(
@@ -138,13 +205,239 @@ class Machine:
             logging.debug(traceback.format_exc())
             logging.error("Script stopped due to {} at instruction {}"
                           .format(ex, self._reg.pc))
+        finally:
+            if self._profile is not None:
+                self._end_profile()
+
+    def _start_profile(self) -> None:
+        # Clock and light calls go through wrappers that record their times,
+        # and returns from routines are recorded, for this run only.
+        self._profile = vm_profile.Profile()
+        self._profile.total_time = time.perf_counter()
+        self._unprofiled_clock = self._clock
+        self._clock = vm_profile.ProfiledClock(self._clock, self._profile)
+        self._light_set = vm_profile.ProfiledLightSet(
+            self._light_set, self._profile)
+        self._return = self._profiled_return
+
+    def _end_profile(self) -> None:
+        profile = self._profile
+        profile.total_time = time.perf_counter() - profile.total_time
+        self._clock = self._unprofiled_clock
+        del self._return
+
+    def _profiled_return(self) -> None:
+        Machine._return(self)
+        self._profile.exit_routine()
+
+    def _profile_steps(self, steps) -> list:
+        return [self._profile_fn(step, inst.op_code, inst.param0)
+                for step, inst in zip(steps, self._program)]
+
+    def _profile_table(self) -> dict:
+        # The routine name for a JSR is only known when it executes.
+        table = {
+            op_code: self._profile_fn(fn, op_code)
+            for op_code, fn in self._fn_table.items()}
+        jsr = table[OpCode.JSR]
+        enter_routine = self._profile.enter_routine
+        def profiled_jsr():
+            enter_routine(self.current_inst.param0)
+            jsr()
+        table[OpCode.JSR] = profiled_jsr
+        return table
+
+    def _profile_fn(self, fn, op_code, routine_name=None):
+        record_op = self._profile.record_op
+        perf_counter = time.perf_counter
+        if op_code is OpCode.JSR and routine_name is not None:
+            enter_routine = self._profile.enter_routine
+            def profiled():
+                enter_routine(routine_name)
+                start = perf_counter()
+                fn()
+                record_op(op_code, perf_counter() - start)
+        else:
+            def profiled():
+                start = perf_counter()
+                fn()
+                record_op(op_code, perf_counter() - start)
+        return profiled
+
+    def _flush_lights(self) -> None:
+        # Writes still waiting in output queues are sent now, in case the
+        # process is about to exit.
+        self._light_set.flush_writes()
+
+    def _run_table(self, fn_table) -> None:
+        # Look up the handler for each instruction as it is executed.
+        program_len = len(self._program)
+        while self._keep_running and self._reg.pc < program_len:
+            inst = self._program[self._reg.pc]
+            if inst.op_code == OpCode.STOP:
+                break
+            fn = fn_table[inst.op_code]
+            fn()
+            if inst.op_code not in (OpCode.END, OpCode.JSR, OpCode.JUMP):
+                self._reg.pc += 1
+
+    def _run_decoded(self, steps) -> None:
+        # Each step has already been bound to its handler and operands.
+        reg = self._reg
+        program_len = len(steps)
+        while self._keep_running and reg.pc < program_len:
+            steps[reg.pc]()
+
+    def _decode(self, program) -> list:
+        """
+        Translate the program into a list of closures, one per instruction.
+        Handlers, operands, and jump targets are resolved here, once, rather
+        than every time an instruction executes. Each closure leaves the pc
+        pointing at the next instruction.
+        """
+        return [self._decode_inst(address, inst)
+                for address, inst in enumerate(program)]
+
+    def _decode_inst(self, address, inst):
+        decoder = self._decoders.get(inst.op_code)
+        if decoder is not None:
+            return decoder(address, inst)
+        fn = self._fn_table.get(inst.op_code, self._unimpl)
+        if inst.op_code in (OpCode.END, OpCode.JSR):
+            # These set the pc themselves.
+            return fn
+        reg = self._reg
+        def step():
+            fn()
+            reg.pc += 1
+        return step
+
+    def _decode_store(self, dest):
+        # Returns a function that puts a value into a register or variable.
+        if isinstance(dest, Register):
+            reg = self._reg
+            attr = Registers.slot_name(dest)
+            return lambda value: setattr(reg, attr, value)
+        put_variable = self._call_stack.variable_setter(dest)
+        def store(value):
+            if self._subscripts is None:
+                put_variable(value)
+            else:
+                self._put_element(dest, value)
+        return store
+
+    def _decode_jump(self, address, inst):
+        reg = self._reg
+        target = address + inst.param1
+        if inst.param0 is JumpCondition.ALWAYS:
+            def step():
+                reg.pc = target
+            return step
+
+        pop = self._vm_math.pop
+        if_false = inst.param0 is JumpCondition.IF_FALSE
+        next_address = address + 1
+        def step():
+            pop(Register.RESULT)
+            if bool(reg.result) ^ if_false:
+                reg.pc = target
+            else:
+                reg.pc = next_address
+        return step
+
+    def _decode_move(self, _, inst):
+        reg = self._reg
+        srce = inst.param0
+        store = self._decode_store(inst.param1)
+        if isinstance(srce, Register):
+            attr = Registers.slot_name(srce)
+            def step():
+                store(getattr(reg, attr))
+                reg.pc += 1
+        elif isinstance(srce, (str, LoopVar)):
+            get_variable = self._call_stack.variable_getter(srce)
+            def step():
+                value = get_variable()
+                if self._subscripts is not None:
+                    value = self._get_element(value)
+                store(value)
+                reg.pc += 1
+        else:
+            def step():
+                store(srce)
+                reg.pc += 1
+        return step
+
+    def _decode_moveq(self, _, inst):
+        reg = self._reg
+        value, dest = inst.param0, inst.param1
+        if dest is Register.UNIT_MODE:
+            switch_unit_mode = self._switch_unit_mode
+            def step():
+                switch_unit_mode(value)
+                reg.pc += 1
+        else:
+            store = self._decode_store(dest)
+            def step():
+                store(value)
+                reg.pc += 1
+        return step
+
+    def _decode_nop(self, *_):
+        reg = self._reg
+        def step():
+            reg.pc += 1
+        return step
+
+    def _decode_op(self, _, inst):
+        reg = self._reg
+        operator = inst.param0
+        op_fn = self._vm_math.op_fn(operator)
+        def step():
+            op_fn(operator)
+            reg.pc += 1
+        return step
+
+    def _decode_pop(self, _, inst):
+        reg = self._reg
+        pop = self._vm_math.pop_fn(inst.param0)
+        def step():
+            pop()
+            reg.pc += 1
+        return step
+
+    def _decode_push(self, _, inst):
+        reg = self._reg
+        push = self._vm_math.push_fn(inst.param0)
+        def step():
+            push()
+            reg.pc += 1
+        return step
+
+    def _decode_pushq(self, _, inst):
+        reg = self._reg
+        value = inst.param0
+        pushq = self._vm_math.pushq
+        def step():
+            pushq(value)
+            reg.pc += 1
+        return step
+
+    def _decode_stop(self, *_):
+        def step():
+            self._keep_running = False
+        return step
 
     def stop(self) -> None:
         self._keep_running = False
         self._clock.stop()
 
     def get_state(self) -> MachineState:
-        return MachineState(self._reg, self._call_stack)
+        return MachineState(self._reg, self._call_stack, self._profile)
+
+    def get_profile(self):
+        # The vm_profile.Profile from the last run, or None.
+        return self._profile
 
     def get_variable(self, name):
         return self._call_stack.get_variable(name)
@@ -171,26 +464,17 @@ class Machine:
         return self._reg.get_color()
 
     def _color(self) -> None:
-        fn_map = {operand: fn for operand, fn in (
-            (Operand.ALL, self._color_all),
-            (Operand.DEFAULT, self._color_default),
-            (Operand.LIGHT, self._color_light),
-            (Operand.GROUP, self._color_group),
-            (Operand.LOCATION, self._color_location),
-            (Operand.MATRIX, self._color_matrix),
-            (Operand.MATRIX_LIGHT, self._color_matrix_light),
-            (Operand.MZ_LIGHT, self._color_mz_light))}
-        fn_map[self._reg.operand]()
-
-    @inject(LightSet)
-    def _get_named_light(self, light_set) -> None:
+        self._color_fns[self._reg.operand]()
+
+    def _get_named_light(self) -> None:
+        light_set = self._light_set
         light = light_set.get_light(self._reg.name)
         if light is None:
             Machine._report_missing(self._reg.name)
         return light
 
-    @inject(LightSet)
-    def _color_all(self, light_set) -> None:
+    def _color_all(self) -> None:
+        light_set = self._light_set
         color = self._as_raw_color(self._reg.get_color())
         duration = self._as_raw_time(self._reg.duration)
         light_set.set_color_all_lights(color, duration)
@@ -232,49 +516,55 @@ class Machine:
                 self._as_raw_color(self._reg.get_color()),
                 self._as_raw_time(self._reg.duration))
 
-    @inject(LightSet)
-    def _color_group(self, light_set) -> None:
+    def _color_group(self) -> None:
+        light_set = self._light_set
         light_names = light_set.get_group_lights(self._reg.name)
         if light_names is None:
             logging.warning("Unknown group: {}".format(self._reg.name))
         else:
-            self._color_multiple(
-                [light_set.get_light(name) for name in light_names])
+            self._color_multiple(light_names)
 
-    @inject(LightSet)
-    def _color_location(self, light_set) -> None:
+    def _color_location(self) -> None:
+        light_set = self._light_set
         light_names = light_set.get_location_lights(self._reg.name)
         if light_names is None:
             logging.warning("Unknown location: {}".format(self._reg.name))
         else:
-            self._color_multiple(
-                [light_set.get_light(name) for name in light_names])
+            self._color_multiple(light_names)
 
-    def _color_multiple(self, lights) -> None:
+    def _color_multiple(self, light_names) -> None:
+        # All of the lights are sent the new color concurrently.
+        light_set = self._light_set
         color = self._as_raw_color(self._reg.get_color())
         duration = self._as_raw_time(self._reg.duration)
-        for light in lights:
-            light.set_color(color, duration)
+        light_set.set_color_lights(
+            Machine._lights_named(light_set, light_names), color, duration)
+
+    @staticmethod
+    def _lights_named(light_set, light_names) -> list:
+        lights = []
+        for name in light_names:
+            light = light_set.get_light(name)
+            if light is None:
+                Machine._report_missing(name)
+            else:
+                lights.append(light)
+        return lights
 
     def _color_default(self) -> None:
         # The "default" register must always contain raw values.
         self._reg.default = self._as_raw_color(self._reg.get_color())
 
     def _power(self) -> None:
-        {
-            Operand.ALL: self._power_all,
-            Operand.LIGHT: self._power_light,
-            Operand.GROUP: self._power_group,
-            Operand.LOCATION: self._power_location
-        }[self._reg.operand]()
+        self._power_fns[self._reg.operand]()
 
-    @inject(LightSet)
-    def _power_all(self, light_set) -> None:
+    def _power_all(self) -> None:
+        light_set = self._light_set
         duration = self._as_raw_time(self._reg.duration)
         light_set.set_power_all_lights(self._reg.get_power(), duration)
 
-    @inject(LightSet)
-    def _power_light(self, light_set) -> None:
+    def _power_light(self) -> None:
+        light_set = self._light_set
         light = light_set.get_light(self._reg.name)
         if light is None:
             Machine._report_missing(self._reg.name)
@@ -282,33 +572,32 @@ class Machine:
             duration = self._as_raw_time(self._reg.duration)
             light.set_power(self._reg.get_power(), duration)
 
-    @inject(LightSet)
-    def _power_group(self, light_set) -> None:
+    def _power_group(self) -> None:
+        light_set = self._light_set
         light_names = light_set.get_group_lights(self._reg.name)
         if light_names is None:
             logging.warning(
                 'Power invoked for unknown group "{}"'.format(self._reg.name))
         else:
-            self._power_multiple(
-                [light_set.get_light(name) for name in light_names])
+            self._power_multiple(light_names)
 
-    @inject(LightSet)
-    def _power_location(self, light_set) -> None:
+    def _power_location(self) -> None:
+        light_set = self._light_set
         light_names = light_set.get_location_lights(self._reg.name)
         if light_names is None:
             logging.warning(
                 "Power invoked for unknown location: {}".format(self._reg.name))
         else:
-            self._power_multiple(
-                [light_set.get_light(name) for name in light_names])
+            self._power_multiple(light_names)
 
-    def _power_multiple(self, lights) -> None:
-        power = self._reg.get_power()
-        for light in lights:
-            light.set_power(power, self._reg.duration)
+    def _power_multiple(self, light_names) -> None:
+        light_set = self._light_set
+        light_set.set_power_lights(
+            Machine._lights_named(light_set, light_names),
+            self._reg.get_power(), self._reg.duration)
 
-    @inject(LightSet)
-    def _get_color(self, light_set) -> None:
+    def _get_color(self) -> None:
+        light_set = self._light_set
         name = self._reg.name
         light = light_set.get_light(name)
         if light is None:
@@ -382,8 +671,8 @@ class Machine:
     def _end_loop(self) -> None:
         self._call_stack.exit_loop()
 
-    @inject(LightSet)
-    def _matrix(self, light_set) -> None:
+    def _matrix(self) -> None:
+        light_set = self._light_set
         name = self._reg.name
         light = light_set.get_light(name)
         if light is None:
@@ -397,7 +686,8 @@ class Machine:
         else:
             height = light.get_height() or 0
             width = light.get_width() or 0
-        self._reg.matrix = ColorMatrix.new_from_constant(height, width, None)
+        self._reg.matrix = array_matrix.matrix_class().new_from_constant(
+            height, width, None)
 
     def _array(self):
         array_name = self.current_inst.param0
@@ -411,21 +701,33 @@ class Machine:
         return True
 
     def _deref(self):
-        # Should put the result on the top of the expression stack.
+        # Starts the list of subscripts for the next access to an array.
         offset = self._param_value(self.current_inst.param1)
-        array_name = self.current_inst.param0
-        array = self._call_stack.get_variable(array_name)
-        array.deref(offset)
+        self._subscripts = [] if offset is None else [offset]
         return True
 
     def _index(self):
-        # Should put the result on the top of the expression stack.
         offset = self._param_value(self.current_inst.param1)
-        array_name = self.current_inst.param0
-        array = self._call_stack.get_variable(array_name)
-        array.index(offset)
+        if self._subscripts is None:
+            self._subscripts = []
+        self._subscripts.append(offset)
         return True
 
+    def _get_element(self, value):
+        # If value is an array, the element at the pending subscripts.
+        subscripts, self._subscripts = self._subscripts, None
+        if not isinstance(value, Array) or len(subscripts) == 0:
+            return value
+        return value.get(subscripts)
+
+    def _put_element(self, name, value) -> None:
+        subscripts, self._subscripts = self._subscripts, None
+        array = self._call_stack.get_variable(name)
+        if isinstance(array, Array) and len(subscripts) > 0:
+            array.set(subscripts, value)
+        else:
+            self._call_stack.put_variable(name, value)
+
     def _nop(self) -> bool:
         return True
 
@@ -512,9 +814,7 @@ class Machine:
     def _as_raw_matrix(self, srce):
         if self._reg.unit_mode is UnitMode.RAW:
             return srce
-        xform_fn = units.convert_fn(self._reg.unit_mode, UnitMode.RAW)
-        return ColorMatrix.new_from_iterable(srce.height, srce.width,
-            (xform_fn(color) for color in srce.get_colors()))
+        return srce.convert_units(self._reg.unit_mode, UnitMode.RAW)
 
     def _assure_units(self, color):
         """
@@ -529,10 +829,7 @@ class Machine:
     def _assure_units_matrix(self, srce):
         if self._reg.unit_mode is UnitMode.RAW:
             return srce
-
-        xform_fn = units.convert_fn(UnitMode.RAW, self._reg.unit_mode)
-        return ColorMatrix.new_from_iterable(
-            (xform_fn(color) for color in srce.as_list()), 6, 5)
+        return srce.convert_units(UnitMode.RAW, self._reg.unit_mode)
 
     def _move(self) -> None:
         # Move from variable/register to variable/register.
@@ -542,8 +839,8 @@ class Machine:
             value = self._reg.get_by_enum(value)
         elif isinstance(value, (str, LoopVar)):
             value = self._call_stack.get_variable(value)
-            ### if isinstance(value, Array, ArrayBranch):
-            ###    value = value.get_value()
+            if self._subscripts is not None:
+                value = self._get_element(value)
         self._do_put_value(dest, value)
 
     def _moveq(self) -> None:
@@ -558,12 +855,10 @@ class Machine:
     def _do_put_value(self, dest, value) -> None:
         if isinstance(dest, Register):
             self._reg.set_by_enum(dest, value)
+        elif self._subscripts is not None:
+            self._put_element(dest, value)
         else:
-            current_value = self._call_stack.get_variable(dest)
-            ### if isinstance(current_value, Array):
-            ###     current_value.set_value(value)
-            ### else:
-            self._call_stack.put_variable(dest, value) ###
+            self._call_stack.put_variable(dest, value)
 
     def _switch_unit_mode(self, to_mode) -> None:
         from_mode = self._reg.unit_mode
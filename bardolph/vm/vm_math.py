@@ -42,6 +42,26 @@ class VmMath:
         assert value is not None, "pushing None onto eval stack"
         self._eval_stack.push(value)
 
+    def push_fn(self, srce):
+        # A function with no parameters that does the same as push(srce).
+        push = self._eval_stack.push
+        if self.is_constant_push(srce):
+            return lambda: push(srce)
+        if isinstance(srce, Register):
+            reg = self._reg
+            attr = reg.slot_name(srce)
+            get_value = lambda: getattr(reg, attr)
+        elif isinstance(srce, (str, LoopVar)):
+            get_value = self._call_stack.variable_getter(srce)
+        else:
+            return lambda: self.push(srce)
+
+        def push_value():
+            value = get_value()
+            assert value is not None, "pushing None onto eval stack"
+            push(value)
+        return push_value
+
     def pushq(self, srce) -> None:
         self._eval_stack.push(srce)
 
@@ -54,13 +74,28 @@ class VmMath:
         elif isinstance(dest, (str, LoopVar)):
             self._call_stack.put_variable(dest, value)
 
+    def pop_fn(self, dest):
+        # A function with no parameters that does the same as pop(dest).
+        pop = self._eval_stack.pop
+        if isinstance(dest, Register):
+            reg = self._reg
+            attr = reg.slot_name(dest)
+            return lambda: setattr(reg, attr, pop())
+        if isinstance(dest, (str, LoopVar)):
+            put_value = self._call_stack.variable_setter(dest)
+            return lambda: put_value(pop())
+        return pop
+
     def op(self, operator) -> None:
+        self.op_fn(operator)(operator)
+
+    def op_fn(self, operator):
+        # The method that carries out the operator, given the operator itself.
         if operator in (Operator.UADD, Operator.USUB, Operator.NOT):
-            self.unary_op(operator)
-        elif operator in (Operator.AND, Operator.OR):
-            self.logical_op(operator)
-        else:
-            self.bin_op(operator)
+            return self.unary_op
+        if operator in (Operator.AND, Operator.OR):
+            return self.logical_op
+        return self.bin_op
 
     def unary_op(self, operator) -> None:
         if operator is Operator.USUB:
@@ -78,3 +113,33 @@ class VmMath:
         op1 = bool(self._eval_stack.pop())
         result = op1 and op2 if operator == Operator.AND else op1 or op2
         self._eval_stack.push(result)
+
+    @staticmethod
+    def arity(operator) -> int:
+        if operator in (Operator.UADD, Operator.USUB, Operator.NOT):
+            return 1
+        return 2
+
+    @staticmethod
+    def evaluate(operator, *operands):
+        """
+        The value that op() would leave on the stack, given the values it
+        would pop off, in the order they were pushed. Used to fold constants
+        before the program runs.
+        """
+        if operator is Operator.USUB:
+            return -operands[0]
+        if operator is Operator.NOT:
+            return not operands[0]
+        if operator is Operator.UADD:
+            return operands[0]
+        if operator in (Operator.AND, Operator.OR):
+            op1, op2 = bool(operands[0]), bool(operands[1])
+            return op1 and op2 if operator == Operator.AND else op1 or op2
+        return VmMath._fn_table[operator](*operands)
+
+    @staticmethod
+    def is_constant_push(srce) -> bool:
+        # True if push() puts srce itself on the stack.
+        return (isinstance(srce, Number)
+                or srce in (Register.UNIT_MODE, Operand.NULL))
@@ -0,0 +1,262 @@
+"""
+Profiling for the VM, turned on with the vm_profile setting. While a script
+runs, the Machine records how many times each op-code executes and how long
+it takes, how long each routine takes from its JSR to its return, how long
+the clock keeps the script waiting, and how long each call to a light takes.
+
+When the setting is off, none of the classes here are used, and the Machine
+runs exactly as it would without them.
+
+All times are in seconds. An op-code's time includes everything done on its
+behalf, so the time for a COLOR instruction includes the calls to the
+lights, and the time for WAIT includes the wait itself.
+"""
+
+import threading
+import time
+
+from bardolph.controller import i_controller
+from bardolph.lib import i_lib
+
+
+class Profile:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.op_codes = {}
+        self.routines = {}
+        self.clock = {}
+        self.lights = {}
+        self.total_time = 0.0
+        self._routine_stack = []
+
+    def __getstate__(self):
+        # A Profile can be pickled, so that it can come back from a worker
+        # process, but the lock stays behind.
+        state = self.__dict__.copy()
+        del state['_lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _add(table, key, elapsed) -> None:
+        entry = table.get(key)
+        if entry is None:
+            table[key] = [1, elapsed]
+        else:
+            entry[0] += 1
+            entry[1] += elapsed
+
+    def record_op(self, op_code, elapsed) -> None:
+        self._add(self.op_codes, op_code, elapsed)
+
+    def enter_routine(self, name) -> None:
+        self._routine_stack.append((name, time.perf_counter()))
+
+    def exit_routine(self) -> None:
+        if len(self._routine_stack) > 0:
+            name, start = self._routine_stack.pop()
+            self._add(self.routines, name, time.perf_counter() - start)
+
+    def record_clock(self, method, elapsed) -> None:
+        self._add(self.clock, method, elapsed)
+
+    def record_light(self, light_name, method, elapsed) -> None:
+        # Lights can be called from several threads at once.
+        with self._lock:
+            self._add(self.lights, (light_name, method), elapsed)
+
+    def get_light_totals(self) -> dict:
+        # Counts and times for each method, across all of the lights.
+        totals = {}
+        with self._lock:
+            for (_, method), (count, elapsed) in self.lights.items():
+                entry = totals.setdefault(method, [0, 0.0])
+                entry[0] += count
+                entry[1] += elapsed
+        return totals
+
+    def as_dict(self) -> dict:
+        """
+        Everything, with names as keys. Each value is a dict with count and
+        time. Light calls are keyed on "light name.method".
+        """
+        def convert(table, key_fn=str):
+            return {key_fn(key): {'count': count, 'time': elapsed}
+                    for key, (count, elapsed) in table.items()}
+
+        with self._lock:
+            lights = convert(self.lights, lambda key: '.'.join(key))
+        return {
+            'total_time': self.total_time,
+            'op_codes': convert(self.op_codes, lambda key: key.name),
+            'routines': convert(self.routines),
+            'clock': convert(self.clock),
+            'lights': lights
+        }
+
+    def report(self) -> str:
+        lines = ['Total time: {:.3f} s'.format(self.total_time)]
+
+        def section(title, table, key_fn=str):
+            if len(table) == 0:
+                return
+            lines.append('')
+            lines.append('{:24} {:>10} {:>12} {:>10}'.format(
+                title, 'count', 'total ms', 'mean us'))
+            for key, (count, elapsed) in sorted(
+                    table.items(), key=lambda item: -item[1][1]):
+                lines.append('{:24} {:10d} {:12.3f} {:10.1f}'.format(
+                    key_fn(key), count, elapsed * 1000.0,
+                    elapsed * 1e6 / count))
+
+        section('op-code', self.op_codes, lambda key: key.name)
+        section('routine', self.routines)
+        section('clock', self.clock)
+        section('light call', self.get_light_totals())
+        return '\n'.join(lines)
+
+
+class ProfiledClock(i_lib.Clock):
+    def __init__(self, clock, profile):
+        self._clock = clock
+        self._profile = profile
+
+    def start(self):
+        self._clock.start()
+
+    def stop(self):
+        self._clock.stop()
+
+    def reset(self):
+        self._clock.reset()
+
+    def pause_for(self, delay):
+        start = time.perf_counter()
+        try:
+            self._clock.pause_for(delay)
+        finally:
+            self._profile.record_clock(
+                'pause_for', time.perf_counter() - start)
+
+    def wait_until(self, time_pattern):
+        start = time.perf_counter()
+        try:
+            self._clock.wait_until(time_pattern)
+        finally:
+            self._profile.record_clock(
+                'wait_until', time.perf_counter() - start)
+
+
+def _timed(method):
+    # A method that forwards to the wrapped light and records the time.
+    def timed_method(self, *args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return getattr(self._light, method)(*args, **kwargs)
+        finally:
+            self._profile.record_light(
+                self._name, method, time.perf_counter() - start)
+    timed_method.__name__ = method
+    return timed_method
+
+
+class _ProfiledLight(i_controller.Light):
+    """
+    Stands in for a light, with the same interface, so that isinstance()
+    checks still work. Anything other than the calls that are timed goes
+    straight to the light.
+    """
+    def __init__(self, light, profile):
+        self._light = light
+        self._profile = profile
+        self._name = light.get_name()
+
+    def __getattr__(self, name):
+        return getattr(self._light, name)
+
+    def get_uid(self):
+        return self._light.get_uid()
+
+    def get_name(self):
+        return self._name
+
+    def get_group(self):
+        return self._light.get_group()
+
+    def get_location(self):
+        return self._light.get_location()
+
+    def get_height(self):
+        return self._light.get_height()
+
+    def get_width(self):
+        return self._light.get_width()
+
+    def is_color(self):
+        return self._light.is_color()
+
+    def get_age(self):
+        return self._light.get_age()
+
+    get_color = _timed('get_color')
+    set_color = _timed('set_color')
+    get_power = _timed('get_power')
+    set_power = _timed('set_power')
+
+
+class _ProfiledMultizoneLight(_ProfiledLight, i_controller.MultizoneLight):
+    get_height = _ProfiledLight.get_height
+    get_width = _ProfiledLight.get_width
+    get_zone_colors = _timed('get_zone_colors')
+    set_zone_colors = _timed('set_zone_colors')
+    set_zone_list = _timed('set_zone_list')
+
+
+class _ProfiledMatrixLight(_ProfiledLight, i_controller.MatrixLight):
+    get_height = _ProfiledLight.get_height
+    get_width = _ProfiledLight.get_width
+    get_matrix = _timed('get_matrix')
+    set_matrix = _timed('set_matrix')
+
+
+def profiled_light(light, profile):
+    if light is None:
+        return None
+    if isinstance(light, i_controller.MultizoneLight):
+        return _ProfiledMultizoneLight(light, profile)
+    if isinstance(light, i_controller.MatrixLight):
+        return _ProfiledMatrixLight(light, profile)
+    return _ProfiledLight(light, profile)
+
+
+class ProfiledLightSet:
+    """
+    Hands out profiled lights. Calls for all the lights at once are
+    recorded under the name "all".
+    """
+    def __init__(self, light_set, profile):
+        self._light_set = light_set
+        self._profile = profile
+
+    def __getattr__(self, name):
+        return getattr(self._light_set, name)
+
+    def get_light(self, name):
+        return profiled_light(self._light_set.get_light(name), self._profile)
+
+    def _time_all(self, method, *args):
+        start = time.perf_counter()
+        try:
+            return getattr(self._light_set, method)(*args)
+        finally:
+            self._profile.record_light(
+                'all', method, time.perf_counter() - start)
+
+    def set_color_all_lights(self, color, duration):
+        return self._time_all('set_color_all_lights', color, duration)
+
+    def set_power_all_lights(self, power_level, duration):
+        return self._time_all('set_power_all_lights', power_level, duration)
@@ -0,0 +1,158 @@
+#!/usr/bin/env python
+
+"""
+Compare the two ways the VM can dispatch instructions: looking up each
+handler in the op-code table as it executes, or running the closures that
+are pre-decoded when the program is loaded.
+
+Scripts run against fake lights, and waits return immediately. Scripts that
+never end on their own are stopped after a fixed number of waits.
+
+Run from the top-level directory:
+    python -m benchmarks.dispatch_benchmark
+"""
+
+import argparse
+import glob
+import logging
+import time
+
+from bardolph.controller import light_set
+from bardolph.fakes import fake_light_api
+from bardolph.lib import i_lib, injection, object_list_output, settings
+from bardolph.parser.parse import Parser
+from bardolph.runtime import runtime_module
+from bardolph.vm.machine import Machine
+
+_TIGHT_LOOP = """
+    units raw
+    saturation 50000 brightness 30000 kelvin 2700
+    define spin with n begin
+        assign total 0
+        repeat n with i from 0 to n
+            assign total {total + i % 7}
+    end
+    repeat 200 with the_hue cycle begin
+        hue {the_hue * 182}
+        set "Top" and "Middle" and "Bottom"
+        spin 20
+    end
+"""
+
+
+class _BudgetClock(i_lib.Clock):
+    """
+    Returns immediately from every wait, but stops the machine after a given
+    number of them, so that infinite loops still finish.
+    """
+    def __init__(self, max_waits):
+        self._max_waits = max_waits
+        self._num_waits = 0
+        self.machine = None
+
+    def start(self):
+        self._num_waits = 0
+
+    def pause_for(self, _):
+        self._num_waits += 1
+        if self._num_waits >= self._max_waits and self.machine is not None:
+            self.machine.stop()
+
+    def wait_until(self, time_pattern):
+        self.pause_for(0)
+
+
+def _configure(predecode):
+    settings.using({
+        'log_level': logging.ERROR,
+        'log_to_console': True,
+        'single_light_discover': True,
+        'use_fakes': True,
+        'vm_predecode': predecode
+    }).configure()
+
+
+def _init(max_waits):
+    injection.configure()
+    _configure(True)
+    logging.basicConfig(level=logging.ERROR)
+    clock = _BudgetClock(max_waits)
+    injection.bind_instance(clock).to(i_lib.Clock)
+    fake_light_api.configure()
+    light_set.configure()
+    object_list_output.configure()
+    runtime_module.configure()
+    return clock
+
+
+def _compile(name, source):
+    parser = Parser()
+    if not parser.parse(source):
+        logging.error('{}: {}'.format(name, parser.get_errors()))
+        return None
+    return parser.get_program()
+
+
+def _time_runs(name, source, clock, predecode, repeat):
+    # Returns the best time, in seconds, across all the runs. Loading a program
+    # modifies it, so each run gets a freshly compiled copy.
+    _configure(predecode)
+    best = None
+    for _ in range(0, repeat):
+        program = _compile(name, source)
+        if program is None:
+            return None
+        machine = Machine()
+        clock.machine = machine
+        start = time.perf_counter()
+        machine.run(program)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def _scripts(patterns):
+    yield ('tight-loop', _TIGHT_LOOP)
+    for pattern in patterns:
+        for file_name in sorted(glob.glob(pattern)):
+            with open(file_name) as srce:
+                yield (file_name, srce.read())
+
+
+def _init_args():
+    arg_parser = argparse.ArgumentParser()
+    arg_parser.add_argument(
+        'patterns', nargs='*', default=['examples/*.ls', 'scripts/*.ls'],
+        help='glob patterns for script files')
+    arg_parser.add_argument(
+        '-r', '--repeat', type=int, default=5, help='runs per script')
+    arg_parser.add_argument(
+        '-w', '--max-waits', type=int, default=500,
+        help='number of waits before a script is stopped')
+    return arg_parser.parse_args()
+
+
+def main():
+    args = _init_args()
+    clock = _init(args.max_waits)
+
+    print('{:32} {:>10} {:>10} {:>8}'.format(
+        'script', 'table ms', 'decoded ms', 'speedup'))
+    total_table = total_decoded = 0.0
+    for name, source in _scripts(args.patterns):
+        table = _time_runs(name, source, clock, False, args.repeat)
+        if table is None:
+            continue
+        decoded = _time_runs(name, source, clock, True, args.repeat)
+        total_table += table
+        total_decoded += decoded
+        print('{:32} {:10.3f} {:10.3f} {:7.2f}x'.format(
+            name, table * 1000.0, decoded * 1000.0, table / decoded))
+    if total_decoded > 0.0:
+        print('{:32} {:10.3f} {:10.3f} {:7.2f}x'.format(
+            'total', total_table * 1000.0, total_decoded * 1000.0,
+            total_table / total_decoded))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,141 @@
+#!/usr/bin/env python
+
+"""
+End-to-end timing against simulated devices: discovery, and a script that
+sets the color of every light over and over. Everything goes through the
+real stack, from the VM to packets on a local UDP socket, using the asyncio
+implementation of the LAN protocol. The simulator runs in this process,
+with whatever latency, packet loss, and rate limit are given.
+
+Run from the top-level directory:
+    python -m benchmarks.lan_benchmark --bulbs 50 --latency 0.01
+"""
+
+import argparse
+import logging
+import time
+
+from bardolph.controller import i_controller, light_module
+from bardolph.fakes.lan_simulator import LanSimulator
+from bardolph.lib import injection, settings
+from bardolph.lib.injection import provide
+from bardolph.parser.parse import Parser
+from bardolph.runtime import runtime_module
+from bardolph.vm.machine import Machine
+
+_SCRIPT = """
+    units raw
+    saturation 65535 brightness 30000 kelvin 2700 duration 0 time 0
+    repeat {} with the_hue cycle begin
+        hue {{the_hue * 182}}
+        set group "Simulated"
+    end
+"""
+
+
+def _init_args():
+    arg_parser = argparse.ArgumentParser()
+    arg_parser.add_argument(
+        '-b', '--bulbs', type=int, default=20, help='number of bulbs')
+    arg_parser.add_argument(
+        '-s', '--strips', type=int, default=4, help='number of strips')
+    arg_parser.add_argument(
+        '-t', '--tiles', type=int, default=2, help='number of tile chains')
+    arg_parser.add_argument(
+        '-l', '--latency', type=float, default=0.002,
+        help='seconds before each response')
+    arg_parser.add_argument(
+        '-j', '--jitter', type=float, default=0.0,
+        help='most random seconds added to the latency')
+    arg_parser.add_argument(
+        '-x', '--loss', type=float, default=0.0,
+        help='probability of dropping a packet')
+    arg_parser.add_argument(
+        '-r', '--rate-limit', type=int, default=0,
+        help='most messages per second for each device')
+    arg_parser.add_argument(
+        '-n', '--repeat', type=int, default=50,
+        help='times the script sets every light')
+    arg_parser.add_argument(
+        '-d', '--delivery', default='rapid', help='delivery mode')
+    arg_parser.add_argument(
+        '-w', '--max-write-rate', type=int, default=0,
+        help='the max_write_rate setting; zero means no limit')
+    return arg_parser.parse_args()
+
+
+def _configure(args, address):
+    injection.configure()
+    settings.using({
+        'background_discovery': False,
+        'delivery_mode': args.delivery,
+        'inventory_file': None,
+        'lan_broadcast': '{}:{}'.format(*address),
+        'lan_discovery_time': 0.5,
+        'light_api': 'async',
+        'log_level': logging.ERROR,
+        'log_to_console': True,
+        'max_write_rate': args.max_write_rate,
+        'shadow_max_age': 0,
+        'single_light_discover': True,
+        'use_fakes': False
+    }).configure()
+
+
+def _time_discovery(num_devices):
+    # Seconds to the first light, to the last one, and until get_lights()
+    # returns, which includes the wait for any more responses.
+    light_api = provide(i_controller.LightApi)
+    start = time.perf_counter()
+    arrivals = [time.perf_counter() - start for _ in light_api.get_lights()]
+    total = time.perf_counter() - start
+    if len(arrivals) < num_devices:
+        print('Only {} of {} devices were found.'.format(
+            len(arrivals), num_devices))
+    if len(arrivals) == 0:
+        return None
+    return arrivals[0], arrivals[-1], total
+
+
+def _time_script(repeat):
+    parser = Parser()
+    if not parser.parse(_SCRIPT.format(repeat)):
+        logging.error(parser.get_errors())
+        return None
+    machine = Machine()
+    start = time.perf_counter()
+    machine.run(parser.get_program())
+    provide(i_controller.LightSet).flush_writes()
+    return time.perf_counter() - start
+
+
+def main():
+    args = _init_args()
+    simulator = LanSimulator(
+        latency=args.latency, jitter=args.jitter, loss=args.loss,
+        rate_limit=args.rate_limit)
+    num_devices = len(
+        simulator.populate(args.bulbs, args.strips, args.tiles))
+    simulator.start()
+    _configure(args, simulator.get_address())
+    light_module.configure()
+    runtime_module.configure()
+
+    discovery = _time_discovery(num_devices)
+    if discovery is not None:
+        print('discovery: first {:.3f} s, last {:.3f} s, total {:.3f} s'
+              .format(*discovery))
+
+    simulator.reset_stats()
+    elapsed = _time_script(args.repeat)
+    if elapsed is not None:
+        writes = args.repeat * num_devices
+        stats = simulator.get_stats()
+        print('script: {} writes in {:.3f} s, {:.0f} writes/s'.format(
+            writes, elapsed, writes / elapsed))
+        print('simulator: {}'.format(stats))
+    simulator.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,139 @@
+#!/usr/bin/env python
+
+"""
+Frames per second, on one core, for sending a full frame to a matrix light:
+the colors are filled in, and every tile is packed and sent over UDP to a
+socket on the local host that never reads them.
+
+Three ways are compared: building a lifxlan SetTileState64 message for each
+tile from get_colors(), as was done before, and MatrixLight.set_matrix()
+packing the pixels straight into its reusable packet, with a list-based and,
+if NumPy is installed, an array-based matrix.
+
+Run from the top-level directory:
+    python -m benchmarks.matrix_benchmark
+"""
+
+import argparse
+import socket
+import time
+
+from lifxlan.msgtypes import SetTileState64
+
+from bardolph.controller import array_matrix, delivery, lifx_lan_light
+from bardolph.controller.color_matrix import ColorMatrix, Rect
+from bardolph.lib import injection, settings
+
+_MAC_ADDR = 'd0:73:d5:00:00:01'
+_CHAINS = (
+    ('candle 6x5', [(5, 6)]),
+    ('tile x5', [(8, 8)] * 5),
+    ('ceiling 16x8', [(16, 8)])
+)
+
+
+class _Impl:
+    # Just enough of a lifxlan device for MatrixLight to send frames.
+    def __init__(self, address):
+        self.mac_addr = _MAC_ADDR
+        self.source_id = 1234
+        self.ip_addr, self.port = address
+        self.power_level = 0
+
+    def get_mac_addr(self):
+        return self.mac_addr
+
+
+def _fill(mat, frame) -> None:
+    # Something different in each frame, so that every tile gets sent.
+    mat.set_from_constant([frame % 65536, 65535, 32768, 2700])
+    mat.overlay_color(
+        Rect(0, mat.height // 2, None, None), [0, 0, frame % 1000, 2700])
+
+
+def _lifxlan_frame(mat, tiles, sock, address) -> None:
+    colors = mat.get_colors()
+    left = 0
+    for tile_index, (width, height) in enumerate(tiles):
+        rows = 64 // width
+        for y in range(0, height, rows):
+            pixels = [colors[row * mat.width + column]
+                      for row in range(y, min(y + rows, height))
+                      for column in range(left, left + width)]
+            msg = SetTileState64(_MAC_ADDR, 1234, 0, {
+                'tile_index': tile_index, 'length': 1, 'reserved': 0,
+                'x': 0, 'y': y, 'width': width, 'duration': 0,
+                'colors': pixels
+            })
+            sock.sendto(msg.packed_message, address)
+        left += width
+
+
+def _rate(fn, seconds) -> float:
+    # Frames per second, running fn(frame) for about the given time.
+    frames = 0
+    start = time.perf_counter()
+    end = start + seconds
+    while time.perf_counter() < end:
+        fn(frames)
+        frames += 1
+    return frames / (time.perf_counter() - start)
+
+
+def _init_args():
+    arg_parser = argparse.ArgumentParser()
+    arg_parser.add_argument(
+        '-t', '--time', type=float, default=1.0,
+        help='seconds to run each measurement')
+    return arg_parser.parse_args()
+
+
+def main():
+    args = _init_args()
+    injection.configure()
+    settings.using({
+        'delivery_mode': 'rapid', 'shadow_max_age': 10
+    }).configure()
+    delivery.configure()
+
+    sink = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sink.bind(('127.0.0.1', 0))
+    address = sink.getsockname()
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+    # Without NumPy, there's no array column.
+    classes = [ColorMatrix, array_matrix.ArrayMatrix]
+    if array_matrix.numpy is None:
+        classes = classes[0:1]
+
+    print('{:16} {:>12} {:>12} {:>12}'.format(
+        'chain', 'lifxlan fps', 'list fps', 'array fps'))
+    for name, tiles in _CHAINS:
+        light = lifx_lan_light.MatrixLight(_Impl(address), {
+            'label': name, 'group': '', 'location': '', 'features': {},
+            'tiles': tiles
+        })
+        height, width = light.get_height(), light.get_width()
+
+        mat = ColorMatrix(height, width)
+        def lifxlan_fn(frame):
+            _fill(mat, frame)
+            _lifxlan_frame(mat, tiles, sock, address)
+        results = [_rate(lifxlan_fn, args.time)]
+
+        for cls in classes:
+            packed_mat = cls(height, width)
+            def packed_fn(frame):
+                _fill(packed_mat, frame)
+                light.set_matrix(packed_mat)
+            results.append(_rate(packed_fn, args.time))
+
+        print('{:16} '.format(name) + ' '.join(
+            '{:12.0f}'.format(fps) for fps in results)
+            + ' {:>12}'.format('-') * (3 - len(results)))
+    sink.close()
+    sock.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,509 @@
+#!/usr/bin/env python
+
+"""
+Timings for the parts of the system that matter for performance: the lexer
+and parser, the optimizer and loader, compiling a ScriptJob with and without
+the program cache, the VM, matrices, unit conversions, and discovery against
+fake and simulated lights.
+
+Each benchmark is run repeatedly for a fixed amount of time, and the best
+run is kept, because it's the one least disturbed by everything else going
+on in the machine. Results can be written to a JSON file and compared with
+an earlier one. A benchmark that has slowed down by more than its threshold
+counts as a regression, and the exit status is then 1.
+
+Run from the top-level directory:
+    python -m benchmarks.suite --output baseline.json
+    ... make changes ...
+    python -m benchmarks.suite --baseline baseline.json
+"""
+
+import argparse
+import fnmatch
+import json
+import logging
+import os
+import platform
+import sys
+import tempfile
+import time
+
+from bardolph.controller import (array_matrix, async_adapter, i_controller,
+                                 light_set, program_cache, units)
+from bardolph.controller.color_matrix import ColorMatrix, Rect
+from bardolph.controller.script_job import ScriptJob
+from bardolph.controller.units import UnitMode
+from bardolph.fakes import fake_light_api
+from bardolph.fakes.lan_simulator import LanSimulator
+from bardolph.lib import i_lib, injection, object_list_output, settings
+from bardolph.parser.lex import Lex
+from bardolph.parser.optimizer import Optimizer
+from bardolph.parser.parse import Parser
+from bardolph.runtime import runtime_module
+from bardolph.vm.loader import Loader
+from bardolph.vm.machine import Machine
+
+_SCHEMA_VERSION = 1
+_DEFAULT_THRESHOLD = 0.25
+
+_BLOCK = """
+define routine_{n} with a b begin
+    assign x {{a * 2 + b % 7}}
+    if {{x > 10 && b != {n}}} begin
+        hue {{x % 360}}
+    end else begin
+        hue 120
+    end
+    saturation 80 brightness {{b % 100}} kelvin 2700
+    set "Top" and "Bottom"
+end
+
+repeat 3 with h from 0 to 360 begin
+    routine_{n} h {n}
+    duration 1.5 time 0
+    set group "Pole"
+    set "Strip" zone 2 5
+end
+"""
+
+_TIGHT_LOOP = """
+    units raw
+    saturation 50000 brightness 30000 kelvin 2700 time 0
+    define spin with n begin
+        assign total 0
+        repeat n with i from 0 to n
+            assign total {total + i % 7}
+    end
+    repeat 100 with the_hue cycle begin
+        hue {the_hue * 182}
+        set "Top" and "Middle" and "Bottom"
+        spin 20
+    end
+"""
+
+
+def generate_script(num_blocks) -> str:
+    # A script with num_blocks routines, each one called from a loop.
+    return ''.join(_BLOCK.format(n=n) for n in range(0, num_blocks))
+
+
+def _compile(source):
+    parser = Parser()
+    if not parser.parse(source):
+        raise ValueError(parser.get_errors())
+    return parser.get_program()
+
+
+class _InstantClock(i_lib.Clock):
+    # Every wait returns immediately.
+    def start(self): pass
+    def stop(self): pass
+    def pause_for(self, _): pass
+    def wait_until(self, _): pass
+
+
+def _configure(**overrides):
+    injection.configure()
+    values = {
+        'background_discovery': False,
+        'inventory_file': None,
+        'log_level': logging.ERROR,
+        'log_to_console': True,
+        'max_write_rate': 0,
+        'optimizer_passes': 'all',
+        'shadow_max_age': 0,
+        'single_light_discover': True,
+        'use_fakes': True
+    }
+    values.update(overrides)
+    settings.using(values).configure()
+    injection.bind_instance(_InstantClock()).to(i_lib.Clock)
+    fake_light_api.configure()
+    light_set.configure()
+    object_list_output.configure()
+    runtime_module.configure()
+    program_cache.configure()
+
+
+class Benchmark:
+    """
+    setup() is called, untimed, before each run, and whatever it returns is
+    passed to run(). ops is how many operations one run performs, for the
+    rate in the results, and unit names them.
+    """
+    name = None
+    unit = 'runs'
+    ops = 1
+    threshold = _DEFAULT_THRESHOLD
+
+    def prepare(self) -> None:
+        pass
+
+    def setup(self):
+        return None
+
+    def run(self, arg) -> None:
+        pass
+
+    def finish(self) -> None:
+        pass
+
+
+class _LexBenchmark(Benchmark):
+    name = 'lex.tokens'
+    unit = 'tokens'
+    num_blocks = 50
+
+    def prepare(self):
+        _configure()
+        self._script = generate_script(self.num_blocks)
+        self.ops = sum(1 for _ in Lex(self._script).tokens())
+
+    def run(self, _):
+        for _ in Lex(self._script).tokens():
+            pass
+
+
+class _LargeLexBenchmark(_LexBenchmark):
+    name = 'lex.tokens.large'
+    num_blocks = 1000
+
+
+class _FileLexBenchmark(_LargeLexBenchmark):
+    # Reads the script from a file, a line at a time, as the tokens are
+    # consumed.
+    name = 'lex.file'
+
+    def prepare(self):
+        super().prepare()
+        self._file = tempfile.NamedTemporaryFile(
+            'w', suffix='.ls', delete=False)
+        with self._file:
+            self._file.write(self._script)
+
+    def run(self, _):
+        with open(self._file.name, 'r') as srce:
+            for _ in Lex(srce).tokens():
+                pass
+
+    def finish(self):
+        os.remove(self._file.name)
+
+
+class _ParseBenchmark(_LexBenchmark):
+    name = 'parser.parse'
+
+    def run(self, _):
+        Parser().parse(self._script)
+
+
+class _IncrementalParseBenchmark(_ParseBenchmark):
+    # Each run changes only the last statement of the script, as an editor
+    # would, so everything before it comes from the statement cache.
+    name = 'parser.parse.incremental'
+
+    def prepare(self):
+        super().prepare()
+        self._count = 0
+        self._parser = Parser(1000)
+        self._parser.parse(self._script)
+
+    def setup(self):
+        self._count += 1
+        return '{}\nhue {} set all\n'.format(self._script, self._count % 360)
+
+    def run(self, script):
+        self._parser.parse(script)
+
+
+class _OptimizeBenchmark(Benchmark):
+    name = 'optimizer.optimize'
+    unit = 'instructions'
+
+    def prepare(self):
+        _configure()
+        self._program = _compile(generate_script(50))
+        self.ops = len(self._program)
+
+    def run(self, _):
+        Optimizer('all').optimize(self._program)
+
+
+class _LoadBenchmark(_OptimizeBenchmark):
+    name = 'loader.load'
+
+    def run(self, _):
+        Loader().load(self._program)
+
+
+class _ScriptJobBenchmark(Benchmark):
+    """
+    Compiling a script for a ScriptJob, either from scratch, or from the
+    in-memory cache after the first run.
+    """
+    unit = 'jobs'
+
+    def __init__(self, name, script_cache):
+        self.name = name
+        self._script_cache = script_cache
+
+    def prepare(self):
+        _configure(script_cache=self._script_cache)
+        self._script = generate_script(50)
+        ScriptJob.from_string(self._script)
+
+    def run(self, _):
+        ScriptJob.from_string(self._script)
+
+
+class _MachineBenchmark(Benchmark):
+    """
+    The number of instructions executed is counted once, with a counter
+    wrapped around each handler in the op-code table.
+    """
+    name = 'machine.run'
+    unit = 'instructions'
+    threshold = 0.35
+
+    def prepare(self):
+        _configure(vm_predecode=False)
+        self._program = _compile(_TIGHT_LOOP)
+        machine = Machine()
+        counts = {'total': 0}
+        def counted(fn):
+            def wrapper():
+                counts['total'] += 1
+                fn()
+            return wrapper
+        machine._fn_table = {
+            op_code: counted(fn) for op_code, fn in machine._fn_table.items()}
+        machine.run(self._program)
+        self.ops = counts['total']
+        _configure()
+
+    def run(self, _):
+        Machine().run(self._program)
+
+
+class _MatrixBenchmark(Benchmark):
+    """ overlay, find_replace, and get_colors on a 16 x 16 matrix. """
+    unit = 'operations'
+    ops = 100
+
+    def __init__(self, cls, name):
+        self._cls = cls
+        self.name = name
+
+    def prepare(self):
+        self._mat = self._cls.new_from_constant(16, 16, [0, 0, 0, 2700])
+
+    def run(self, _):
+        mat = self._mat
+        for i in range(0, 25):
+            mat.overlay_color(Rect(i % 8, i % 8 + 7, 2, 12), [i, 1, 2, 3])
+            mat.find_replace([i, 1, 2, 3], [0, 0, 0, 2700])
+            mat.set_from_constant([i, 65535, 65535, 2700])
+            mat.get_colors()
+
+
+class _UnitsBenchmark(Benchmark):
+    name = 'units.convert'
+    unit = 'conversions'
+    ops = 4000
+
+    def prepare(self):
+        self._colors = [[index % 360, 50.0, 75.0, 2700]
+                        for index in range(0, 1000)]
+
+    def run(self, _):
+        convert = units.convert
+        for color in self._colors:
+            raw = convert(color, UnitMode.LOGICAL, UnitMode.RAW)
+            convert(raw, UnitMode.RAW, UnitMode.LOGICAL)
+            rgb = convert(raw, UnitMode.RAW, UnitMode.RGB)
+            convert(rgb, UnitMode.RGB, UnitMode.RAW)
+
+
+class _FakeDiscoverBenchmark(Benchmark):
+    name = 'light_set.discover.fake'
+    unit = 'lights'
+
+    def prepare(self):
+        _configure()
+        self.ops = len(list(
+            injection.provide(i_controller.LightApi).get_lights()))
+
+    def run(self, _):
+        light_set.LightSet().discover()
+
+
+class _SimulatedDiscoverBenchmark(Benchmark):
+    """
+    Discovery through the asyncio driver, against simulated devices. Most
+    of the time is spent waiting for responses to the broadcast, for
+    lan_discovery_time.
+    """
+    name = 'light_set.discover.simulated'
+    unit = 'lights'
+    threshold = 0.5
+
+    def prepare(self):
+        self._simulator = LanSimulator(latency=0.001)
+        self.ops = len(self._simulator.populate(20, 4, 2))
+        self._simulator.start()
+        _configure(
+            use_fakes=False, light_api='async', lan_discovery_time=0.1,
+            lan_broadcast='{}:{}'.format(*self._simulator.get_address()))
+        self._api = async_adapter.SyncLightApi()
+        injection.bind_instance(self._api).to(i_controller.LightApi)
+
+    def run(self, _):
+        light_set.LightSet().discover()
+
+    def finish(self):
+        self._api.close()
+        self._simulator.stop()
+
+
+def all_benchmarks() -> list:
+    benchmarks = [
+        _LexBenchmark(),
+        _LargeLexBenchmark(),
+        _FileLexBenchmark(),
+        _ParseBenchmark(),
+        _IncrementalParseBenchmark(),
+        _OptimizeBenchmark(),
+        _LoadBenchmark(),
+        _ScriptJobBenchmark('script_job.compile', False),
+        _ScriptJobBenchmark('script_job.cached', True),
+        _MachineBenchmark(),
+        _MatrixBenchmark(ColorMatrix, 'color_matrix.list')
+    ]
+    if array_matrix.numpy is not None:
+        benchmarks.append(
+            _MatrixBenchmark(array_matrix.ArrayMatrix, 'color_matrix.array'))
+    benchmarks.extend((
+        _UnitsBenchmark(),
+        _FakeDiscoverBenchmark(),
+        _SimulatedDiscoverBenchmark()
+    ))
+    return benchmarks
+
+
+def measure(benchmark, seconds, min_runs=3) -> dict:
+    """
+    Run the benchmark for about the given number of seconds, and at least
+    min_runs times. Times are in seconds for one run.
+    """
+    benchmark.prepare()
+    try:
+        times = []
+        end = time.perf_counter() + seconds
+        while len(times) < min_runs or time.perf_counter() < end:
+            arg = benchmark.setup()
+            start = time.perf_counter()
+            benchmark.run(arg)
+            times.append(time.perf_counter() - start)
+    finally:
+        benchmark.finish()
+    times.sort()
+    best = times[0]
+    return {
+        'best': best,
+        'median': times[len(times) // 2],
+        'runs': len(times),
+        'ops': benchmark.ops,
+        'unit': benchmark.unit,
+        'rate': benchmark.ops / best if best > 0.0 else None,
+        'threshold': benchmark.threshold
+    }
+
+
+def compare(results, baseline, threshold=None) -> list:
+    """
+    Returns a list of (name, baseline time, current time, ratio) for each
+    benchmark that's slower than in the baseline by more than its threshold.
+    If threshold isn't None, it replaces the threshold of every benchmark.
+    """
+    regressions = []
+    for name, current in results.items():
+        previous = baseline.get(name)
+        if previous is None or not previous['best']:
+            continue
+        limit = threshold if threshold is not None else current['threshold']
+        ratio = current['best'] / previous['best']
+        if ratio > 1.0 + limit:
+            regressions.append(
+                (name, previous['best'], current['best'], ratio))
+    return regressions
+
+
+def _init_args():
+    arg_parser = argparse.ArgumentParser()
+    arg_parser.add_argument(
+        'patterns', nargs='*', default=['*'],
+        help='glob patterns for the names of benchmarks to run')
+    arg_parser.add_argument(
+        '-t', '--time', type=float, default=1.0,
+        help='seconds to run each benchmark')
+    arg_parser.add_argument(
+        '-o', '--output', help='write the results to this JSON file')
+    arg_parser.add_argument(
+        '-b', '--baseline', help='compare with results in this JSON file')
+    arg_parser.add_argument(
+        '--threshold', type=float,
+        help='allowed slowdown, as a fraction, for every benchmark')
+    arg_parser.add_argument(
+        '-l', '--list', action='store_true', help='list the benchmarks')
+    return arg_parser.parse_args()
+
+
+def main():
+    args = _init_args()
+    logging.basicConfig(level=logging.ERROR)
+    benchmarks = [
+        benchmark for benchmark in all_benchmarks()
+        if any(fnmatch.fnmatch(benchmark.name, pattern)
+               for pattern in args.patterns)]
+    if args.list:
+        for benchmark in benchmarks:
+            print(benchmark.name)
+        return 0
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as srce:
+            baseline = json.load(srce)['results']
+
+    results = {}
+    print('{:32} {:>12} {:>12} {:>16}'.format(
+        'benchmark', 'best ms', 'median ms', 'rate'))
+    for benchmark in benchmarks:
+        result = measure(benchmark, args.time)
+        results[benchmark.name] = result
+        print('{:32} {:12.3f} {:12.3f} {:>16}'.format(
+            benchmark.name, result['best'] * 1000.0,
+            result['median'] * 1000.0,
+            '{:.0f} {}/s'.format(result['rate'], result['unit'])))
+
+    if args.output:
+        with open(args.output, 'w') as dest:
+            json.dump({
+                'version': _SCHEMA_VERSION,
+                'python': platform.python_version(),
+                'platform': platform.platform(),
+                'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                'results': results
+            }, dest, indent=2)
+
+    if baseline is None:
+        return 0
+    regressions = compare(results, baseline, args.threshold)
+    for name, previous, current, ratio in regressions:
+        print('Regression in {}: {:.3f} ms -> {:.3f} ms ({:.0%} slower)'
+              .format(name, previous * 1000.0, current * 1000.0, ratio - 1.0))
+    return 1 if len(regressions) > 0 else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,124 @@
+#!/usr/bin/env python
+
+import unittest
+
+from bardolph.controller import array_matrix
+from bardolph.controller.array_matrix import ArrayMatrix
+from bardolph.controller.color_matrix import ColorMatrix, Rect
+from bardolph.controller.units import UnitMode
+from bardolph.lib import injection, settings
+
+a = [1, 2, 3, 4]
+b = [10, 20, 30, 40]
+x = [123.4, 70000, -5, 3500]
+
+
+def _srce():
+    return [a, b, None, a, b, a] * 5
+
+
+@unittest.skipIf(array_matrix.numpy is None, 'NumPy is not installed')
+class ArrayMatrixTest(unittest.TestCase):
+    def _both(self, srce):
+        return (ColorMatrix.new_from_iterable(6, 5, srce),
+                ArrayMatrix.new_from_iterable(6, 5, srce))
+
+    def test_round_trip(self):
+        srce = _srce()
+        mat = ArrayMatrix.new_from_iterable(6, 5, srce)
+        self.assertListEqual(mat.as_list(), srce)
+        self.assertListEqual(mat.matrix[0], srce[0:5])
+
+    def test_overlay(self):
+        expected, actual = self._both(_srce())
+        for mat in (expected, actual):
+            mat.overlay_color(Rect(1, 3, 1, 4), x)
+            mat.overlay_color(Rect(0, None, None, None), None)
+        self.assertListEqual(actual.as_list(), expected.as_list())
+        self.assertListEqual(actual.get_colors(), expected.get_colors())
+
+    def test_overlay_section(self):
+        expected, actual = self._both(_srce())
+        srce = ColorMatrix.new_from_constant(6, 5, x)
+        srce.overlay_color(Rect(2, 2, 2, 2), None)
+        for mat in (expected, actual):
+            mat.overlay_section(Rect(1, 3, 1, 3), srce.matrix)
+        self.assertListEqual(actual.as_list(), expected.as_list())
+
+    def test_all_none(self):
+        mat = ArrayMatrix.new_from_iterable(2, 3, [None] * 6)
+        self.assertListEqual(mat.as_list(), [None] * 6)
+
+    def test_convert_units(self):
+        srce = [
+            [0, 0, 0, 2700], [360, 100, 100, 9000], [359.6, 50.5, 0.4, 3500],
+            [725, 120, -3, -20], None, [65535, 65535, 65535, 65535]
+        ] * 5
+        for srce_mode, dest_mode in (
+                (UnitMode.LOGICAL, UnitMode.RAW),
+                (UnitMode.RAW, UnitMode.LOGICAL),
+                (UnitMode.LOGICAL, UnitMode.RGB)):
+            expected, actual = self._both(srce)
+            expected = expected.convert_units(srce_mode, dest_mode)
+            actual = actual.convert_units(srce_mode, dest_mode)
+            self.assertIsInstance(actual, ArrayMatrix)
+            for actual_color, expected_color in zip(
+                    actual.as_list(), expected.as_list()):
+                if expected_color is None:
+                    self.assertIsNone(actual_color)
+                else:
+                    for value, expected_value in zip(
+                            actual_color, expected_color):
+                        self.assertAlmostEqual(value, expected_value)
+
+    def test_find_replace(self):
+        expected, actual = self._both(_srce())
+        for mat in (expected, actual):
+            mat.find_replace(a, b)
+            mat.find_replace(None, x)
+        self.assertListEqual(actual.get_colors(), expected.get_colors())
+        self.assertTrue(actual.get_valid_mask().all())
+
+    def test_raw_array(self):
+        mat = ArrayMatrix.new_from_constant(2, 3, x)
+        mat.overlay_color(Rect(1, 1, 2, 2), None)
+        raw = mat.get_raw_array()
+        self.assertEqual(raw.shape, (2, 3, 4))
+        self.assertListEqual(raw[0, 0].tolist(), [123, 65535, 0, 3500])
+        self.assertListEqual(raw[1, 2].tolist(), [0, 0, 0, 0])
+        self.assertIsNone(mat.get_colors()[5])
+
+    def test_pack_into(self):
+        expected, actual = self._both(_srce())
+        for mat in (expected, actual):
+            mat.overlay_color(Rect(1, 2, 1, 3), x)
+        expected_buffer = bytearray(4 * 3 * 8 + 2)
+        actual_buffer = bytearray(4 * 3 * 8 + 2)
+        expected.pack_into(expected_buffer, 2, 1, 2, 4, 3)
+        actual.pack_into(actual_buffer, 2, 1, 2, 4, 3)
+        self.assertEqual(actual_buffer, expected_buffer)
+        self.assertFalse(actual.is_complete())
+
+    def test_set_from_matrix(self):
+        srce = ColorMatrix.new_from_iterable(6, 5, _srce())
+        mat = ArrayMatrix(6, 5).set_from_matrix(srce)
+        self.assertListEqual(mat.as_list(), srce.as_list())
+        copy = ArrayMatrix(6, 5).set_from_matrix(mat)
+        mat.set_from_constant(a)
+        self.assertListEqual(copy.as_list(), srce.as_list())
+
+
+class MatrixClassTest(unittest.TestCase):
+    def setUp(self):
+        injection.configure()
+
+    def test_matrix_class(self):
+        settings.using({'use_array_matrix': False}).configure()
+        self.assertIs(array_matrix.matrix_class(), ColorMatrix)
+        settings.using({'use_array_matrix': True}).configure()
+        expected = ColorMatrix if array_matrix.numpy is None else ArrayMatrix
+        self.assertIs(array_matrix.matrix_class(), expected)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,95 @@
+#!/usr/bin/env python
+
+import unittest
+
+from bardolph.vm.array import Array, ArrayError
+from bardolph.vm.instruction import Instruction
+from bardolph.vm.machine import Machine
+from bardolph.vm.vm_codes import OpCode, Register
+from tests import test_module
+
+
+class ArrayTest(unittest.TestCase):
+    def test_one_dimension(self):
+        array = Array(3)
+        self.assertTupleEqual(array.dimensions, (3, ))
+        self.assertIsNone(array.get([2]))
+        array.set([2], 'x')
+        self.assertEqual(array.get([2]), 'x')
+
+    def test_dimensions(self):
+        array = Array(2)
+        array.add_dimension(3)
+        array.add_dimension(4)
+        self.assertTupleEqual(array.dimensions, (2, 3, 4))
+        for i in range(2):
+            for j in range(3):
+                for k in range(4):
+                    array.set([i, j, k], (i, j, k))
+        for i in range(2):
+            for j in range(3):
+                for k in range(4):
+                    self.assertTupleEqual(array.get([i, j, k]), (i, j, k))
+        self.assertEqual(array.offset([1, 2, 3]), 23)
+
+    def test_bounds(self):
+        array = Array(2)
+        array.add_dimension(3)
+        for subscripts in ([2, 0], [0, 3], [-1, 0], [0], [0, 0, 0], [0.5, 0]):
+            with self.assertRaises(ArrayError):
+                array.get(subscripts)
+        with self.assertRaises(ArrayError):
+            Array(0)
+
+    def test_typed(self):
+        array = Array(4, 'd')
+        self.assertEqual(array.get([3]), 0.0)
+        array.set([3], 1.5)
+        self.assertEqual(array.get([3]), 1.5)
+
+    def test_colors(self):
+        array = Array(2, 'd', 4)
+        array.add_dimension(2)
+        array.set([1, 0], [120, 50, 75, 2700])
+        self.assertListEqual(array.get([1, 0]), [120.0, 50.0, 75.0, 2700.0])
+        self.assertListEqual(array.get([1, 1]), [0.0] * 4)
+        with self.assertRaises(ArrayError):
+            array.set([0, 0], [1, 2, 3])
+
+    def _run(self, predecode):
+        test_module.configure(True, {'vm_predecode': predecode})
+        # declare a[2][3], then a[1][2] = 5, then x = a[1][2].
+        program = [
+            Instruction(OpCode.MOVEQ, 2, Register.RESULT),
+            Instruction(OpCode.ARRAY, 'a', Register.RESULT),
+            Instruction(OpCode.MOVEQ, 3, Register.RESULT),
+            Instruction(OpCode.ARRAY, 'a', Register.RESULT),
+            Instruction(OpCode.MOVEQ, 1, Register.RESULT),
+            Instruction(OpCode.DEREF, 'a', Register.RESULT),
+            Instruction(OpCode.MOVEQ, 2, Register.RESULT),
+            Instruction(OpCode.INDEX, 'a', Register.RESULT),
+            Instruction(OpCode.MOVEQ, 5, Register.RESULT),
+            Instruction(OpCode.MOVE, Register.RESULT, 'a'),
+            Instruction(OpCode.MOVEQ, 1, Register.RESULT),
+            Instruction(OpCode.DEREF, 'a', Register.RESULT),
+            Instruction(OpCode.MOVEQ, 2, Register.RESULT),
+            Instruction(OpCode.INDEX, 'a', Register.RESULT),
+            Instruction(OpCode.MOVE, 'a', 'x')
+        ]
+        machine = Machine()
+        machine.run(program)
+        self.assertEqual(machine.get_variable('x'), 5)
+        array = machine.get_variable('a')
+        self.assertTupleEqual(array.dimensions, (2, 3))
+        self.assertEqual(array.get([1, 2]), 5)
+        self.assertIsNone(array.get([0, 2]))
+
+    def test_machine_decoded(self):
+        self._run(True)
+
+    def test_machine_table(self):
+        self._run(False)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,137 @@
+#!/usr/bin/env python
+
+import asyncio
+import unittest
+
+from bardolph.controller import async_adapter, delivery, lan_protocol as lp
+from bardolph.controller.async_lan_api import (AsyncLightApi, LanEndpoint,
+                                               LanTimeout)
+from bardolph.controller.color_matrix import ColorMatrix
+from bardolph.fakes.lan_simulator import (LanSimulator, SimulatedBulb,
+                                          SimulatedMatrix, SimulatedMultizone)
+from bardolph.lib import injection, settings
+
+_BULB = 'd0:73:d5:00:01:01'
+_STRIP = 'd0:73:d5:00:01:02'
+_OLD_STRIP = 'd0:73:d5:00:01:03'
+_TILES = 'd0:73:d5:00:01:04'
+
+
+class AsyncLanTest(unittest.TestCase):
+    def setUp(self):
+        self._simulator = LanSimulator()
+        self._simulator.add_device(SimulatedBulb(
+            _BULB, 'Top', 'Living', 'Home', [1, 2, 3, 4], 65535))
+        self._simulator.add_device(SimulatedMultizone(
+            _STRIP, 'Strip', 'Living', 'Home', 20))
+        self._simulator.add_device(SimulatedMultizone(
+            _OLD_STRIP, 'Old Strip', 'Den', 'Home', 10, False))
+        self._simulator.add_device(SimulatedMatrix(
+            _TILES, 'Tiles', 'Den', 'Home', [(8, 8), (5, 6)]))
+        self._simulator.start()
+        injection.configure()
+        self._configure('acked')
+
+    def tearDown(self):
+        self._simulator.stop()
+
+    def _configure(self, delivery_mode):
+        host, port = self._simulator.get_address()
+        settings.using({
+            'lan_broadcast': '{}:{}'.format(host, port),
+            'lan_discovery_time': 0.2,
+            'delivery_mode': delivery_mode
+        }).configure()
+        delivery.configure()
+
+    def _lights(self):
+        api = async_adapter.SyncLightApi()
+        self.addCleanup(api.close)
+        return {light.get_name(): light for light in api.get_lights()}
+
+    def test_discover(self):
+        lights = self._lights()
+        self.assertSetEqual(
+            set(lights.keys()), {'Top', 'Strip', 'Old Strip', 'Tiles'})
+        self.assertEqual(lights['Top'].get_group(), 'Living')
+        self.assertEqual(lights['Tiles'].get_location(), 'Home')
+        self.assertEqual(lights['Strip'].get_width(), 20)
+        self.assertEqual(lights['Old Strip'].get_width(), 10)
+        self.assertEqual(lights['Tiles'].get_width(), 13)
+        self.assertEqual(lights['Tiles'].get_height(), 8)
+        self.assertTrue(lights['Top'].is_color())
+
+    def test_color_power(self):
+        light = self._lights()['Top']
+        bulb = self._simulator.get_device(_BULB)
+        self.assertListEqual(light.get_color(), [1, 2, 3, 4])
+        self.assertEqual(light.get_power(), 65535)
+        light.set_color([10, 20, 30, 2700], 0)
+        light.set_power(0, 0)
+        self.assertListEqual(bulb.color, [10, 20, 30, 2700])
+        self.assertEqual(bulb.power, 0)
+
+    def test_rapid(self):
+        self._configure('rapid*2')
+        light = self._lights()['Top']
+        light.set_color([5, 6, 7, 8], 0)
+        # The reply to the read comes after both writes have been handled.
+        self.assertListEqual(light.get_color(), [5, 6, 7, 8])
+        bulb = self._simulator.get_device(_BULB)
+        self.assertEqual(bulb.received.count(lp.LIGHT_SET_COLOR), 2)
+
+    def test_zones(self):
+        lights = self._lights()
+        a, b = [1, 1, 1, 1], [2, 2, 2, 2]
+        for name, mac in (('Strip', _STRIP), ('Old Strip', _OLD_STRIP)):
+            light = lights[name]
+            light.set_zone_list(2, [a, a, None, b], 0)
+            zones = light.get_zone_colors()
+            self.assertListEqual(zones[2:6], [a, a, [0, 0, 0, 0], b])
+            light.set_zone_colors(0, 2, b, 0)
+            self.assertListEqual(light.get_zone_colors()[0:3], [b, b, a])
+        strip = self._simulator.get_device(_STRIP)
+        self.assertNotIn(lp.SET_COLOR_ZONES, strip.received)
+        old_strip = self._simulator.get_device(_OLD_STRIP)
+        self.assertNotIn(lp.SET_EXTENDED_COLOR_ZONES, old_strip.received)
+
+    def test_matrix(self):
+        light = self._lights()['Tiles']
+        colors = [[index, 0, 0, 0] for index in range(0, 8 * 13)]
+        light.set_matrix(ColorMatrix.new_from_iterable(8, 13, colors), 0)
+        tiles = self._simulator.get_device(_TILES)
+        self.assertListEqual(
+            tiles.pixels[0][0:2], [[0, 0, 0, 0], [1, 0, 0, 0]])
+        self.assertListEqual(tiles.pixels[1][5], [21, 0, 0, 0])
+        result = light.get_matrix().get_colors()
+        for row in range(0, 6):
+            self.assertListEqual(
+                result[row * 13:(row + 1) * 13],
+                colors[row * 13:(row + 1) * 13])
+
+    def test_concurrent(self):
+        # Many requests at once, each matched with its own response.
+        async def run():
+            endpoint = LanEndpoint()
+            await endpoint.open(('127.0.0.1', 0))
+            api = AsyncLightApi(endpoint, self._simulator.get_address())
+            try:
+                lights = [light async for light in api.get_lights(0.2)]
+                results = await asyncio.gather(*(
+                    light.get_state() for light in lights * 20))
+                with self.assertRaises(LanTimeout):
+                    await endpoint.request(
+                        self._simulator.get_address(), 'd0:73:d5:99:99:99',
+                        lp.LIGHT_GET, b'', (lp.LIGHT_STATE,), timeout=0.05)
+            finally:
+                endpoint.close()
+            return lights, results
+
+        lights, results = asyncio.run(run())
+        self.assertEqual(len(results), 80)
+        for light, result in zip(lights * 20, results):
+            self.assertEqual(result['label'], light.get_name())
+
+
+if __name__ == '__main__':
+    unittest.main()
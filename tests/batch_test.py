@@ -0,0 +1,65 @@
+#!/usr/bin/env python
+
+import threading
+import time
+import unittest
+
+from bardolph.controller.batch import Batch
+
+
+class _Light:
+    def __init__(self, name, delay=0.0, fail=False):
+        self._name = name
+        self._delay = delay
+        self._fail = fail
+        self.power = None
+
+    def get_name(self):
+        return self._name
+
+    def set_power(self, power):
+        time.sleep(self._delay)
+        if self._fail:
+            raise RuntimeError('no response')
+        self.power = power
+
+
+class BatchTest(unittest.TestCase):
+    def test_concurrent(self):
+        lights = [_Light('light_{}'.format(i), 0.1) for i in range(0, 8)]
+        batch = Batch(8, 2.0)
+        start_time = time.monotonic()
+        failures = batch.run(lights, lambda light: light.set_power(1))
+        self.assertLess(time.monotonic() - start_time, 0.5)
+        self.assertListEqual(failures, [])
+        for light in lights:
+            self.assertEqual(light.power, 1)
+
+    def test_failures(self):
+        lights = [
+            _Light('ok'), _Light('broken', fail=True), _Light('slow', 1.0)
+        ]
+        batch = Batch(4, 0.2)
+        failures = batch.run(lights, lambda light: light.set_power(1))
+        self.assertEqual(len(failures), 2)
+        reasons = dict(failures)
+        self.assertIsInstance(reasons['broken'], RuntimeError)
+        self.assertEqual(reasons['slow'], 'timed out')
+        self.assertEqual(lights[0].power, 1)
+
+    def test_single(self):
+        # A lone light is handled on the calling thread.
+        light = _Light('only')
+        caller = threading.current_thread()
+        threads = []
+
+        def operation(target):
+            threads.append(threading.current_thread())
+            target.set_power(5)
+        self.assertListEqual(Batch(4, 1.0).run([light], operation), [])
+        self.assertIs(threads[0], caller)
+        self.assertEqual(light.power, 5)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -2,6 +2,7 @@
 
 import unittest
 from bardolph.vm.call_stack import CallStack
+from bardolph.vm.vm_codes import LoopVar
 
 class CallStackTest(unittest.TestCase):
     def test_routine(self):
@@ -24,6 +25,39 @@ class CallStackTest(unittest.TestCase):
         self.assertEqual(stack.get_variable('x'), 100)
         self.assertEqual(stack.get_variable('y'), 200)
 
+    def test_getter_setter(self):
+        stack = CallStack()
+        get_x = stack.variable_getter('x')
+        set_x = stack.variable_setter('x')
+        set_x(100)
+        self.assertEqual(get_x(), 100)
+
+        # In a routine, x is the parameter, until the routine returns.
+        stack.new_frame()
+        stack.put_param('x', 500)
+        stack.enter_routine()
+        self.assertEqual(get_x(), 500)
+        set_x(600)
+        self.assertEqual(stack.get_variable('x'), 600)
+        stack.exit_routine()
+        self.assertEqual(get_x(), 100)
+
+        # A global is assigned from within a routine, rather than hidden.
+        stack.new_frame()
+        stack.enter_routine()
+        set_x(700)
+        stack.exit_routine()
+        self.assertEqual(get_x(), 700)
+
+    def test_loop_var(self):
+        stack = CallStack()
+        stack.enter_loop()
+        set_counter = stack.variable_setter(LoopVar.COUNTER)
+        set_counter(3)
+        self.assertEqual(stack.variable_getter(LoopVar.COUNTER)(), 3)
+        self.assertIsNone(stack.get_variable('counter'))
+        stack.exit_loop()
+
 
 if __name__ == '__main__':
     unittest.main()
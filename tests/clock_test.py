@@ -1,68 +1,84 @@
 #!/usr/bin/env python
 
+import threading
+import time
 import unittest
+from datetime import datetime
 from unittest.mock import patch
 
 from bardolph.lib import clock, injection, settings, time_pattern
 
-class MockNow:
-    def __init__(self, hour, minute):
-        self._hour = hour
-        self._minute = minute
-
-    @property
-    def hour(self):
-        self._minute += 1
-        if self._minute == 60:
-            self._minute = 0
-            self._hour += 1
-            if self._hour == 24:
-                self._hour = 0
-        return self._hour
-
-    @property
-    def minute(self):
-        return self._minute
-
-    def time_equals(self, hour, minute):
-        return hour == self._hour and minute == self._minute
-
 
 class ClockTest(unittest.TestCase):
     def setUp(self):
         injection.configure()
+        settings.using({}).configure()
         self._precision = 0.1
-        settings.using({'sleep_time': self._precision}).configure()
 
     def test_clock(self):
         clk = clock.Clock()
         clk.start()
-        time_0 = clk.et()
-        for _ in range(1, 10):
-            clk.wait()
-            time_1 = clk.et()
-            delta = time_1 - time_0
-            self.assertAlmostEqual(delta, self._precision, 1)
-            time_0 = time_1
+        for i in range(1, 5):
+            clk.pause_for(self._precision)
+            self.assertAlmostEqual(
+                clk.et(), i * self._precision, delta=0.02)
         clk.stop()
 
+    def test_shared_queue(self):
+        # Clocks in separate threads wake up independently.
+        delays = (0.15, 0.05, 0.1)
+        results = {}
+
+        def pause(delay):
+            clk = clock.Clock()
+            clk.start()
+            clk.pause_for(delay)
+            results[delay] = clk.et()
+
+        threads = [threading.Thread(target=pause, args=(delay,))
+                   for delay in delays]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        for delay in delays:
+            self.assertAlmostEqual(results[delay], delay, delta=0.02)
+
+    def test_stop(self):
+        clk = clock.Clock()
+        clk.start()
+        threading.Timer(0.05, clk.stop).start()
+        start_time = time.monotonic()
+        clk.pause_for(10.0)
+        self.assertLess(time.monotonic() - start_time, 1.0)
+
+    def test_seconds_to_match(self):
+        current = datetime(2024, 1, 1, 9, 55, 30)
+        for pattern, expected in (
+                ('10:*', 4 * 60 + 30),
+                ('10:1*', 14 * 60 + 30),
+                ('10:*5', 9 * 60 + 30),
+                ('9:56', 30),
+                ('9:55', 24 * 60 * 60 - 30)):
+            self.assertEqual(
+                clock.Clock.seconds_to_match(
+                    current, time_pattern.TimePattern.from_string(pattern)),
+                expected, pattern)
+
     @patch('bardolph.lib.clock.datetime')
     def test_time_pattern(self, patch_datetime):
-        mock_now = MockNow(9, 55)
-        patch_datetime.now = lambda: mock_now
+        patch_datetime.now = lambda: datetime(2024, 1, 1, 10, 15, 59, 999000)
 
         clk = clock.Clock()
         clk.start()
-
-        clk.wait_until(time_pattern.TimePattern.from_string('10:*'))
-        self.assertTrue(mock_now.time_equals(10, 0))
-
-        clk.wait_until(time_pattern.TimePattern.from_string('10:1*'))
-        self.assertTrue(mock_now.time_equals(10, 10))
-
+        start_time = time.monotonic()
         clk.wait_until(time_pattern.TimePattern.from_string('10:*5'))
-        self.assertTrue(mock_now.time_equals(10, 15))
+        self.assertLess(time.monotonic() - start_time, 0.1)
 
+        patch_datetime.now = lambda: datetime(2024, 1, 1, 10, 16)
+        threading.Timer(0.05, clk.stop).start()
+        clk.wait_until(time_pattern.TimePattern.from_string('10:*5'))
+        self.assertLess(time.monotonic() - start_time, 1.0)
         clk.stop()
 
 
@@ -1,6 +1,7 @@
 #!/usr/bin/env python
 
 import copy
+import struct
 import unittest
 
 from bardolph.controller.color_matrix import ColorMatrix, Rect
@@ -92,6 +93,18 @@ class ColorMatrixTest(unittest.TestCase):
         actual = mat.as_list()
         self.assertListEqual(expected, actual)
 
+    def test_pack_into(self):
+        mat = ColorMatrix.new_from_iterable(6, 5, iterable_srce())
+        mat.overlay_color(Rect(1, 1, 0, 0), [-1, 70000, 1.6, 0])
+        mat.overlay_color(Rect(2, 2, 0, 0), None)
+        buffer = bytearray(3 * 2 * 8)
+        mat.pack_into(buffer, 0, 0, 0, 3, 2)
+        self.assertListEqual(
+            [list(cell) for cell in struct.iter_unpack('<4H', buffer)],
+            [a, b, [0, 65535, 2, 0], c, [0, 0, 0, 0], d])
+        self.assertFalse(mat.is_complete())
+        self.assertTrue(ColorMatrix.new_from_constant(2, 2, a).is_complete())
+
     def test_normalize_rect(self):
         matrix = ColorMatrix(6, 5)
 
@@ -0,0 +1,59 @@
+#!/usr/bin/env python
+
+import unittest
+
+from bardolph.controller import delivery
+from bardolph.controller.delivery import (Delivery, DeliveryStats,
+                                          default_delivery)
+from bardolph.lib import injection, settings
+
+
+class DeliveryTest(unittest.TestCase):
+    def setUp(self):
+        injection.configure()
+
+    def test_from_string(self):
+        self.assertEqual(Delivery.from_string('acked'), Delivery(True))
+        self.assertEqual(Delivery.from_string('rapid'), Delivery(False, 1))
+        self.assertEqual(Delivery.from_string('Rapid * 3'), Delivery(False, 3))
+        for text in ('acked', 'rapid', 'rapid*4'):
+            self.assertEqual(str(Delivery.from_string(text)), text)
+        self.assertRaises(ValueError, Delivery.from_string, 'acked*2x')
+        self.assertRaises(ValueError, Delivery.from_string, 'slow')
+
+    def test_default(self):
+        settings.using({
+            'delivery_mode': 'rapid*2',
+            'light_delivery_modes': {'Top': 'acked'}
+        }).configure()
+        delivery.configure()
+        self.assertEqual(default_delivery('Top'), Delivery(True))
+        self.assertEqual(default_delivery('Bottom'), Delivery(False, 2))
+
+    def test_invalid(self):
+        # An invalid mode is caught when the settings are read, at startup.
+        settings.using({'delivery_mode': 'slow'}).configure()
+        self.assertRaises(ValueError, delivery.configure)
+        settings.using({'light_delivery_modes': {'Top': 'often'}}).configure()
+        self.assertRaises(ValueError, delivery.configure)
+
+    def test_stats(self):
+        stats = DeliveryStats()
+        acked = Delivery(True)
+        rapid = Delivery(False, 2)
+        stats.record(acked, 0.02)
+        stats.record(acked, 0.04, True)
+        stats.record(rapid, 0.001)
+        result = stats.get_stats()
+        self.assertEqual(result['acked']['writes'], 2)
+        self.assertEqual(result['acked']['losses'], 1)
+        self.assertAlmostEqual(result['acked']['mean_latency'], 0.03)
+        self.assertAlmostEqual(result['acked']['max_latency'], 0.04)
+        self.assertEqual(result['rapid*2']['writes'], 1)
+        self.assertEqual(result['rapid*2']['losses'], 0)
+        stats.reset()
+        self.assertDictEqual(stats.get_stats(), {})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -5,6 +5,10 @@ import unittest
 
 module_names = (
     'activity_log_test',
+    'array_matrix_test',
+    'array_test',
+    'async_lan_test',
+    'batch_test',
     'block_candle_test',
     'cache_test',
     'call_stack_test',
@@ -14,15 +18,20 @@ module_names = (
     'color_matrix_test',
     'context_test',
     'define_test',
+    'delivery_test',
     'end_to_end_test',
     'example_test',
     'expr_test',
     'fake_light_builder_test',
     'function_test',
     'injection_test',
+    'inventory_test',
     'io_parser_test',
     'job_control_test',
+    'lan_protocol_test',
+    'lan_simulator_test',
     'lex_test',
+    'lifx_lan_light_test',
     'light_set_test',
     'log_config_test',
     'loop_test',
@@ -30,27 +39,39 @@ module_names = (
     'math_runtime_test',
     'noneable_test',
     'optimizer_test',
+    'output_queue_test',
     'param_helper_test',
     'parser_test',
     'print_test',
+    'process_pool_test',
+    'program_cache_test',
     'query_test',
     'retry_test',
     'settings_test',
+    'shadow_state_test',
     'sorted_list_test',
     'time_pattern_test',
     'units_test',
     'vm_discover_test',
     'vm_math_test',
-    'web_app_test'
+    'vm_profile_test',
+    'web_app_test',
+    'worker_pool_test'
 )
 
-modules = (importlib.import_module('tests.' + module_name)
-            for module_name in module_names)
 
-loader = unittest.TestLoader()
-suite = unittest.TestSuite()
+def main():
+    modules = (importlib.import_module('tests.' + module_name)
+               for module_name in module_names)
 
-for module in modules:
-    suite.addTests(loader.loadTestsFromModule(module))
+    loader = unittest.TestLoader()
+    suite = unittest.TestSuite()
 
-unittest.TextTestRunner(verbosity=2).run(suite)
+    for module in modules:
+        suite.addTests(loader.loadTestsFromModule(module))
+
+    unittest.TextTestRunner(verbosity=2).run(suite)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,80 @@
+#!/usr/bin/env python
+
+import os
+import tempfile
+import threading
+import time
+import unittest
+
+from bardolph.controller.inventory import Inventory
+
+
+class InventoryTest(unittest.TestCase):
+    def setUp(self):
+        self._dir = tempfile.TemporaryDirectory()
+        self._file_name = os.path.join(self._dir.name, 'sub', 'inv.json')
+
+    def tearDown(self):
+        self._dir.cleanup()
+
+    @staticmethod
+    def _record(mac, label):
+        return {
+            'mac': mac, 'ip': '10.0.0.1', 'service': 1, 'port': 56700,
+            'label': label, 'group': 'g', 'location': 'l',
+            'features': {'color': True}
+        }
+
+    def test_round_trip(self):
+        inventory = Inventory(self._file_name, 60)
+        self.assertListEqual(inventory.load(), [])
+        inventory.put(self._record('d0:73:d5:00:00:01', 'Top'))
+        inventory.put(self._record('d0:73:d5:00:00:02', 'Bottom'))
+        inventory.put(self._record('d0:73:d5:00:00:01', 'Middle'))
+        inventory.save()
+
+        records = Inventory(self._file_name, 60).load()
+        self.assertEqual(len(records), 2)
+        labels = sorted(record['label'] for record in records)
+        self.assertListEqual(labels, ['Bottom', 'Middle'])
+
+    def test_expired(self):
+        inventory = Inventory(self._file_name, 60)
+        inventory.put(self._record('d0:73:d5:00:00:01', 'Top'))
+        inventory.put(self._record('d0:73:d5:00:00:02', 'Bottom'))
+        inventory._records['d0:73:d5:00:00:02']['time'] = time.time() - 120
+        inventory.save()
+
+        records = Inventory(self._file_name, 60).load()
+        self.assertEqual(len(records), 1)
+        self.assertEqual(records[0]['label'], 'Top')
+
+    def test_concurrent_saves(self):
+        # Each save has its own temporary file, so the result is always one
+        # whole file, and nothing is left behind.
+        inventories = [Inventory(self._file_name, 60) for _ in range(0, 4)]
+        for i, inventory in enumerate(inventories):
+            inventory.put(self._record('d0:73:d5:00:00:01', str(i) * 1000))
+        threads = [
+            threading.Thread(target=inventory.save)
+            for inventory in inventories for _ in range(0, 10)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        records = Inventory(self._file_name, 60).load()
+        self.assertEqual(len(records), 1)
+        self.assertListEqual(
+            os.listdir(os.path.dirname(self._file_name)),
+            [os.path.basename(self._file_name)])
+
+    def test_bad_file(self):
+        os.makedirs(os.path.dirname(self._file_name))
+        with open(self._file_name, 'w') as dest:
+            dest.write('{ not json')
+        self.assertListEqual(Inventory(self._file_name, 60).load(), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,144 @@
+#!/usr/bin/env python
+
+import unittest
+
+from lifxlan.msgtypes import (LightSetColor, LightSetPower, LightState,
+                              MultiZoneGetColorZones, MultiZoneSetColorZones,
+                              MultiZoneSetExtendedColorZones,
+                              MultiZoneStateMultiZone, SetTileState64,
+                              StateDeviceChain, StateHostFirmware,
+                              StateTileState64)
+
+from bardolph.controller import lan_protocol as lp
+
+_MAC = 'd0:73:d5:01:02:03'
+_SOURCE = 12345
+
+
+class LanProtocolTest(unittest.TestCase):
+    def _assert_same(self, msg_type, lifxlan_msg, **fields):
+        # Byte for byte the same as the message lifxlan builds.
+        expected = lifxlan_msg.packed_message
+        actual = lp.pack_message(
+            msg_type, lp.encode(msg_type, **fields), _MAC, _SOURCE, 7,
+            lifxlan_msg.ack_requested, lifxlan_msg.response_requested)
+        self.assertEqual(actual, expected)
+
+    def test_set_color(self):
+        color = [1000, 65535, 32768, 2700]
+        self._assert_same(
+            lp.LIGHT_SET_COLOR,
+            LightSetColor(_MAC, _SOURCE, 7, {
+                'color': color, 'duration': 1500}, True, False),
+            color=color, duration=1500)
+
+    def test_set_power(self):
+        self._assert_same(
+            lp.LIGHT_SET_POWER,
+            LightSetPower(_MAC, _SOURCE, 7, {
+                'power_level': 65535, 'duration': 20}, False, True),
+            level=65535, duration=20)
+
+    def test_zones(self):
+        color = [5, 6, 7, 8]
+        self._assert_same(
+            lp.SET_COLOR_ZONES,
+            MultiZoneSetColorZones(_MAC, _SOURCE, 7, {
+                'start_index': 2, 'end_index': 5, 'color': color,
+                'duration': 0, 'apply': 1}, True, False),
+            start_index=2, end_index=5, color=color, duration=0, apply=1)
+        self._assert_same(
+            lp.GET_COLOR_ZONES,
+            MultiZoneGetColorZones(_MAC, _SOURCE, 7, {
+                'start_index': 0, 'end_index': 255}, False, True),
+            start_index=0, end_index=255)
+        # lifxlan doesn't pad the colors, so all 82 are used here.
+        colors = [[index, 0, 0, 0] for index in range(0, 82)]
+        self._assert_same(
+            lp.SET_EXTENDED_COLOR_ZONES,
+            MultiZoneSetExtendedColorZones(_MAC, _SOURCE, 7, {
+                'duration': 10, 'apply': 1, 'index': 3, 'count': 82,
+                'colors': colors}, True, False),
+            duration=10, apply=1, index=3, colors=colors)
+
+    def test_set_64(self):
+        colors = [[index, 1, 2, 3] for index in range(0, 64)]
+        msg = SetTileState64(_MAC, _SOURCE, 7, {
+            'tile_index': 1, 'length': 2, 'reserved': 0, 'x': 0, 'y': 0,
+            'width': 8, 'duration': 0, 'colors': colors})
+        actual = lp.pack_message(lp.SET_64, lp.encode(
+            lp.SET_64, tile_index=1, length=2, y=0, width=8, duration=0,
+            colors=colors), _MAC, _SOURCE, 7)
+        # lifxlan always sends this message tagged.
+        self.assertEqual(actual[36:], msg.packed_message[36:])
+        self.assertEqual(lp.decode(lp.SET_64, actual[36:])['colors'], colors)
+
+    def test_decode(self):
+        color = [1, 2, 3, 4]
+        state = LightState(_MAC, _SOURCE, 7, {
+            'color': color, 'reserved1': 0, 'power_level': 65535,
+            'label': 'Top', 'reserved2': 0})
+        header, payload = lp.unpack_message(state.packed_message)
+        self.assertEqual(header.msg_type, lp.LIGHT_STATE)
+        self.assertEqual(header.target, _MAC)
+        self.assertEqual(header.source, _SOURCE)
+        self.assertEqual(header.sequence, 7)
+        self.assertDictEqual(lp.decode(lp.LIGHT_STATE, payload), {
+            'color': color, 'power': 65535, 'label': 'Top'})
+
+        colors = [[index, 0, 0, 0] for index in range(0, 8)]
+        zones = MultiZoneStateMultiZone(_MAC, _SOURCE, 7, {
+            'count': 16, 'index': 8, 'color': colors})
+        fields = lp.decode(
+            lp.STATE_MULTI_ZONE, lp.unpack_message(zones.packed_message)[1])
+        self.assertDictEqual(
+            fields, {'count': 16, 'index': 8, 'colors': colors})
+
+    def test_host_firmware(self):
+        self._assert_same(
+            lp.STATE_HOST_FIRMWARE,
+            StateHostFirmware(_MAC, _SOURCE, 7, {
+                'build': 5, 'reserved1': 0, 'version': (3 << 16) | 70}),
+            build=5, reserved=0, version=(3 << 16) | 70)
+
+    def test_state_64(self):
+        colors = [[index, 0, 0, 3500] for index in range(0, 64)]
+        payload = lp.encode(
+            lp.STATE_64, tile_index=2, y=0, width=8, colors=colors)
+        msg = StateTileState64(_MAC, _SOURCE, 7, {
+            'tile_index': 2, 'reserved': 0, 'x': 0, 'y': 0, 'width': 8,
+            'colors': colors})
+        self.assertEqual(payload, msg.packed_message[36:])
+
+    def test_device_chain(self):
+        tiles = [(8, 8), (8, 8), (5, 6)]
+        payload = lp.encode(lp.STATE_DEVICE_CHAIN, start_index=0, tiles=tiles)
+        self.assertDictEqual(lp.decode(lp.STATE_DEVICE_CHAIN, payload), {
+            'start_index': 0, 'tiles': tiles})
+        tile_devices = []
+        for index in range(0, lp.MAX_CHAIN_TILES):
+            width, height = tiles[index] if index < len(tiles) else (0, 0)
+            tile_devices.append({
+                'reserved1': 0, 'reserved2': 0, 'reserved3': 0,
+                'reserved4': 0, 'user_x': 0.0, 'user_y': 0.0,
+                'width': width, 'height': height, 'reserved5': 0,
+                'device_version_vendor': 0, 'device_version_product': 0,
+                'device_version_version': 0, 'firmware_build': 0,
+                'reserved6': 0, 'firmware_version': 0, 'reserved7': 0
+            })
+        msg = StateDeviceChain(_MAC, _SOURCE, 7, {
+            'start_index': 0, 'total_count': 3,
+            'tile_devices': tile_devices})
+        self.assertEqual(payload, msg.packed_message[36:])
+
+    def test_errors(self):
+        self.assertRaises(lp.ProtocolError, lp.unpack_message, b'short')
+        message = lp.pack_message(lp.GET_SERVICE)
+        self.assertRaises(lp.ProtocolError, lp.unpack_message, message + b'x')
+        self.assertTrue(lp.unpack_message(message)[0].tagged)
+        self.assertRaises(lp.ProtocolError, lp.decode, lp.LIGHT_STATE, b'')
+        self.assertRaises(lp.ProtocolError, lp.encode, 9999)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,151 @@
+#!/usr/bin/env python
+
+import socket
+import time
+import unittest
+
+import lifxlan
+
+from bardolph.controller import delivery, lifx_lan_light
+from bardolph.controller import lan_protocol as lp
+from bardolph.controller.color_matrix import ColorMatrix, Rect
+from bardolph.fakes.lan_simulator import (LanSimulator, SimulatedBulb,
+                                          SimulatedMatrix, SimulatedMultizone)
+from bardolph.lib import injection, settings
+
+_MAC = 'd0:73:d5:00:02:01'
+
+
+class LanSimulatorTest(unittest.TestCase):
+    def _start(self, **kwargs):
+        simulator = LanSimulator(**kwargs)
+        simulator.add_device(SimulatedBulb(
+            _MAC, 'Top', 'Group', 'Home', [1, 2, 3, 4], 65535))
+        simulator.start()
+        self.addCleanup(simulator.stop)
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sock.bind(('127.0.0.1', 0))
+        sock.settimeout(0.3)
+        self.addCleanup(sock.close)
+        return simulator, sock
+
+    @staticmethod
+    def _send(simulator, sock, sequence, msg_type=lp.LIGHT_GET_POWER):
+        sock.sendto(lp.pack_message(
+            msg_type, b'', _MAC, 99, sequence, res_required=True),
+            simulator.get_address())
+
+    @staticmethod
+    def _responses(sock) -> list:
+        # The headers of everything that arrives before the socket times out.
+        headers = []
+        try:
+            while True:
+                headers.append(lp.unpack_message(sock.recv(2048))[0])
+        except socket.timeout:
+            return headers
+
+    def test_populate(self):
+        simulator = LanSimulator()
+        self.addCleanup(simulator.stop)
+        devices = simulator.populate(3, 2, 1)
+        self.assertEqual(len(devices), 6)
+        self.assertEqual(len({device.mac_addr for device in devices}), 6)
+        self.assertListEqual(
+            [device.label for device in devices],
+            ['Bulb 1', 'Bulb 2', 'Bulb 3', 'Strip 1', 'Strip 2', 'Tile 1'])
+        self.assertListEqual(devices[-1].tiles, [(8, 8)] * 5)
+
+    def test_latency(self):
+        simulator, sock = self._start(latency=0.1)
+        start = time.monotonic()
+        self._send(simulator, sock, 1)
+        header = self._responses(sock)[0]
+        self.assertGreaterEqual(time.monotonic() - start, 0.1)
+        self.assertEqual(header.msg_type, lp.LIGHT_STATE_POWER)
+        self.assertEqual(header.sequence, 1)
+
+    def test_loss(self):
+        simulator, sock = self._start(loss=1.0)
+        for sequence in range(0, 5):
+            self._send(simulator, sock, sequence)
+        self.assertListEqual(self._responses(sock), [])
+        stats = simulator.get_stats()
+        self.assertEqual(stats['received'], 5)
+        self.assertEqual(stats['lost'], 5)
+        self.assertEqual(stats['sent'], 0)
+
+    def test_rate_limit(self):
+        simulator, sock = self._start(rate_limit=4)
+        for sequence in range(0, 10):
+            self._send(simulator, sock, sequence)
+        headers = self._responses(sock)
+        self.assertListEqual(
+            [header.sequence for header in headers], [0, 1, 2, 3])
+        self.assertEqual(simulator.get_stats()['rate_limited'], 6)
+
+    def test_lifxlan(self):
+        # The simulator also answers lifxlan.
+        simulator, _ = self._start()
+        port = simulator.get_address()[1]
+        impl = lifxlan.Light(_MAC, '127.0.0.1', 1, port, 1234)
+        self.assertEqual(impl.get_label(), 'Top')
+        self.assertTupleEqual(tuple(impl.get_color()), (1, 2, 3, 4))
+        impl.set_power(0, 0, False)
+        self.assertEqual(impl.get_power(), 0)
+        self.assertEqual(simulator.get_device(_MAC).power, 0)
+
+
+    def _lifxlan_impl(self, simulator, cls, mac):
+        injection.configure()
+        settings.using({
+            'shadow_max_age': 0, 'delivery_mode': 'acked'
+        }).configure()
+        delivery.configure()
+        port = simulator.get_address()[1]
+        return cls(mac, '127.0.0.1', 1, port, 1234)
+
+    def test_lifxlan_multizone(self):
+        # Each range of zones that lifxlan asks for comes back by itself, and
+        # the firmware version decides whether extended messages are used.
+        simulator, _ = self._start()
+        for mac, extended in (('d0:73:d5:00:02:02', True),
+                              ('d0:73:d5:00:02:03', False)):
+            strip = simulator.add_device(SimulatedMultizone(
+                mac, 'Strip', num_zones=16, extended=extended))
+            strip.zones = [[zone, 2, 3, 4] for zone in range(0, 16)]
+            start = time.monotonic()
+            light = lifx_lan_light.MultizoneLight(
+                self._lifxlan_impl(simulator, lifxlan.MultiZoneLight, mac))
+            self.assertLess(time.monotonic() - start, 0.5)
+            self.assertIn(lp.GET_HOST_FIRMWARE, strip.received)
+            self.assertEqual(light.get_width(), 16)
+            self.assertListEqual(
+                [list(color) for color in light.get_zone_colors()],
+                strip.zones)
+            light.set_zone_colors(8, 12, [9, 9, 9, 9], 0)
+            self.assertListEqual(strip.zones[7:13], [
+                [7, 2, 3, 4], [9, 9, 9, 9], [9, 9, 9, 9], [9, 9, 9, 9],
+                [9, 9, 9, 9], [12, 2, 3, 4]])
+            self.assertEqual(
+                lp.SET_EXTENDED_COLOR_ZONES in strip.received, extended)
+
+    def test_lifxlan_matrix(self):
+        simulator, _ = self._start()
+        mac = 'd0:73:d5:00:02:04'
+        chain = simulator.add_device(
+            SimulatedMatrix(mac, 'Tiles', tiles=[(8, 8)] * 2))
+        light = lifx_lan_light.MatrixLight(
+            self._lifxlan_impl(simulator, lifxlan.Light, mac))
+        self.assertEqual(light.get_height(), 8)
+        self.assertEqual(light.get_width(), 16)
+        mat = ColorMatrix.new_from_constant(8, 16, [1, 2, 3, 4])
+        mat.overlay_color(Rect(0, 7, 8, 15), [5, 6, 7, 8])
+        light.set_matrix(mat)
+        self.assertListEqual(chain.pixels[0], [[1, 2, 3, 4]] * 64)
+        self.assertListEqual(chain.pixels[1], [[5, 6, 7, 8]] * 64)
+        self.assertListEqual(light.get_matrix().get_colors(), mat.get_colors())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,5 +1,6 @@
 #!/usr/bin/env python
 
+import io
 import re
 import unittest
 
@@ -148,6 +149,28 @@ class LexTest(unittest.TestCase):
         ]
         self._lex_and_compare_pairs(input_string, expected)
 
+    def test_keyword_case(self):
+        input_string = 'ALL Set Hue hue h DEFAULT'
+        expected = [
+            TokenTypes.ALL, 'ALL',
+            TokenTypes.SET, 'Set',
+            TokenTypes.NAME, 'Hue',
+            TokenTypes.REGISTER, 'hue',
+            TokenTypes.NAME, 'h',
+            TokenTypes.DEFAULT, 'DEFAULT']
+        self._lex_and_compare_pairs(input_string, expected)
+
+    def test_file(self):
+        srce = io.StringIO('hue 5 # comment\n\nset "a # b"\n')
+        actual = [(token.token_type, token.content, token.line_number)
+                  for token in Lex(srce).tokens()]
+        self.assertListEqual(actual, [
+            (TokenTypes.REGISTER, 'hue', 1),
+            (TokenTypes.NUMBER, '5', 1),
+            (TokenTypes.SET, 'set', 3),
+            (TokenTypes.LITERAL_STRING, 'a # b', 3),
+            (TokenTypes.EOF, '', 0)])
+
     def _lex_and_compare_pairs(self, input_string, expected):
         it = iter(expected)
         expected_tokens = [Token(token_type, next(it)) for token_type in it]
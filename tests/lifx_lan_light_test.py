@@ -0,0 +1,259 @@
+#!/usr/bin/env python
+
+import struct
+import unittest
+from unittest.mock import MagicMock, call, patch
+
+from lifxlan.msgtypes import SetTileState64
+
+from bardolph.controller import (delivery, lifx_lan_light, output_queue,
+                                 shadow_state, tile_packet)
+from bardolph.controller.color_matrix import ColorMatrix
+from bardolph.controller.shadow_state import MATRIX, ZONES
+from bardolph.lib import injection, settings
+
+
+class LifxLanLightTest(unittest.TestCase):
+    def setUp(self):
+        injection.configure()
+        settings.using({
+            'shadow_max_age': 10, 'delivery_mode': 'rapid'
+        }).configure()
+        delivery.configure()
+
+    @staticmethod
+    def _strip(mac, extended):
+        # Forget anything left from an earlier run of the same test.
+        shadow_state.for_device(hash(mac)).invalidate(ZONES)
+        impl = MagicMock()
+        impl.get_mac_addr.return_value = mac
+        impl.get_color_zones.return_value = [(0, 0, 0, 0)] * 8
+        info = {
+            'label': 'Strip', 'group': 'g', 'location': 'l',
+            'features': {'color': True, 'multizone': True},
+            'num_zones': 8, 'extended_multizone': extended
+        }
+        return impl, lifx_lan_light.MultizoneLight(impl, info=info)
+
+    def test_ranges(self):
+        impl, light = self._strip('d0:73:d5:00:00:b1', False)
+        light.set_zone_list(
+            0, [[1, 1, 1, 1], [1, 1, 1, 1], [0, 0, 0, 0], [2, 2, 2, 2]], 5)
+        self.assertListEqual(impl.set_zone_color.call_args_list, [
+            call(0, 1, [1, 1, 1, 1], 5, True, 0),
+            call(3, 3, [2, 2, 2, 2], 5, True, 1)
+        ])
+        # The rapid write wasn't acknowledged, so it's sent again.
+        impl.set_zone_color.reset_mock()
+        light.set_zone_colors(0, 2, [1, 1, 1, 1], 5)
+        impl.set_zone_color.assert_called_once_with(
+            0, 1, [1, 1, 1, 1], 5, True, 1)
+        self.assertEqual(impl.get_color_zones.call_count, 1)
+
+    def test_ranges_acked(self):
+        settings.using({
+            'shadow_max_age': 10, 'delivery_mode': 'acked'
+        }).configure()
+        delivery.configure()
+        impl, light = self._strip('d0:73:d5:00:00:b8', False)
+        light.set_zone_list(0, [[1, 1, 1, 1], [1, 1, 1, 1]], 5)
+        impl.set_zone_color.assert_called_once_with(
+            0, 1, [1, 1, 1, 1], 5, False, 1)
+        impl.set_zone_color.reset_mock()
+        light.set_zone_colors(0, 2, [1, 1, 1, 1], 5)
+        impl.set_zone_color.assert_not_called()
+        self.assertEqual(impl.get_color_zones.call_count, 1)
+
+    def test_extended(self):
+        impl, light = self._strip('d0:73:d5:00:00:b2', True)
+        light.set_zone_list(
+            1, [[1, 1, 1, 1], None, [0, 0, 0, 0], [2, 2, 2, 2]], 0)
+        impl.set_zone_color.assert_not_called()
+        impl.extended_set_zone_color.assert_called_once_with(
+            [[1, 1, 1, 1], [0, 0, 0, 0], [0, 0, 0, 0], [2, 2, 2, 2]],
+            1, 0, True, 1)
+        impl.extended_set_zone_color.reset_mock()
+        light.set_zone_colors(0, 8, [3, 3, 3, 3], 0)
+        impl.extended_set_zone_color.assert_called_once_with(
+            [[3, 3, 3, 3]] * 8, 0, 0, True, 1)
+        self.assertListEqual(light.get_zone_colors(), [[3, 3, 3, 3]] * 8)
+
+    def test_no_shadow(self):
+        settings.using({
+            'shadow_max_age': 0, 'delivery_mode': 'rapid'
+        }).configure()
+        delivery.configure()
+        impl, light = self._strip('d0:73:d5:00:00:b3', True)
+        light.set_zone_list(0, [[1, 1, 1, 1], None, [2, 2, 2, 2]], 0)
+        impl.get_color_zones.assert_not_called()
+        self.assertListEqual(impl.extended_set_zone_color.call_args_list, [
+            call([[1, 1, 1, 1]], 0, 0, True, 0),
+            call([[2, 2, 2, 2]], 2, 0, True, 1)
+        ])
+
+    @staticmethod
+    def _chain(mac, tiles):
+        shadow_state.for_device(hash(mac)).invalidate(MATRIX)
+        impl = MagicMock()
+        impl.get_mac_addr.return_value = mac
+        impl.mac_addr = mac
+        impl.source_id = 1234
+        impl.ip_addr = '10.0.0.2'
+        impl.port = 56700
+        chain = MagicMock()
+        chain.start_index = 0
+        chain.total_count = len(tiles)
+        chain.tile_devices = [
+            {'width': width, 'height': height} for width, height in tiles
+        ] + [{'width': 0, 'height': 0}] * (16 - len(tiles))
+        impl.req_with_resp.return_value = chain
+        return impl, lifx_lan_light.MatrixLight(impl)
+
+    def setUp_socket(self):
+        self._socket = MagicMock()
+        patcher = patch.object(
+            tile_packet, '_get_socket', return_value=self._socket)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        # The packet buffer is reused, so keep a copy of each one sent.
+        self._packets = []
+        self._socket.sendto.side_effect = (
+            lambda message, _: self._packets.append(bytes(message)))
+
+    def _sent(self):
+        return [(packet[36], packet[37], packet[40])
+                for packet in self._packets]
+
+    @staticmethod
+    def _sent_acked(impl):
+        # (tile_index, length) of each SetTileState64 sent with an ack.
+        return [(args[0][1]['tile_index'], args[0][1]['length'])
+                for args in impl.req_with_ack.call_args_list]
+
+    def _pixel(self, packet_index, pixel):
+        return list(struct.unpack_from(
+            '<4H', self._packets[packet_index], 46 + pixel * 8))
+
+    def test_packet(self):
+        colors = [(i, 2 * i, 3 * i, 4 * i) for i in range(0, 64)]
+        expected = SetTileState64(
+            'd0:73:d5:01:02:03', 1234, 0, {
+                'tile_index': 2, 'length': 3, 'reserved': 0, 'x': 0,
+                'y': 4, 'width': 8, 'duration': 500, 'colors': colors
+            }).packed_message
+        packet = tile_packet.TilePacket('d0:73:d5:01:02:03', 1234)
+        for i, color in enumerate(colors):
+            struct.pack_into('<4H', packet.colors, i * 8, *color)
+        packet.set_fields(2, 3, 4, 8, 500)
+        # lifxlan sends this message tagged, to every device; the packet is
+        # addressed to the one light.
+        message = bytes(packet.message)
+        self.assertEqual(message[36:], expected[36:])
+        self.assertEqual(message[0:2], expected[0:2])
+        self.assertEqual(message[3] & 0x20, 0)
+        self.assertEqual(
+            message[8:16], bytes.fromhex('d073d5010203') + bytes(2))
+        self.assertEqual(message[16:], expected[16:])
+
+    def test_chain(self):
+        self.setUp_socket()
+        impl, light = self._chain('d0:73:d5:00:00:b4', [(8, 8)] * 3)
+        self.assertEqual(light.get_height(), 8)
+        self.assertEqual(light.get_width(), 24)
+        self.assertListEqual(light.get_record()['tiles'], [[8, 8]] * 3)
+
+        mat = ColorMatrix.new_from_constant(8, 24, [1, 2, 3, 4])
+        light.set_matrix(mat)
+        self.assertListEqual(self._sent(), [(0, 3, 0)])
+
+        # Rapid writes aren't acknowledged, so every tile is sent each time.
+        self._packets.clear()
+        colors = mat.get_colors()
+        colors[2 * 24 + 10] = [5, 6, 7, 8]
+        mat = ColorMatrix.new_from_iterable(8, 24, colors)
+        light.set_matrix(mat)
+        self.assertListEqual(self._sent(), [(0, 1, 0), (1, 1, 0), (2, 1, 0)])
+        self.assertEqual(len(self._packets[1]), tile_packet.SIZE)
+        self.assertListEqual(self._pixel(1, 2 * 8 + 2), [5, 6, 7, 8])
+        self.assertListEqual(self._pixel(1, 2 * 8 + 3), [1, 2, 3, 4])
+        impl.fire_and_forget.assert_not_called()
+        self.assertListEqual(light.get_matrix().get_colors(), mat.get_colors())
+
+    def test_chain_acked(self):
+        # Only the tiles that changed since the last acknowledged write are
+        # sent.
+        settings.using({
+            'shadow_max_age': 10, 'delivery_mode': 'acked'
+        }).configure()
+        delivery.configure()
+        impl, light = self._chain('d0:73:d5:00:00:b9', [(8, 8)] * 3)
+        mat = ColorMatrix.new_from_constant(8, 24, [1, 2, 3, 4])
+        light.set_matrix(mat)
+        self.assertListEqual(self._sent_acked(impl), [(0, 3)])
+
+        impl.req_with_ack.reset_mock()
+        colors = mat.get_colors()
+        colors[2 * 24 + 10] = [5, 6, 7, 8]
+        mat = ColorMatrix.new_from_iterable(8, 24, colors)
+        light.set_matrix(mat)
+        self.assertListEqual(self._sent_acked(impl), [(1, 1)])
+
+        impl.req_with_ack.reset_mock()
+        light.set_matrix(mat)
+        impl.req_with_ack.assert_not_called()
+        self.assertListEqual(light.get_matrix().get_colors(), mat.get_colors())
+
+    def test_color_then_matrix(self):
+        # Setting the whole light to one color leaves a frame of that color
+        # in the shadow, which later matrix calls still work with.
+        settings.using({
+            'shadow_max_age': 10, 'delivery_mode': 'acked'
+        }).configure()
+        delivery.configure()
+        impl, light = self._chain('d0:73:d5:00:00:b7', [(8, 8)] * 2)
+        light.set_matrix(ColorMatrix.new_from_constant(8, 16, [1, 2, 3, 4]))
+        light.set_color([5, 6, 7, 8], 0)
+        self.assertListEqual(
+            light.get_matrix().get_colors(), [[5, 6, 7, 8]] * 128)
+
+        impl.req_with_ack.reset_mock()
+        light.set_matrix(ColorMatrix.new_from_constant(8, 16, [5, 6, 7, 8]))
+        impl.req_with_ack.assert_not_called()
+        light.set_matrix(ColorMatrix.new_from_constant(8, 16, [1, 2, 3, 4]))
+        self.assertListEqual(self._sent_acked(impl), [(0, 2)])
+
+    def test_queued(self):
+        # Through an output queue, the frame is packed by the queue and sent
+        # from its buffer.
+        self.setUp_socket()
+        _, light = self._chain('d0:73:d5:00:00:ba', [(8, 8)] * 2)
+        queued = output_queue.queued(light, 1000)
+        queued.set_matrix(ColorMatrix.new_from_constant(8, 16, [1, 2, 3, 4]))
+        queued.flush()
+        self.assertListEqual(self._sent(), [(0, 2, 0)])
+        self.assertListEqual(self._pixel(0, 63), [1, 2, 3, 4])
+
+        self._packets.clear()
+        light.set_frame(bytearray(8), 0)
+        self.assertListEqual(self._packets, [])
+
+    def test_large_tile(self):
+        self.setUp_socket()
+        _, light = self._chain('d0:73:d5:00:00:b5', [(16, 8)])
+        light.set_matrix(ColorMatrix.new_from_constant(8, 16, [1, 2, 3, 4]))
+        self.assertListEqual(self._sent(), [(0, 1, 0), (0, 1, 4)])
+
+    def test_acked(self):
+        settings.using({
+            'shadow_max_age': 10, 'delivery_mode': 'acked'
+        }).configure()
+        delivery.configure()
+        impl, light = self._chain('d0:73:d5:00:00:b6', [(5, 6)])
+        light.set_matrix(ColorMatrix.new_from_constant(6, 5, [1, 2, 3, 4]))
+        payload = impl.req_with_ack.call_args[0][1]
+        self.assertEqual(payload['width'], 5)
+        self.assertListEqual(payload['colors'], [(1, 2, 3, 4)] * 30)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,10 +1,40 @@
 #!/usr/bin/env python
 
+import threading
 import unittest
 
-from bardolph.controller import light_set
+from bardolph.controller import i_controller, light_set
 from bardolph.fakes import fake_light_api
 from bardolph.lib import injection, settings
+from bardolph.lib.injection import bind_instance, provide
+
+
+class _GatedLightApi:
+    # Delivers the first light right away, and the rest after release().
+    def __init__(self, light_api):
+        self._lights = light_api.get_lights()
+        self._gate = threading.Event()
+
+    def get_lights(self):
+        yield self._lights[0]
+        self._gate.wait()
+        yield from self._lights[1:]
+
+    def release(self):
+        self._gate.set()
+
+
+class _CachedLightApi:
+    # Remembers a light that discovery doesn't find any more.
+    def __init__(self, light_api, stale_light):
+        self._light_api = light_api
+        self._stale_light = stale_light
+
+    def get_cached_lights(self):
+        return self._light_api.get_lights()[:2] + [self._stale_light]
+
+    def get_lights(self):
+        return self._light_api.get_lights()
 
 
 class LightSetTest(unittest.TestCase):
@@ -116,6 +146,49 @@ class LightSetTest(unittest.TestCase):
         names = tested_set.get_location_lights(self._loc1)
         self._assert_names_match(names, self._light1, self._light3)
 
+    def test_background_discover(self):
+        gated_api = _GatedLightApi(provide(i_controller.LightApi))
+        bind_instance(gated_api).to(i_controller.LightApi)
+        tested_set = light_set.LightSet()
+        tested_set.discover_in_background()
+
+        # The first light is available before discovery has finished.
+        light = tested_set.get_light(self._light0)
+        self.assertIsNotNone(light)
+        self.assertEqual(light.get_name(), self._light0)
+
+        threading.Timer(0.05, gated_api.release).start()
+        lights = tested_set.get_group_lights(self._group1)
+        self._assert_names_match(lights, self._light2, self._light3)
+        self.assertEqual(tested_set.get_light_count(), 4)
+        self.assertIsNone(tested_set.get_light('no such light'))
+
+    def test_inventory(self):
+        fake_light_api.using([('Stale', 'Group 9', 'Location 9')]).configure()
+        stale_light = provide(i_controller.LightApi).get_lights()[0]
+        fake_light_api.using([
+            (self._light0, self._group0, self._loc0),
+            (self._light1, self._group0, self._loc1),
+            (self._light2, self._group1, self._loc0),
+            (self._light3, self._group1, self._loc1)
+        ]).configure()
+        cached_api = _CachedLightApi(
+            provide(i_controller.LightApi), stale_light)
+        bind_instance(cached_api).to(i_controller.LightApi)
+
+        tested_set = light_set.LightSet()
+        self.assertEqual(tested_set.load_inventory(), 3)
+        self.assertIsNotNone(tested_set.get_light('Stale'))
+        self.assertIsNone(tested_set.get_light(self._light3))
+        self.assertEqual(len(tested_set.get_group_names()), 2)
+
+        tested_set.discover()
+        self.assertIsNone(tested_set.get_light('Stale'))
+        self.assertIsNotNone(tested_set.get_light(self._light3))
+        self.assertEqual(len(tested_set.get_light_names()), 4)
+        self.assertIsNone(tested_set.get_group_lights('Group 9'))
+        self.assertIsNone(tested_set.get_location_lights('Location 9'))
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -420,6 +420,12 @@ class LoopTest(unittest.TestCase):
             [(Action.SET_COLOR, [500, 600, 700, 800], 900)])
         self._runner.check_no_others('light_0', 'light_1')
 
+    def test_table_dispatch(self):
+        # Same as test_nested_break, without pre-decoding the program.
+        test_module.configure(True, {'vm_predecode': False})
+        self._runner = ScriptRunner(self)
+        self.test_nested_break()
+
     def test_bad_break(self):
         script = "hue 5 saturation 6 break set all"
         parser = Parser()
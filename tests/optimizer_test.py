@@ -2,9 +2,38 @@
 
 import unittest
 
-from bardolph.controller import ls_asm
-from bardolph.parser.optimizer import Optimizer
-from bardolph.vm.vm_codes import JumpCondition, OpCode, Operand, Register
+from bardolph.controller import i_controller, ls_asm
+from bardolph.controller.units import UnitMode
+from bardolph.lib.i_lib import Settings
+from bardolph.lib.injection import provide
+from bardolph.parser.optimizer import Optimizer, pass_names
+from bardolph.vm.vm_codes import (JumpCondition, OpCode, Operand, Operator,
+                                  Register)
+from tests import test_module
+from tests.script_runner import ScriptRunner
+
+_SCRIPT = """
+    units raw
+    hue {100 * 2 + 1} saturation 5 saturation 6 kelvin 2700 duration 0
+    define show with the_light the_brightness begin
+        units raw
+        brightness {the_brightness * 2}
+        if {1 > 2} begin
+            hue 0
+        end
+        set the_light
+    end
+    repeat 3 with brt from 10 to 30 begin
+        show "Top" brt
+        show "Bottom" {brt + 1}
+    end
+    repeat 2 with the_hue cycle begin
+        hue the_hue
+        set all
+    end
+    units logical
+    hue 180 set "Middle"
+"""
 
 
 class OptimizerTest(unittest.TestCase):
@@ -60,6 +89,197 @@ class OptimizerTest(unittest.TestCase):
         optimized_list = Optimizer().optimize(ls_asm.assemble(raw_assembly))
         self.assertListEqual(expected_list, optimized_list)
 
+    def test_original_unchanged(self):
+        raw_assembly = (
+            OpCode.JUMP, JumpCondition.ALWAYS, 3,
+            OpCode.PUSHQ, 1,
+            OpCode.POP, Register.RESULT,
+            OpCode.POWER,
+            OpCode.WAIT
+        )
+        program = ls_asm.assemble(raw_assembly)
+        original = [(inst.op_code, inst.param0, inst.param1)
+                    for inst in program]
+        optimized = Optimizer().optimize(program)
+        self.assertListEqual(Optimizer().optimize(program), optimized)
+        self.assertListEqual(
+            original,
+            [(inst.op_code, inst.param0, inst.param1) for inst in program])
+
+        # Instructions that didn't change are shared.
+        self.assertIs(optimized[2], program[3])
+
+    def _check(self, passes, raw_assembly, expected_assembly):
+        program = ls_asm.assemble(raw_assembly)
+        self.assertListEqual(
+            ls_asm.assemble(expected_assembly),
+            Optimizer(passes).optimize(program))
+
+    def test_constant_fold(self):
+        self._check(
+            'constant_fold', (
+                OpCode.PUSHQ, 5,
+                OpCode.PUSHQ, 2,
+                OpCode.OP, Operator.MUL,
+                OpCode.PUSHQ, 1,
+                OpCode.OP, Operator.ADD,
+                OpCode.OP, Operator.USUB,
+                OpCode.POP, Register.HUE,
+                OpCode.PUSHQ, 1,
+                OpCode.PUSHQ, 0,
+                OpCode.OP, Operator.DIV,
+                OpCode.POP, Register.HUE
+            ), (
+                OpCode.PUSHQ, -11,
+                OpCode.POP, Register.HUE,
+                OpCode.PUSHQ, 1,
+                OpCode.PUSHQ, 0,
+                OpCode.OP, Operator.DIV,
+                OpCode.POP, Register.HUE
+            ))
+
+    def test_fold_target(self):
+        # The operator can't be folded when a jump goes to its operand.
+        raw_assembly = (
+            OpCode.PUSHQ, 1,
+            OpCode.JUMP, JumpCondition.ALWAYS, 1,
+            OpCode.PUSHQ, 2,
+            OpCode.OP, Operator.ADD,
+            OpCode.POP, "x"
+        )
+        self._check('constant_fold', raw_assembly, raw_assembly)
+
+    def test_dead_code(self):
+        self._check(
+            'dead_code', (
+                OpCode.PUSHQ, False,
+                OpCode.JUMP, JumpCondition.IF_FALSE, 3,
+                OpCode.MOVEQ, 1, Register.HUE,
+                OpCode.STOP,
+                OpCode.MOVEQ, 2, Register.HUE,
+                OpCode.JUMP, JumpCondition.ALWAYS, 1,
+                OpCode.COLOR,
+                OpCode.STOP,
+                OpCode.COLOR
+            ), (
+                OpCode.MOVEQ, False, Register.RESULT,
+                OpCode.MOVEQ, 2, Register.HUE,
+                OpCode.COLOR,
+                OpCode.STOP
+            ))
+
+    def test_jump_thread(self):
+        self._check(
+            'jump_thread', (
+                OpCode.PUSH, "x",
+                OpCode.JUMP, JumpCondition.IF_TRUE, 3,
+                OpCode.COLOR,
+                OpCode.STOP,
+                OpCode.JUMP, JumpCondition.ALWAYS, 2,
+                OpCode.POWER,
+                OpCode.WAIT
+            ), (
+                OpCode.PUSH, "x",
+                OpCode.JUMP, JumpCondition.IF_TRUE, 5,
+                OpCode.COLOR,
+                OpCode.STOP,
+                OpCode.JUMP, JumpCondition.ALWAYS, 2,
+                OpCode.POWER,
+                OpCode.WAIT
+            ))
+
+    def test_redundant_store(self):
+        self._check(
+            'redundant_store', (
+                OpCode.MOVEQ, 1, Register.HUE,
+                OpCode.MOVEQ, "Top", Register.NAME,
+                OpCode.MOVEQ, 2, Register.HUE,
+                OpCode.MOVE, Register.SATURATION, Register.SATURATION,
+                OpCode.COLOR,
+                OpCode.MOVEQ, "Top", Register.NAME,
+                OpCode.MOVEQ, 2, Register.HUE,
+                OpCode.MOVEQ, 2.0, Register.HUE,
+                OpCode.COLOR
+            ), (
+                OpCode.MOVEQ, "Top", Register.NAME,
+                OpCode.MOVEQ, 2, Register.HUE,
+                OpCode.COLOR,
+                OpCode.MOVEQ, 2.0, Register.HUE,
+                OpCode.COLOR
+            ))
+
+    def test_store_read(self):
+        # Stores that are read, or that may be read after a jump, remain.
+        raw_assembly = (
+            OpCode.MOVEQ, 1, Register.HUE,
+            OpCode.PUSH, Register.HUE,
+            OpCode.MOVEQ, 2, Register.HUE,
+            OpCode.PUSH, "x",
+            OpCode.JUMP, JumpCondition.IF_FALSE, 2,
+            OpCode.MOVEQ, 3, Register.HUE,
+            OpCode.COLOR
+        )
+        self._check('redundant_store', raw_assembly, raw_assembly)
+
+    def test_unit_fold(self):
+        self._check(
+            'unit_fold', (
+                OpCode.MOVEQ, UnitMode.RAW, Register.UNIT_MODE,
+                OpCode.PUSH, "x",
+                OpCode.JUMP, JumpCondition.IF_FALSE, 3,
+                OpCode.MOVEQ, UnitMode.RAW, Register.UNIT_MODE,
+                OpCode.JSR, "f",
+                OpCode.MOVEQ, UnitMode.RAW, Register.UNIT_MODE,
+                OpCode.STOP,
+                OpCode.ROUTINE, "f",
+                OpCode.MOVEQ, UnitMode.RAW, Register.UNIT_MODE,
+                OpCode.MOVEQ, UnitMode.LOGICAL, Register.UNIT_MODE,
+                OpCode.END, "f"
+            ), (
+                OpCode.MOVEQ, UnitMode.RAW, Register.UNIT_MODE,
+                OpCode.PUSH, "x",
+                OpCode.JUMP, JumpCondition.IF_FALSE, 2,
+                OpCode.JSR, "f",
+                OpCode.MOVEQ, UnitMode.RAW, Register.UNIT_MODE,
+                OpCode.STOP,
+                OpCode.ROUTINE, "f",
+                OpCode.MOVEQ, UnitMode.LOGICAL, Register.UNIT_MODE,
+                OpCode.END, "f"
+            ))
+
+    def test_pass_names(self):
+        self.assertTupleEqual(pass_names(None), ('push_pop', ))
+        self.assertTupleEqual(pass_names('none'), ())
+        self.assertTupleEqual(
+            pass_names('dead_code, push_pop'), ('dead_code', 'push_pop'))
+        self.assertEqual(len(pass_names('all')), 6)
+
+    def test_harness(self):
+        # End-to-end tests run scripts with the passes that users get.
+        test_module.configure()
+        self.assertTupleEqual(
+            pass_names(provide(Settings).get_value('optimizer_passes')),
+            pass_names('all'))
+
+    def _run(self, passes):
+        test_module.configure(False, {'optimizer_passes': passes})
+        runner = ScriptRunner(self)
+        runner.run_script(_SCRIPT)
+        light_api = provide(i_controller.LightApi)
+        calls = {'all': light_api.get_call_list()}
+        for light in light_api.get_lights():
+            calls[light.get_name()] = light.get_call_list()
+        return calls
+
+    def test_same_results(self):
+        # The script does the same thing with and without the optimizer.
+        expected = self._run('none')
+        self.assertEqual(len(expected['Top']), 3)
+        self.assertEqual(len(expected['all']), 2)
+        self.assertDictEqual(self._run('all'), expected)
+        for name in pass_names('all'):
+            self.assertDictEqual(self._run(name), expected, name)
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,182 @@
+#!/usr/bin/env python
+
+import time
+import unittest
+
+from bardolph.controller import i_controller, light_set, output_queue
+from bardolph.controller.color_matrix import ColorMatrix
+from bardolph.fakes import fake_light, fake_light_api
+from bardolph.fakes.activity_monitor import Action
+from bardolph.lib import injection, settings
+from bardolph.lib.injection import provide
+
+
+class _FrameLight(fake_light.MatrixLight):
+    # Takes packed frames, as lifx_lan_light.MatrixLight does.
+    def __init__(self, *args):
+        super().__init__(*args)
+        self.frames = []
+        self.num_buffers = 0
+
+    def new_frame(self):
+        self.num_buffers += 1
+        return bytearray(self.get_height() * self.get_width() * 8)
+
+    def pack_frame(self, matrix, frame):
+        matrix.pack_into(frame, 0, 0, 0, matrix.height, matrix.width)
+
+    def set_frame(self, frame, duration=0):
+        self.frames.append((bytes(frame), duration))
+
+
+class OutputQueueTest(unittest.TestCase):
+    def setUp(self):
+        self._light = fake_light.Light('Top', 'Pole', 'Home')
+        # One write every 0.1 seconds.
+        self._queued = output_queue.queued(self._light, 10)
+
+    def _wait(self, seconds=0.3):
+        time.sleep(seconds)
+
+    def test_immediate(self):
+        self._queued.set_color([1, 2, 3, 4], 5)
+        self.assertListEqual(
+            self._light.get_call_list(),
+            [(Action.SET_COLOR, [1, 2, 3, 4], 5)])
+
+    def test_last_writer_wins(self):
+        for hue in range(0, 10):
+            self._queued.set_color([hue, 2, 3, 4], 0)
+        self._queued.set_power(1, 0)
+        self._queued.set_power(0, 0)
+        self._wait()
+        self.assertListEqual(self._light.get_call_list(), [
+            (Action.SET_COLOR, [0, 2, 3, 4], 0),
+            (Action.SET_COLOR, [9, 2, 3, 4], 0),
+            (Action.SET_POWER, 0, 0)
+        ])
+
+    def test_rate(self):
+        start_time = time.monotonic()
+        self._queued.set_power(1, 0)
+        self._queued.set_color([1, 2, 3, 4], 0)
+        self._queued.get_color()
+        # The read sends the pending write right away.
+        self.assertLess(time.monotonic() - start_time, 0.05)
+        self._queued.set_color([5, 6, 7, 8], 0)
+        self._wait(0.05)
+        self.assertEqual(len(self._light.get_call_list()), 3)
+        self._wait(0.1)
+        self.assertListEqual(self._light.get_call_list(), [
+            (Action.SET_POWER, 1, 0),
+            (Action.SET_COLOR, [1, 2, 3, 4], 0),
+            (Action.GET_COLOR, [1, 2, 3, 4]),
+            (Action.SET_COLOR, [5, 6, 7, 8], 0)
+        ])
+
+    def test_duplicate(self):
+        self._queued.set_color([1, 2, 3, 4], 0)
+        self._queued.set_color([1, 2, 3, 4], 0)
+        self._wait()
+        self.assertListEqual(
+            self._light.get_call_list(),
+            [(Action.SET_COLOR, [1, 2, 3, 4], 0)])
+
+    def test_zones(self):
+        light = fake_light.MultizoneLight('Strip', 'Pole', 'Home')
+        queued = output_queue.queued(light, 10)
+        self.assertIsInstance(queued, i_controller.MultizoneLight)
+        queued.set_power(1, 0)
+        queued.set_zone_colors(0, 4, [1, 2, 3, 4], 0)
+        queued.set_zone_colors(4, 8, [5, 6, 7, 8], 0)
+        queued.set_zone_colors(0, 4, [9, 9, 9, 9], 0)
+        self._wait(0.4)
+        # The pending zone writes are merged into one.
+        self.assertListEqual(light.get_call_list(), [
+            (Action.SET_POWER, 1, 0),
+            (Action.SET_ZONE_COLOR, 0, 4, [9, 9, 9, 9], 0),
+            (Action.SET_ZONE_COLOR, 4, 8, [5, 6, 7, 8], 0)
+        ])
+
+    def test_zone_by_zone(self):
+        light = fake_light.MultizoneLight('Strip', 'Pole', 'Home')
+        queued = output_queue.queued(light, 10)
+        for zone in range(0, 16):
+            queued.set_zone_colors(zone, zone + 1, [zone // 8, 2, 3, 4], 0)
+        self._wait()
+        # The first write goes out right away, and the rest are merged.
+        self.assertListEqual(light.get_call_list(), [
+            (Action.SET_ZONE_COLOR, 0, 1, [0, 2, 3, 4], 0),
+            (Action.SET_ZONE_COLOR, 1, 8, [0, 2, 3, 4], 0),
+            (Action.SET_ZONE_COLOR, 8, 16, [1, 2, 3, 4], 0)
+        ])
+
+    def test_matrix_copy(self):
+        light = fake_light.MatrixLight('Candle', 'Pole', 'Home', 2, 2)
+        queued = output_queue.queued(light, 10)
+        self.assertIsInstance(queued, i_controller.MatrixLight)
+        queued.set_power(1, 0)
+        mat = ColorMatrix.new_from_constant(2, 2, [1, 2, 3, 4])
+        queued.set_matrix(mat, 0)
+        mat.set_from_constant([0, 0, 0, 0])
+        self._wait()
+        self.assertListEqual(
+            light.get_matrix().get_colors(), [[1, 2, 3, 4]] * 4)
+
+    def test_matrix_frames(self):
+        light = _FrameLight('Candle', 'Pole', 'Home', 2, 2)
+        queued = output_queue.queued(light, 10)
+
+        def frame(color):
+            mat = ColorMatrix.new_from_constant(2, 2, color)
+            pixels = bytearray(32)
+            mat.pack_into(pixels, 0, 0, 0, 2, 2)
+            return bytes(pixels)
+
+        for hue in (1, 2, 3, 3):
+            queued.set_matrix(
+                ColorMatrix.new_from_constant(2, 2, [hue, 2, 3, 4]), 5)
+        self._wait()
+        # The first frame goes out right away, the second is replaced by the
+        # third, and the fourth is the same as the third.
+        self.assertListEqual(light.frames, [
+            (frame([1, 2, 3, 4]), 5), (frame([3, 2, 3, 4]), 5)])
+        for hue in range(0, 10):
+            queued.set_matrix(
+                ColorMatrix.new_from_constant(2, 2, [hue, 2, 3, 4]), 5)
+        self.assertEqual(light.num_buffers, 3)
+
+        # A matrix with None cells goes to set_matrix().
+        mat = ColorMatrix.new_from_iterable(
+            2, 2, [[7, 8, 9, 10], None, None, None])
+        queued.flush()
+        queued.set_matrix(mat, 0)
+        self._wait()
+        self.assertListEqual(
+            light.get_matrix().as_list(), [[7, 8, 9, 10], None, None, None])
+
+    def test_light_set(self):
+        injection.configure()
+        settings.using({
+            'max_write_rate': 10,
+            'single_light_discover': True,
+            'use_fakes': True
+        }).configure()
+        fake_light_api.configure()
+        light_set.configure()
+        lights = provide(i_controller.LightSet)
+        queued = lights.get_light('Top')
+        self.assertIsInstance(queued, output_queue.QueuedLight)
+        queued.set_power(1, 0)
+        queued.set_color([1, 2, 3, 4], 0)
+        lights.set_color_all_lights([5, 6, 7, 8], 0)
+        self._wait()
+        # The broadcast replaces the color that was waiting in the queue.
+        target = queued.get_target()
+        self.assertListEqual(
+            target.get_call_list(), [(Action.SET_POWER, 1, 0)])
+        self.assertTrue(target.was_set([5, 6, 7, 8]))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -48,6 +48,45 @@ class ParserTest(unittest.TestCase):
         self.assertIn('Attempt to assign to constant',
                       self.parser.get_errors())
 
+    def test_reuse(self):
+        self.assertTrue(self.parser.parse('hue 5 set all'))
+        program = self.parser.get_program()
+        self.assertTrue(self.parser.parse('hue 5 set all'))
+        self.assertListEqual(self.parser.get_program(), program)
+
+    def _check_incremental(self, input_string):
+        self.assertTrue(self.parser.parse(input_string), input_string)
+        parser = Parser(100)
+        for _ in range(2):
+            self.assertTrue(parser.parse(input_string), input_string)
+            self.assertListEqual(
+                parser.get_program(), self.parser.get_program(),
+                input_string)
+
+    def test_incremental(self):
+        script = """
+            define light "Top"
+            define set_one with the_hue begin
+                hue the_hue set light
+            end
+            assign x 5
+            set_one x
+        """
+        self._check_incremental(script)
+        self._check_incremental(script + ' set_one 10')
+        self._check_incremental(script.replace('assign x 5', 'assign x 6'))
+        self._check_incremental(script.replace('"Top"', '"Bottom"'))
+        self._check_incremental('hue 5 set all')
+        self._check_incremental('repeat 2 begin hue 5 set all end')
+
+    def test_incremental_errors(self):
+        parser = Parser(100)
+        self.assertTrue(parser.parse('define x 5 hue x set all'))
+        self.assertFalse(parser.parse('define x 5 assign x 6'))
+        self.assertIn('Attempt to assign to constant', parser.get_errors())
+        self.assertFalse(parser.parse('define y 5 hue x set all'))
+        self.assertIn('Unknown name', parser.get_errors())
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,129 @@
+#!/usr/bin/env python
+
+import time
+import unittest
+
+from bardolph.controller.process_pool import ProcessPool
+from bardolph.controller.script_job import ScriptJob
+from bardolph.fakes.activity_monitor import Action
+from bardolph.lib.injection import provide
+from bardolph.lib.job_control import JobControl
+from bardolph.vm.vm_codes import Register
+from tests import test_module
+from tests.script_runner import ScriptRunner
+
+_SCRIPT = """
+    units raw
+    define set_one with the_light the_hue begin
+        hue the_hue set the_light
+    end
+    saturation 2 brightness 3 kelvin 4 duration 5
+    set_one "Top" 10
+    get "Top"
+    set_one "Bottom" 20
+"""
+
+_FOREVER = """
+    assign x 0
+    repeat begin
+        assign x {x + 1}
+    end
+"""
+
+
+class ProcessPoolTest(unittest.TestCase):
+    def setUp(self):
+        test_module.configure(False, {
+            'process_pool': True,
+            'process_pool_size': 1
+        })
+
+    def tearDown(self):
+        provide(ProcessPool).close()
+
+    def wait_for_jobs(self, jobs):
+        max_wait = 100
+        while jobs.has_jobs():
+            time.sleep(0.1)
+            max_wait -= 1
+            if max_wait <= 0:
+                self.fail("jobs still running")
+
+    def test_run(self):
+        runner = ScriptRunner(self)
+        runner.run_script(_SCRIPT)
+        runner.check_call_list('Top', [
+            (Action.SET_COLOR, [10, 2, 3, 4], 5),
+            (Action.GET_COLOR, [10, 2, 3, 4])
+        ])
+        runner.check_call_list(
+            'Bottom', (Action.SET_COLOR, [20, 2, 3, 4], 5))
+        runner.assert_reg_equal(Register.HUE, 20)
+        pool = provide(ProcessPool)
+        worker = pool.acquire()
+        self.assertTrue(worker.is_alive())
+        pool.release(worker)
+
+    def test_reuse(self):
+        pool = provide(ProcessPool)
+        worker = pool.acquire()
+        pool.release(worker)
+        self.assertIs(pool.acquire(), worker)
+        pool.release(worker)
+
+    def test_stop(self):
+        jobs = JobControl()
+        jobs.spawn_job(ScriptJob.from_string(_FOREVER), 'forever')
+        time.sleep(0.5)
+        self.assertTrue(jobs.is_running('forever'))
+        self.assertTrue(jobs.stop_job('forever'))
+        self.wait_for_jobs(jobs)
+        self.assertFalse(jobs.is_running('forever'))
+
+    def test_waiting_job(self):
+        # With only one worker, the second job waits for it, and can be
+        # stopped while it's waiting.
+        jobs = JobControl()
+        jobs.spawn_job(ScriptJob.from_string(_FOREVER), 'first')
+        jobs.spawn_job(ScriptJob.from_string(_FOREVER), 'second')
+        time.sleep(0.5)
+        self.assertTrue(jobs.is_running('second'))
+        self.assertTrue(jobs.stop_job('second'))
+        time.sleep(0.2)
+        self.assertFalse(jobs.is_running('second'))
+        self.assertTrue(jobs.is_running('first'))
+        jobs.stop_background()
+        self.wait_for_jobs(jobs)
+
+    def test_profile(self):
+        # The profile comes back from the worker with the machine state.
+        test_module.configure(False, {
+            'process_pool': True,
+            'vm_profile': True
+        })
+        jobs = JobControl()
+        job = ScriptJob.from_string(_SCRIPT)
+        jobs.add_job(job)
+        self.wait_for_jobs(jobs)
+        profile = job.get_machine_state().profile
+        self.assertIsNotNone(profile)
+        self.assertEqual(profile.get_light_totals()['get_color'][0], 1)
+
+    def test_close(self):
+        pool = provide(ProcessPool)
+        worker = pool.acquire()
+        pool.release(worker)
+        pool.close()
+        self.assertFalse(worker.is_alive())
+
+    def test_disabled(self):
+        test_module.configure()
+        self.assertFalse(provide(ProcessPool).enabled)
+        runner = ScriptRunner(self)
+        runner.run_script(_SCRIPT)
+        runner.check_call_list(
+            'Bottom', (Action.SET_COLOR, [20, 2, 3, 4], 5))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,117 @@
+#!/usr/bin/env python
+
+import os
+import tempfile
+import unittest
+
+from bardolph.controller.program_cache import ProgramCache
+from bardolph.controller.script_job import ScriptJob
+from bardolph.fakes.activity_monitor import Action
+from bardolph.lib.injection import provide
+from bardolph.vm.loader import CompiledProgram
+from tests import test_module
+from tests.script_runner import ScriptRunner
+
+_SCRIPT = """
+    units raw
+    define set_one with the_light the_hue begin
+        hue the_hue set the_light
+    end
+    saturation 2 brightness 3 kelvin 4 duration 5
+    set_one "Top" 10
+    set_one "Bottom" 20
+"""
+
+
+class ProgramCacheTest(unittest.TestCase):
+    def setUp(self):
+        self._dir = tempfile.TemporaryDirectory()
+        self._configure()
+
+    def tearDown(self):
+        self._dir.cleanup()
+
+    def _configure(self, **overrides):
+        settings = {
+            'script_cache': True,
+            'script_cache_dir': self._dir.name
+        }
+        settings.update(overrides)
+        test_module.configure(False, settings)
+
+    def _check_calls(self):
+        runner = ScriptRunner(self)
+        runner.check_call_list('Top', (Action.SET_COLOR, [10, 2, 3, 4], 5))
+        runner.check_call_list(
+            'Bottom', (Action.SET_COLOR, [20, 2, 3, 4], 5))
+
+    def test_memory(self):
+        program = ScriptJob.from_string(_SCRIPT).program
+        self.assertIsInstance(program, CompiledProgram)
+        self.assertIs(ScriptJob.from_string(_SCRIPT).program, program)
+        self.assertIsNot(ScriptJob.from_string(_SCRIPT + ' ').program, program)
+
+    def test_run_twice(self):
+        ScriptJob.from_string(_SCRIPT)
+        for _ in range(2):
+            self._configure()
+            ScriptRunner(self).run_script(_SCRIPT)
+            self._check_calls()
+
+    def test_file(self):
+        program = ScriptJob.from_string(_SCRIPT).program
+        file_names = os.listdir(self._dir.name)
+        self.assertListEqual(file_names, [provide(ProgramCache).key(_SCRIPT) + '.lsc'])
+
+        # A new cache starts out empty, and finds the program in the file.
+        self._configure()
+        from_file = provide(ProgramCache).get(_SCRIPT)
+        self.assertIsNotNone(from_file)
+        self.assertIsNot(from_file, program)
+        self.assertListEqual(from_file.code, program.code)
+        self.assertListEqual(
+            sorted(from_file.routines), sorted(program.routines))
+        ScriptRunner(self).run_script(_SCRIPT)
+        self._check_calls()
+
+    def test_bad_file(self):
+        file_name = os.path.join(
+            self._dir.name, provide(ProgramCache).key(_SCRIPT) + '.lsc')
+        with open(file_name, 'wb') as dest:
+            dest.write(b'not a pickle')
+        self.assertIsNone(provide(ProgramCache).get(_SCRIPT))
+        self.assertIsInstance(
+            ScriptJob.from_string(_SCRIPT).program, CompiledProgram)
+
+    def test_key(self):
+        key = provide(ProgramCache).key(_SCRIPT)
+        self._configure(optimizer_passes='none')
+        self.assertNotEqual(provide(ProgramCache).key(_SCRIPT), key)
+        self._configure(optimizer_passes='all')
+        self.assertEqual(provide(ProgramCache).key(_SCRIPT), key)
+
+    def test_not_private(self):
+        # Another user could have written the file, so it isn't loaded.
+        ScriptJob.from_string(_SCRIPT)
+        os.chmod(self._dir.name, 0o777)
+        self._configure()
+        self.assertIsNone(provide(ProgramCache).get(_SCRIPT))
+        os.chmod(self._dir.name, 0o700)
+        self.assertIsNotNone(provide(ProgramCache).get(_SCRIPT))
+
+    def test_disabled(self):
+        self._configure(script_cache=False)
+        program = ScriptJob.from_string(_SCRIPT).program
+        self.assertIsInstance(program, list)
+        self.assertIsNone(provide(ProgramCache).get(_SCRIPT))
+        self.assertListEqual(os.listdir(self._dir.name), [])
+        ScriptRunner(self).run_script(_SCRIPT)
+        self._check_calls()
+
+    def test_compile_error(self):
+        self.assertIsNone(ScriptJob.from_string('hue 5 set "').program)
+        self.assertListEqual(os.listdir(self._dir.name), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
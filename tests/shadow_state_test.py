@@ -0,0 +1,177 @@
+#!/usr/bin/env python
+
+import time
+import unittest
+from unittest.mock import MagicMock
+
+from bardolph.controller import (delivery, i_controller, lifx_lan_light,
+                                 light_set, shadow_state)
+from bardolph.controller.shadow_state import COLOR, POWER, ZONES, ShadowState
+from bardolph.lib import injection, settings
+from bardolph.lib.injection import bind_instance
+
+
+class ShadowStateTest(unittest.TestCase):
+    def setUp(self):
+        injection.configure()
+
+    def test_get_put(self):
+        shadow = ShadowState()
+        self.assertIsNone(shadow.get(COLOR, 10))
+        color = [1, 2, 3, 4]
+        shadow.put(COLOR, color)
+        color[0] = 100
+        self.assertListEqual(shadow.get(COLOR, 10), [1, 2, 3, 4])
+        self.assertTrue(shadow.matches(COLOR, [1, 2, 3, 4], 10))
+        self.assertFalse(shadow.matches(COLOR, [1, 2, 3, 5], 10))
+        shadow.invalidate(COLOR)
+        self.assertIsNone(shadow.get(COLOR, 10))
+
+    def test_stale(self):
+        shadow = ShadowState()
+        shadow.put(POWER, 65535)
+        time.sleep(0.02)
+        self.assertIsNone(shadow.get(POWER, 0.01))
+        self.assertFalse(shadow.matches(POWER, 65535, 0.01))
+        self.assertEqual(shadow.get(POWER, 10), 65535)
+
+    def test_zones(self):
+        shadow = ShadowState()
+        shadow.put(ZONES, [[0, 0, 0, 0] for _ in range(0, 4)])
+        shadow.put_color([1, 1, 1, 1])
+        self.assertListEqual(shadow.get(ZONES, 10), [[1, 1, 1, 1]] * 4)
+        shadow.put_zones({1: [2, 2, 2, 2], 2: [3, 3, 3, 3], 5: [4, 4, 4, 4]})
+        self.assertIsNone(shadow.get(COLOR, 10))
+        self.assertListEqual(shadow.get(ZONES, 10), [
+            [1, 1, 1, 1], [2, 2, 2, 2], [3, 3, 3, 3], [1, 1, 1, 1]])
+
+    def test_unconfirmed(self):
+        shadow = ShadowState()
+        shadow.put(COLOR, [1, 2, 3, 4], False)
+        self.assertListEqual(shadow.get(COLOR, 10), [1, 2, 3, 4])
+        self.assertIsNone(shadow.get(COLOR, 10, True))
+        self.assertFalse(shadow.matches(COLOR, [1, 2, 3, 4], 10))
+
+        shadow.put(ZONES, [[0, 0, 0, 0] for _ in range(0, 4)])
+        shadow.put_zones({1: [2, 2, 2, 2]}, False)
+        self.assertIsNone(shadow.get(ZONES, 10, True))
+        shadow.put_zones({1: [3, 3, 3, 3]})
+        self.assertIsNone(shadow.get(ZONES, 10, True))
+
+    def test_invalidate_all(self):
+        first = shadow_state.for_device('shadow_c')
+        second = shadow_state.for_device('shadow_d')
+        first.put(COLOR, [1, 2, 3, 4])
+        second.put(COLOR, [1, 2, 3, 4])
+        second.put(POWER, 65535)
+        shadow_state.invalidate_all(COLOR)
+        self.assertIsNone(first.get(COLOR, 10))
+        self.assertIsNone(second.get(COLOR, 10))
+        self.assertEqual(second.get(POWER, 10), 65535)
+
+    def test_for_device(self):
+        self.assertIs(
+            shadow_state.for_device('shadow_a'),
+            shadow_state.for_device('shadow_a'))
+        self.assertIsNot(
+            shadow_state.for_device('shadow_a'),
+            shadow_state.for_device('shadow_b'))
+
+    @staticmethod
+    def _light(mac):
+        # Forget anything left from an earlier run of the same test.
+        shadow_state.for_device(hash(mac)).invalidate(COLOR, POWER)
+        impl = MagicMock()
+        impl.get_mac_addr.return_value = mac
+        impl.get_color.return_value = (1, 2, 3, 4)
+        impl.get_power.return_value = 65535
+        info = {
+            'label': 'Top', 'group': 'g', 'location': 'l',
+            'features': {'color': True}
+        }
+        return impl, lifx_lan_light.Light(impl, info)
+
+    def test_light(self):
+        settings.using({
+            'shadow_max_age': 10, 'delivery_mode': 'acked'
+        }).configure()
+        delivery.configure()
+        impl, light = self._light('d0:73:d5:00:00:a1')
+        self.assertListEqual(light.get_color(), [1, 2, 3, 4])
+        self.assertListEqual(light.get_color(), [1, 2, 3, 4])
+        self.assertEqual(impl.get_color.call_count, 1)
+
+        light.set_color([1, 2, 3, 4], 0)
+        impl.set_color.assert_not_called()
+        light.set_color([5, 6, 7, 8], 0)
+        light.set_color([5, 6, 7, 8], 0)
+        self.assertEqual(impl.set_color.call_count, 1)
+        self.assertListEqual(light.get_color(), [5, 6, 7, 8])
+        self.assertEqual(impl.get_color.call_count, 1)
+
+        self.assertEqual(light.get_power(), 65535)
+        light.set_power(65535, 0)
+        impl.set_power.assert_not_called()
+        light.set_power(0, 0)
+        self.assertEqual(impl.set_power.call_count, 1)
+        self.assertEqual(impl.get_power.call_count, 1)
+
+    def test_rapid(self):
+        # A write that isn't acknowledged might have been lost, so it doesn't
+        # suppress another write of the same value.
+        settings.using({
+            'shadow_max_age': 10, 'delivery_mode': 'rapid'
+        }).configure()
+        delivery.configure()
+        impl, light = self._light('d0:73:d5:00:00:a3')
+        light.get_color()
+        light.set_color([1, 2, 3, 4], 0)
+        impl.set_color.assert_not_called()
+        light.set_color([5, 6, 7, 8], 0)
+        light.set_color([5, 6, 7, 8], 0)
+        self.assertEqual(impl.set_color.call_count, 2)
+        self.assertListEqual(light.get_color(), [5, 6, 7, 8])
+        self.assertEqual(impl.get_color.call_count, 1)
+
+        light.set_power(0, 0)
+        light.set_power(0, 0)
+        self.assertEqual(impl.set_power.call_count, 2)
+
+    def test_broadcast(self):
+        # After a broadcast, the next write to a light isn't suppressed.
+        settings.using({
+            'shadow_max_age': 10, 'delivery_mode': 'acked'
+        }).configure()
+        delivery.configure()
+        bind_instance(MagicMock()).to(i_controller.LightApi)
+        impl, light = self._light('d0:73:d5:00:00:a4')
+        light.get_color()
+        light.get_power()
+        light.set_color([1, 2, 3, 4], 0)
+        impl.set_color.assert_not_called()
+        light_set.LightSet().set_color_all_lights([5, 6, 7, 8], 0)
+        light.set_color([1, 2, 3, 4], 0)
+        self.assertEqual(impl.set_color.call_count, 1)
+
+        light.set_power(65535, 0)
+        impl.set_power.assert_not_called()
+        light_set.LightSet().set_power_all_lights(False, 0)
+        light.set_power(65535, 0)
+        self.assertEqual(impl.set_power.call_count, 1)
+
+    def test_disabled(self):
+        settings.using({
+            'shadow_max_age': 0, 'delivery_mode': 'rapid'
+        }).configure()
+        delivery.configure()
+        impl, light = self._light('d0:73:d5:00:00:a2')
+        light.get_color()
+        light.get_color()
+        self.assertEqual(impl.get_color.call_count, 2)
+        light.set_color([1, 2, 3, 4], 0)
+        light.set_color([1, 2, 3, 4], 0)
+        self.assertEqual(impl.set_color.call_count, 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
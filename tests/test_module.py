@@ -1,20 +1,23 @@
 
 import logging
 
-from bardolph.controller import light_set
+from bardolph.controller import (config_values, light_set, process_pool,
+                                 program_cache)
 from bardolph.fakes import fake_clock, fake_light_api
 from bardolph.lib import (i_lib, injection, log_config, object_list_output,
                           settings, std_out_output)
 from bardolph.runtime import runtime_module
 
 
-def configure(small_set=False):
+def configure(small_set=False, overrides=None):
     injection.configure()
     settings.using({
         'log_level': logging.ERROR,
         'log_to_console': True,
+        # Scripts are optimized the same way as when they're run for real.
+        'optimizer_passes': config_values.functional['optimizer_passes'],
         'use_fakes': True
-    }).configure()
+    }).add_overrides(overrides or {}).configure()
     log_config.configure()
     fake_clock.configure()
     if small_set:
@@ -24,6 +27,8 @@ def configure(small_set=False):
     light_set.configure()
     std_out_output.configure()
     runtime_module.configure()
+    program_cache.configure()
+    process_pool.configure()
 
 
 def using_small_set():
@@ -3,8 +3,8 @@
 import unittest
 
 from bardolph.vm.instruction import Instruction
-from bardolph.vm.machine import Machine
-from bardolph.vm.vm_codes import OpCode, Operator
+from bardolph.vm.machine import Machine, Registers
+from bardolph.vm.vm_codes import OpCode, Operator, Register
 from tests import test_module
 
 
@@ -59,6 +59,21 @@ class VmMathTest(unittest.TestCase):
         for test_case in self._test_cases:
             self._eval_test(test_case[1], test_case[0])
 
+    def test_registers(self):
+        reg = Registers()
+        for register, value in ((Register.HUE, 120.0), (Register.PC, 7),
+                                (Register.UNIT_MODE, None)):
+            reg.set_by_enum(register, value)
+            self.assertEqual(reg.get_by_enum(register), value)
+        self.assertEqual(reg.hue, 120.0)
+        self.assertEqual(reg.pc, 7)
+        reg.reset()
+        self.assertEqual(reg.pc, 0)
+        with self.assertRaises(AttributeError):
+            reg.not_a_register = 0
+        with self.assertRaises(AttributeError):
+            Instruction(OpCode.NOP).not_a_field = 0
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,61 @@
+#!/usr/bin/env python
+
+import unittest
+
+from bardolph.controller.script_job import ScriptJob
+from bardolph.vm.vm_codes import OpCode
+from tests import test_module
+
+_SCRIPT = """
+    units raw
+    define brighten with the_light begin
+        brightness 1000 set the_light
+    end
+    hue 100 saturation 200 kelvin 2700 duration 0
+    repeat 3 begin
+        time 5
+        brighten "light_0"
+        brighten "light_1"
+    end
+    set all
+"""
+
+
+class VmProfileTest(unittest.TestCase):
+    def _run(self, overrides):
+        test_module.configure(True, overrides)
+        job = ScriptJob.from_string(_SCRIPT)
+        self.assertIsNotNone(job.program, job.compile_errors)
+        job.execute()
+        return job.get_machine_state().profile
+
+    def _check_profile(self, predecode):
+        profile = self._run({'vm_profile': True, 'vm_predecode': predecode})
+        self.assertIsNotNone(profile)
+        self.assertEqual(profile.op_codes[OpCode.JSR][0], 6)
+        self.assertEqual(profile.op_codes[OpCode.COLOR][0], 7)
+        self.assertEqual(profile.routines['brighten'][0], 6)
+        self.assertEqual(profile.clock['pause_for'][0], 7)
+        self.assertEqual(profile.lights[('light_0', 'set_color')][0], 3)
+        self.assertEqual(profile.lights[('light_1', 'set_color')][0], 3)
+        self.assertEqual(profile.lights[('all', 'set_color_all_lights')][0], 1)
+        self.assertEqual(profile.get_light_totals()['set_color'][0], 6)
+        self.assertGreater(profile.total_time, 0.0)
+
+        as_dict = profile.as_dict()
+        self.assertEqual(as_dict['op_codes']['JSR']['count'], 6)
+        self.assertEqual(as_dict['lights']['light_0.set_color']['count'], 3)
+        self.assertIn('brighten', profile.report())
+
+    def test_decoded(self):
+        self._check_profile(True)
+
+    def test_table(self):
+        self._check_profile(False)
+
+    def test_disabled(self):
+        self.assertIsNone(self._run({}))
+
+
+if __name__ == '__main__':
+    unittest.main()
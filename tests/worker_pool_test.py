@@ -0,0 +1,54 @@
+#!/usr/bin/env python
+
+import threading
+import time
+import unittest
+
+from bardolph.lib.worker_pool import WorkerPool
+
+
+class WorkerPoolTest(unittest.TestCase):
+    def test_submit(self):
+        pool = WorkerPool(4)
+        tasks = [pool.submit(lambda x: x * 2, i) for i in range(0, 10)]
+        for i, task in enumerate(tasks):
+            self.assertTrue(task.wait(1.0))
+            self.assertEqual(task.result, i * 2)
+            self.assertIsNone(task.exception)
+
+    def test_exception(self):
+        def fail():
+            raise ValueError('failed')
+        task = WorkerPool(1).submit(fail)
+        self.assertTrue(task.wait(1.0))
+        self.assertIsInstance(task.exception, ValueError)
+
+    def test_max_workers(self):
+        lock = threading.Lock()
+        threads = set()
+
+        def record(_):
+            time.sleep(0.05)
+            with lock:
+                threads.add(threading.current_thread().name)
+        pool = WorkerPool(3)
+        for _ in pool.imap_unordered(record, range(0, 9)):
+            pass
+        self.assertEqual(len(threads), 3)
+
+    def test_unordered(self):
+        pool = WorkerPool(3)
+        delays = (0.15, 0.0, 0.05)
+        results = [task.result for task in pool.imap_unordered(
+            lambda delay: time.sleep(delay) or delay, delays)]
+        self.assertListEqual(results, [0.0, 0.05, 0.15])
+
+    def test_idle(self):
+        pool = WorkerPool(2, idle_time=0.05)
+        pool.submit(lambda: None).wait()
+        time.sleep(0.2)
+        self.assertTrue(pool.submit(lambda: 5).wait(1.0))
+
+
+if __name__ == '__main__':
+    unittest.main()